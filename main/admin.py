@@ -156,4 +156,20 @@ class DBSubscriptionAdmin(admin.ModelAdmin):
     ]
     inlines = [
         TicketDBSubscriptionInline
-    ]
\ No newline at end of file
+    ]
+
+@admin.register(models.RedecodeCheckpoint)
+class RedecodeCheckpointAdmin(admin.ModelAdmin):
+    list_display = [
+        "job",
+        "model",
+        "processed",
+        "changed",
+        "failed",
+        "updated_at",
+        "finished_at",
+    ]
+    readonly_fields = [
+        "started_at",
+        "updated_at",
+    ]
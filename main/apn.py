@@ -1,9 +1,16 @@
+import logging
+import typing
 import niquests
 from django.conf import settings
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, QuerySet, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from . import models
 
+logger = logging.getLogger(__name__)
+
+
 def notify_device(device: "models.AppleDevice"):
     r = niquests.post(f"https://api.push.apple.com/3/device/{device.push_token}", headers={
         "apns-push-type": "alert",
@@ -21,19 +28,37 @@ def notify_ticket(ticket: "models.Ticket"):
         notify_device(registration.device)
 
 
-def notify_ticket_if_renewed(ticket: "models.Ticket"):
+def renew_tickets(tickets: "QuerySet[models.Ticket]") -> typing.List["models.Ticket"]:
+    # A ticket's current instance is its newest UIC one that's already valid, or failing that its newest valid VDV one,
+    # and it counts as renewed when that started after the ticket was last updated
     now = timezone.now()
-    current_ticket_valid_from = None
-    uic_tickets = ticket.uic_instances.filter(validity_start__lt=now)
-    if uic_tickets.count() != 0:
-        current_ticket_valid_from = uic_tickets[0].validity_start
-    else:
-        vdv_tickets = ticket.vdv_instances.filter(validity_start__lt=now)
-        if vdv_tickets.count() != 0:
-            current_ticket_valid_from = vdv_tickets[0].validity_start
-
-    if current_ticket_valid_from:
-        if current_ticket_valid_from > ticket.last_updated:
-            ticket.last_updated = now
-            ticket.save()
-            notify_ticket(ticket)
\ No newline at end of file
+    uic_valid_from = models.UICTicketInstance.objects.filter(ticket=OuterRef("pk"), validity_start__lt=now) \
+        .order_by("-issuing_time").values("validity_start")[:1]
+    vdv_valid_from = models.VDVTicketInstance.objects.filter(ticket=OuterRef("pk"), validity_start__lt=now) \
+        .order_by("-validity_start").values("validity_start")[:1]
+    # Another scheduler replica running at the same time skips the rows this one has locked, and once this commits
+    # they no longer count as renewed, so each renewal is only pushed once
+    with transaction.atomic():
+        renewed = list(
+            tickets.annotate(current_valid_from=Coalesce(Subquery(uic_valid_from), Subquery(vdv_valid_from)))
+            .filter(current_valid_from__gt=F("last_updated"))
+            .select_for_update(skip_locked=True, of=("self",))
+            .prefetch_related("apple_registrations__device")
+        )
+
+        if renewed:
+            models.Ticket.objects.filter(pk__in=[t.pk for t in renewed]).update(last_updated=now)
+            for t in renewed:
+                t.last_updated = now
+    return renewed
+
+
+def notify_renewed_tickets(tickets: "QuerySet[models.Ticket]") -> typing.List["models.Ticket"]:
+    renewed = renew_tickets(tickets)
+    for t in renewed:
+        for registration in t.apple_registrations.all():
+            try:
+                notify_device(registration.device)
+            except niquests.RequestException:
+                logger.exception("Failed to notify device of renewed ticket %s", t.pk)
+    return renewed
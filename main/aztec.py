@@ -1,41 +1,231 @@
-import json
+import dataclasses
+import logging
+import os
+import threading
+import time
+import typing
 import numpy as np
 import cv2
 from django.conf import settings
 
+from .ticket_formats import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Symbologies to try in the fast pass, by the kind of source an image comes from
+DECODER_HINTS = {
+    "aztec": ("Aztec", "AztecCompact"),
+    "qr": ("QR", "QRMicro"),
+    "pdf417": ("PDF417", "PDF417Micro"),
+}
+ALL_DECODERS = ("Aztec", "AztecCompact", "QR", "QRMicro", "PDF417", "PDF417Micro")
+PASSES = ("fast", "roi", "full")
+
+FAST_PASS_MAX_SIDE = 1600
+ROI_PADDING = 0.15
+# A candidate region covering most of the image is no better than the full image
+ROI_MAX_FRACTION = 0.7
+
 
 class AztecError(Exception):
     pass
 
 
-def decode(img_data: bytes):
+@dataclasses.dataclass
+class DecodeResult:
+    data: bytes
+    pass_name: str
+
+
+def make_config(speed: str, decoders: typing.Tuple[str, ...]):
     try:
         import Barkoder
     except ImportError:
         raise AztecError("Barkoder SDK not available")
 
     cfg_response = Barkoder.Config.InitializeWithLicenseKey(settings.BARKODER_LICENSE)
-    assert cfg_response.get_result() == Barkoder.ConfigResult.OK
+    if cfg_response.get_result() != Barkoder.ConfigResult.OK:
+        raise AztecError("Unable to initialise the Barkoder SDK")
     config = cfg_response.get_config()
 
-    config.decodingSpeed = Barkoder.DecodingSpeed.Slow
-    assert config.set_enabled_decoders([
-        Barkoder.DecoderType.Aztec,
-        Barkoder.DecoderType.AztecCompact,
-        Barkoder.DecoderType.QR,
-        Barkoder.DecoderType.QRMicro,
-        Barkoder.DecoderType.PDF417,
-        Barkoder.DecoderType.PDF417Micro,
-    ]).get_result() == Barkoder.ConfigResult.OK
+    config.decodingSpeed = getattr(Barkoder.DecodingSpeed, speed)
+    if config.set_enabled_decoders([
+        getattr(Barkoder.DecoderType, decoder) for decoder in decoders
+    ]).get_result() != Barkoder.ConfigResult.OK:
+        raise AztecError("Unable to enable the Barkoder decoders")
 
-    img = cv2.imdecode(np.asarray(bytearray(img_data), dtype="uint8"), cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        raise AztecError("Unable to read image")
+    return config
 
+
+def downscale(img: np.ndarray, max_side: int) -> typing.Tuple[np.ndarray, float]:
     height, width = img.shape[:2]
-    results = Barkoder.Barkoder.DecodeImageMemory(config, img, width, height)
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return img, 1
+    return cv2.resize(img, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA), scale
+
+
+def candidate_region(img: np.ndarray) -> typing.Optional[typing.Tuple[int, int, int, int]]:
+    # Barcodes are dense patches of strong edges, so take the largest blob of high gradient magnitude
+    grad_x = cv2.Sobel(img, cv2.CV_32F, 1, 0, ksize=3)
+    grad_y = cv2.Sobel(img, cv2.CV_32F, 0, 1, ksize=3)
+    magnitude = cv2.blur(cv2.convertScaleAbs(cv2.magnitude(grad_x, grad_y)), (9, 9))
+    _, mask = cv2.threshold(magnitude, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15)))
+    mask = cv2.dilate(cv2.erode(mask, None, iterations=3), None, iterations=3)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    return cv2.boundingRect(max(contours, key=cv2.contourArea))
+
+
+def crop_region(
+        img: np.ndarray, region: typing.Tuple[int, int, int, int], scale: float
+) -> typing.Optional[np.ndarray]:
+    height, width = img.shape[:2]
+    x, y, w, h = (round(v / scale) for v in region)
+    pad_x, pad_y = round(w * ROI_PADDING), round(h * ROI_PADDING)
+    x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+    x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+    if (x1 - x0) * (y1 - y0) > ROI_MAX_FRACTION * width * height:
+        return None
+    return img[y0:y1, x0:x1]
+
+
+class DecoderPool:
+    # Licence initialisation is slow, so each thread keeps its own configurations - the SDK makes no promises
+    # about sharing one between threads
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.initialisations = 0
+        self.decodes = 0
+        self.not_found = 0
+        self.failures = 0
+        self.image_decode = LatencyHistogram()
+        self.detection = LatencyHistogram()
+        self.pass_latency = {name: LatencyHistogram() for name in PASSES}
+        self.successes = {}
+
+    def config(self, speed: str = "Slow", decoders: typing.Tuple[str, ...] = ALL_DECODERS):
+        # A forked child can't use the configurations inherited from its parent
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.configs = {}
+            self._local.pid = os.getpid()
+
+        key = (speed, decoders)
+        if key not in self._local.configs:
+            self._local.configs[key] = make_config(speed, decoders)
+            with self._lock:
+                self.initialisations += 1
+        return self._local.configs[key]
+
+    def discard(self):
+        self._local.pid = None
+        self._local.configs = {}
+
+    def decode(self, img_data: bytes, hint: typing.Optional[str] = None) -> DecodeResult:
+        if not img_data:
+            raise AztecError("Unable to read image")
+        start = time.perf_counter()
+        img = cv2.imdecode(np.asarray(bytearray(img_data), dtype="uint8"), cv2.IMREAD_GRAYSCALE)
+        self.image_decode.observe(time.perf_counter() - start)
+        if img is None:
+            raise AztecError("Unable to read image")
+
+        return self.decode_array(img, hint)
+
+    def decode_array(self, img: np.ndarray, hint: typing.Optional[str] = None) -> DecodeResult:
+        fast_config = self.config("Fast", DECODER_HINTS.get(hint, ALL_DECODERS))
+        slow_config = self.config()
+        import Barkoder
+
+        def attempt(pass_name, config, image):
+            start = time.perf_counter()
+            results = self.detect(Barkoder, config, image)
+            self.pass_latency[pass_name].observe(time.perf_counter() - start)
+            if len(results) > 0:
+                self.record(hint, pass_name)
+                return DecodeResult(data=bytes(results[0].binaryData), pass_name=pass_name)
+
+        small, scale = downscale(img, FAST_PASS_MAX_SIDE)
+        if result := attempt("fast", fast_config, small):
+            return result
+
+        region = candidate_region(small)
+        cropped = crop_region(img, region, scale) if region else None
+        if cropped is not None and (result := attempt("roi", slow_config, np.ascontiguousarray(cropped))):
+            return result
+
+        if result := attempt("full", slow_config, img):
+            return result
+
+        self.record(hint, None)
+        raise AztecError("No barcodes found")
+
+    def detect(self, barkoder, config, img: np.ndarray):
+        height, width = img.shape[:2]
+        start = time.perf_counter()
+        try:
+            results = barkoder.Barkoder.DecodeImageMemory(config, img, width, height)
+        except Exception:
+            # Don't keep configurations around that may have been left in a bad state
+            self.discard()
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            self.detection.observe(time.perf_counter() - start)
+
+        with self._lock:
+            self.decodes += 1
+        return results
+
+    def record(self, hint: typing.Optional[str], pass_name: typing.Optional[str]):
+        with self._lock:
+            if not pass_name:
+                self.not_found += 1
+            counts = self.successes.setdefault(hint or "any", {name: 0 for name in (*PASSES, "none")})
+            counts[pass_name or "none"] += 1
+        logger.debug("Barcode decode with hint %s: %s", hint, pass_name or "not found")
+
+    def health_check(self) -> typing.Tuple[bool, typing.Optional[str]]:
+        try:
+            config = self.config()
+            import Barkoder
+
+            self.detect(Barkoder, config, np.full((64, 64), 255, dtype="uint8"))
+        except Exception as e:
+            logger.warning("Barkoder health check failed", exc_info=True)
+            return False, str(e)
+        return True, None
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "initialisations": self.initialisations,
+            "decodes": self.decodes,
+            "not_found": self.not_found,
+            "failures": self.failures,
+            "successes": self.successes,
+            "image_decode": self.image_decode.to_dict(),
+            "detection": self.detection.to_dict(),
+            "passes": {name: latency.to_dict() for name, latency in self.pass_latency.items()},
+        }
+
+
+DECODER_POOL = None
+
+
+def get_decoder_pool() -> DecoderPool:
+    global DECODER_POOL
+
+    if not DECODER_POOL:
+        DECODER_POOL = DecoderPool()
+
+    return DECODER_POOL
+
 
-    if len(results) > 0:
-        return bytes(results[0].binaryData)
-    else:
-        raise AztecError("No barcodes found")
\ No newline at end of file
+def decode(img_data: bytes, hint: typing.Optional[str] = None) -> bytes:
+    return get_decoder_pool().decode(img_data, hint).data
@@ -0,0 +1,96 @@
+import dataclasses
+import hashlib
+import logging
+import typing
+from django.utils import timezone
+
+from . import aztec, models, ticket, ticket_cache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class CacheStats:
+    images: int = 0
+    decodes_skipped: int = 0
+    unchanged: int = 0
+    failed: int = 0
+
+    def merge(self, other: "CacheStats"):
+        for field in dataclasses.fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+    def skip_ratio(self) -> float:
+        return self.unchanged / self.images if self.images else 0
+
+    def log(self, name: str):
+        logger.info(
+            "%s: %d barcode images, %d unchanged (%.0f%% skipped), %d decodes skipped, %d failed",
+            name, self.images, self.unchanged, self.skip_ratio() * 100, self.decodes_skipped, self.failed
+        )
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_current(
+        entry: typing.Optional["models.SubscriptionBarcode"], account: "models.Account",
+        links: typing.Dict[str, typing.Any]
+) -> bool:
+    # The last ingest only stands in for a new one if it left the ticket exactly as this one would
+    if not entry or not entry.ticket or entry.parser_version != ticket_cache.PARSER_VERSION:
+        return False
+    if entry.ticket.account_id != account.pk:
+        return False
+    return all(getattr(entry.ticket, f"{name}_id") == obj.pk for name, obj in links.items())
+
+
+def ingest_image(
+        img_data: bytes, account: "models.Account", links: typing.Dict[str, typing.Any], stats: CacheStats
+) -> "models.Ticket":
+    stats.images += 1
+    image_digest = digest(img_data)
+    entry = models.SubscriptionBarcode.objects.select_related("ticket").filter(image_digest=image_digest).first()
+    if is_current(entry, account, links):
+        stats.decodes_skipped += 1
+        stats.unchanged += 1
+        return entry.ticket
+
+    try:
+        if entry:
+            barcode_data = bytes(entry.barcode_data)
+            stats.decodes_skipped += 1
+        else:
+            barcode_data = aztec.decode(img_data, hint="aztec")
+
+        # The same barcode can come back re-rendered in a new image
+        barcode_digest = digest(barcode_data)
+        previous = models.SubscriptionBarcode.objects.select_related("ticket") \
+            .filter(barcode_digest=barcode_digest).order_by("-ingested_at").first()
+        if is_current(previous, account, links):
+            stats.unchanged += 1
+            ticket_obj = previous.ticket
+        else:
+            ticket_obj = ticket.update_from_subscription_barcode(barcode_data, account=account)
+            for name, obj in links.items():
+                setattr(ticket_obj, name, obj)
+            ticket_obj.save()
+    except (aztec.AztecError, ticket.TicketError):
+        stats.failed += 1
+        raise
+
+    models.SubscriptionBarcode.objects.update_or_create(image_digest=image_digest, defaults={
+        "barcode_digest": barcode_digest,
+        "barcode_data": barcode_data,
+        "ticket": ticket_obj,
+        "parser_version": ticket_cache.PARSER_VERSION,
+        "ingested_at": timezone.now(),
+    })
+    prune(ticket_obj, image_digest)
+    return ticket_obj
+
+
+def prune(ticket_obj: "models.Ticket", image_digest: str):
+    # Subscriptions only ever send the current image of a ticket, so the ones it replaced won't be seen again
+    models.SubscriptionBarcode.objects.filter(ticket=ticket_obj).exclude(image_digest=image_digest).delete()
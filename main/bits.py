@@ -0,0 +1,83 @@
+import functools
+import typing
+
+SIX_BIT_ASCII = bytes((i + 0x20) & 0xff for i in range(256))
+
+
+@functools.lru_cache(maxsize=None)
+def _spread_masks(bits: int, size: int) -> typing.List[typing.Tuple[int, int]]:
+    masks = []
+    group = size // 2
+    while group:
+        stride = 16 * group
+        repeat = ((1 << (stride * (size // (2 * group)))) - 1) // ((1 << stride) - 1)
+        masks.append((((1 << (bits * group)) - 1) * repeat, (8 - bits) * group))
+        group //= 2
+    return masks
+
+
+def unpack(x: int, count: int, bits: int) -> bytes:
+    # Widens count packed characters to one byte each by repeatedly moving the upper half of every group
+    # into place, so a string costs log2(count) big-int operations instead of one per character.
+    if not count:
+        return b""
+    size = 1 << (count - 1).bit_length()
+    for low, shift in _spread_masks(bits, size):
+        x = (x & low) | ((x & ~low) << shift)
+    return x.to_bytes(size, "big")[size - count:]
+
+
+class BitReader:
+    __slots__ = ("value", "length", "error")
+
+    def __init__(self, data: bytes, error: typing.Type[Exception] = ValueError):
+        self.value = int.from_bytes(data, "big")
+        self.length = len(data) * 8
+        self.error = error
+
+    @classmethod
+    def from_int(cls, value: int, length: int, error: typing.Type[Exception]) -> "BitReader":
+        reader = cls.__new__(cls)
+        reader.value = value
+        reader.length = length
+        reader.error = error
+        return reader
+
+    def __len__(self) -> int:
+        return self.length
+
+    def read_int(self, start: int, end: int) -> int:
+        if end > self.length:
+            raise self.error(f"Read of bits {start}:{end} past the end of {self.length} bits")
+        return (self.value >> (self.length - end)) & ((1 << (end - start)) - 1)
+
+    def read_bool(self, index: int) -> bool:
+        return bool(self.read_int(index, index + 1))
+
+    def read_bytes(self, start: int, end: int) -> bytes:
+        if (end - start) % 8:
+            raise self.error(f"Bits {start}:{end} are not a whole number of bytes")
+        return self.read_int(start, end).to_bytes((end - start) // 8, "big")
+
+    def read_string(self, start: int, end: int) -> str:
+        # Six bit characters start every six bits from start, the last one may run past end and is only cut
+        # short by the end of the data.
+        count = -(-(end - start) // 6)
+        if count and start + 6 * (count - 1) >= self.length:
+            raise self.error(f"Read of bits {start}:{end} past the end of {self.length} bits")
+        end = min(start + 6 * count, self.length)
+        count, partial = divmod(end - start, 6)
+        value = self.read_int(start, end)
+        out = unpack(value >> partial, count, 6)
+        if partial:
+            out += bytes([value & ((1 << partial) - 1)])
+        return out.translate(SIX_BIT_ASCII).decode("ascii").strip()
+
+    def __getitem__(self, index: slice) -> "BitReader":
+        start, stop, step = index.indices(self.length)
+        if step != 1:
+            raise self.error("Bit slices must be contiguous")
+        stop = max(start, stop)
+        return self.from_int(
+            (self.value >> (self.length - stop)) & ((1 << (stop - start)) - 1), stop - start, self.error
+        )
@@ -1,93 +1,218 @@
+import asyncio
 import base64
+import concurrent.futures
 import json
 import niquests
 import datetime
 import logging
+import random
+import time
+import typing
 import bs4
+from django.db import connection
 from django.utils import timezone
 
-from . import models, aztec, ticket, apn
+from . import models, aztec, ticket, barcode_cache
+from .ticket_formats import LatencyHistogram
 
 logger = logging.getLogger(__name__)
 
+REFRESH_URL = "https://dig-aboprod.noncd.db.de/aboticket/refreshmultiple"
+HEADERS = {
+    "X-User-Agent": "com.deutschebahn.abo.navigatorV2.modul"
+}
+BATCH_SIZE = 20
+CONCURRENCY = 4
+WORKERS = 4
+REQUEST_TIMEOUT = 60
+# Spreads subscriptions that all renew at the same moment over a few minutes
+REFRESH_JITTER = 300
+# A refreshDatum already in the past would otherwise make the subscription due again straight away
+MIN_REFRESH_INTERVAL = datetime.timedelta(minutes=10)
 
-def update_all():
-    now = timezone.now()
-    for abo in models.DBSubscription.objects.all():
-        if abo.refresh_at <= now:
-            update_abo_tickets(abo)
-        else:
-            logging.info(f"Not updating DB subscription {abo.device_token} - not due for refresh")
+RefreshResult = typing.Tuple[models.DBSubscription, typing.Optional[dict]]
 
-        if abo.pk:
-            for t in abo.tickets.all():
-                apn.notify_ticket_if_renewed(t)
 
+class BatchStats:
+    def __init__(self):
+        self.batches = 0
+        self.failed = 0
+        self.subscriptions = 0
+        self.latency = LatencyHistogram()
+        self.tickets = barcode_cache.CacheStats()
 
-def update_abo_tickets(abo: models.DBSubscription):
-    r = niquests.post("https://dig-aboprod.noncd.db.de/aboticket/refreshmultiple", json={
+    def log(self):
+        logger.info(
+            "Refreshed %d DB subscriptions in %d batches, %d failed (%.0f%%), mean batch latency %.2fs",
+            self.subscriptions, self.batches, self.failed, self.failed / self.batches * 100 if self.batches else 0,
+            self.latency.total / self.latency.count if self.latency.count else 0
+        )
+        self.tickets.log("DB subscriptions")
+
+
+def refresh_request(abos: typing.List[models.DBSubscription]) -> dict:
+    return {
         "aboTicketCheckRequestList": [{
             "deviceToken": abo.device_token,
-        }]
-    }, headers={
-        "X-User-Agent": "com.deutschebahn.abo.navigatorV2.modul"
-    })
+        } for abo in abos]
+    }
+
+
+def match_results(abos: typing.List[models.DBSubscription], data: typing.List[dict]) -> typing.List[RefreshResult]:
+    # Subscriptions left out of the response no longer exist
+    by_token = {entry["deviceToken"]: entry for entry in data if entry.get("deviceToken")}
+    if by_token:
+        return [(abo, by_token.get(abo.device_token)) for abo in abos]
+    elif len(abos) == 1:
+        return [(abos[0], data[0] if data else None)]
+    elif len(data) == len(abos):
+        return list(zip(abos, data))
+    else:
+        raise ValueError(f"Unable to match {len(data)} results to {len(abos)} subscriptions")
+
+
+def refresh_all(
+        abos: typing.List[models.DBSubscription], batch_size: int = BATCH_SIZE, concurrency: int = CONCURRENCY,
+        workers: int = WORKERS, stats: typing.Optional[BatchStats] = None
+) -> BatchStats:
+    stats = stats or BatchStats()
+    batches = [abos[i:i + batch_size] for i in range(0, len(abos), batch_size)]
+    if batches:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            asyncio.run(refresh_batches(batches, executor, concurrency, stats))
+    return stats
+
+
+async def refresh_batches(
+        batches: typing.List[typing.List[models.DBSubscription]], executor: concurrent.futures.Executor,
+        concurrency: int, stats: BatchStats
+):
+    # Fetching stays on the event loop and everything touching the database or the decoder on the pool, so decoding
+    # one batch overlaps with fetching the next
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    processing = []
+    async with niquests.AsyncSession(pool_connections=1, pool_maxsize=concurrency) as session:
+        for task in asyncio.as_completed([fetch_batch(session, semaphore, batch, stats) for batch in batches]):
+            if results := await task:
+                processing.append(loop.run_in_executor(executor, apply_results, results))
+
+        for batch_stats in await asyncio.gather(*processing):
+            stats.tickets.merge(batch_stats)
+
+
+async def fetch_batch(
+        session: niquests.AsyncSession, semaphore: asyncio.Semaphore, abos: typing.List[models.DBSubscription],
+        stats: BatchStats
+) -> typing.List[RefreshResult]:
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            r = await session.post(REFRESH_URL, json=refresh_request(abos), headers=HEADERS, timeout=REQUEST_TIMEOUT)
+            if r.status_code != 404:
+                r.raise_for_status()
+                results = match_results(abos, r.json())
+        except (niquests.RequestException, ValueError, KeyError) as e:
+            stats.batches += 1
+            stats.failed += 1
+            logger.error("Failed to refresh batch of %d DB subscriptions: %s", len(abos), e)
+            return []
+        finally:
+            stats.latency.observe(time.perf_counter() - start)
+
+    stats.batches += 1
+    logger.debug("Refreshed batch of %d DB subscriptions in %.2fs", len(abos), time.perf_counter() - start)
+    if r.status_code == 404:
+        if len(abos) == 1:
+            return [(abos[0], None)]
+        # A 404 doesn't say which token is gone, so ask for each on its own
+        logger.info("Batch of %d DB subscriptions not found, retrying individually", len(abos))
+        singles = await asyncio.gather(*(fetch_batch(session, semaphore, [abo], stats) for abo in abos))
+        return [result for single in singles for result in single]
+
+    stats.subscriptions += len(abos)
+    return results
+
+
+def apply_results(results: typing.List[RefreshResult]) -> barcode_cache.CacheStats:
+    stats = barcode_cache.CacheStats()
+    try:
+        for abo, result in results:
+            try:
+                apply_refresh(abo, result, stats)
+            except Exception:
+                logger.exception("Failed to update DB subscription %s", abo.device_token)
+    finally:
+        # Pool threads aren't request threads, so nothing else will close their connections
+        connection.close()
+    return stats
+
+
+def update_abo_tickets(abo: models.DBSubscription, stats: typing.Optional[barcode_cache.CacheStats] = None):
+    r = niquests.post(REFRESH_URL, json=refresh_request([abo]), headers=HEADERS, timeout=REQUEST_TIMEOUT)
 
     if r.status_code == 404:
         abo.delete()
         return
 
     r.raise_for_status()
-    data = r.json()
+    apply_refresh(abo, match_results([abo], r.json())[0][1], stats or barcode_cache.CacheStats())
+
 
-    if len(data) == 0:
+def apply_refresh(abo: models.DBSubscription, tickets: typing.Optional[dict], stats: barcode_cache.CacheStats):
+    if not tickets:
         abo.delete()
         return
 
-    tickets = data[0]
-    abo.refresh_at = datetime.datetime.fromisoformat(tickets['refreshDatum'])
+    refresh_at = datetime.datetime.fromisoformat(tickets['refreshDatum'])
+    if timezone.is_naive(refresh_at):
+        refresh_at = timezone.make_aware(refresh_at)
+    abo.refresh_at = max(refresh_at, timezone.now() + MIN_REFRESH_INTERVAL) + \
+        datetime.timedelta(seconds=random.uniform(0, REFRESH_JITTER))
     abo.info = tickets["ticketHuelle"]
     abo.save()
 
     for t in tickets["tickets"]:
-        ticket_data = base64.urlsafe_b64decode(t["payload"] + '==')
-        ticket_data = json.loads(ticket_data.decode('utf-8'))
-        if "barcode" in ticket_data and ticket_data["barcode"]:
-            barcode_url = ticket_data["barcode"]
-        else:
-            ticket_layout = bs4.BeautifulSoup(ticket_data["ticketLayoutTemplate"], 'html.parser')
-            barcode_elm = ticket_layout.find("nativeimg", attrs={
-                "id": "ticketbarcode"
-            }, recursive=True)
-            if not barcode_elm:
-                logger.error("Could not find barcode element")
-                continue
-            barcode_url = barcode_elm.attrs["src"]
-
-        if not barcode_url.startswith("data:"):
-            logger.error("Barcode image not a data URL")
-            continue
-        media_type, data = barcode_url[5:].split(";", 1)
-        encoding, data = data.split(",", 1)
-        if not media_type.startswith("image/"):
-            logger.error("Unsupported media type '%s'", media_type)
+        barcode_img_data = barcode_image(t)
+        if not barcode_img_data:
             continue
-        if encoding != "base64":
-            logger.error("Unsupported encoding type '%s' in barcode image", encoding)
-            continue
-        barcode_img_data = base64.urlsafe_b64decode(data)
+
         try:
-            barcode_data = aztec.decode(barcode_img_data)
+            barcode_cache.ingest_image(barcode_img_data, abo.account, {"db_subscription": abo}, stats)
         except aztec.AztecError as e:
             logger.error("Error decoding barcode image: %s", e)
             continue
-
-        try:
-            ticket_obj = ticket.update_from_subscription_barcode(barcode_data, account=abo.account)
-            ticket_obj.db_subscription = abo
-            ticket_obj.save()
         except ticket.TicketError as e:
             logger.error("Error decoding barcode ticket: %s", e)
             continue
 
-    logging.info(f"Successfully updated DB subscription {abo.device_token}")
\ No newline at end of file
+    logging.info(f"Successfully updated DB subscription {abo.device_token}")
+
+
+def barcode_image(t: dict) -> typing.Optional[bytes]:
+    ticket_data = base64.urlsafe_b64decode(t["payload"] + '==')
+    ticket_data = json.loads(ticket_data.decode('utf-8'))
+    if "barcode" in ticket_data and ticket_data["barcode"]:
+        barcode_url = ticket_data["barcode"]
+    else:
+        ticket_layout = bs4.BeautifulSoup(ticket_data["ticketLayoutTemplate"], 'html.parser')
+        barcode_elm = ticket_layout.find("nativeimg", attrs={
+            "id": "ticketbarcode"
+        }, recursive=True)
+        if not barcode_elm:
+            logger.error("Could not find barcode element")
+            return None
+        barcode_url = barcode_elm.attrs["src"]
+
+    if not barcode_url.startswith("data:"):
+        logger.error("Barcode image not a data URL")
+        return None
+    media_type, data = barcode_url[5:].split(";", 1)
+    encoding, data = data.split(",", 1)
+    if not media_type.startswith("image/"):
+        logger.error("Unsupported media type '%s'", media_type)
+        return None
+    if encoding != "base64":
+        logger.error("Unsupported encoding type '%s' in barcode image", encoding)
+        return None
+    return base64.urlsafe_b64decode(data)
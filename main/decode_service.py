@@ -0,0 +1,265 @@
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import resource
+import threading
+import time
+import typing
+import pymupdf
+from django.conf import settings
+
+from . import aztec, pdf_scan
+from .ticket_formats import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_PAYLOAD_BYTES = 16 * 1024 * 1024
+# Time for the client to also cover connecting and queueing, on top of the job itself
+CLIENT_GRACE = 5
+
+
+class DecodeServiceError(aztec.AztecError):
+    pass
+
+
+class DecodeBusy(DecodeServiceError):
+    pass
+
+
+Response = typing.Tuple[typing.Dict[str, typing.Any], bytes]
+
+
+def decode_job(kind: str, hint: typing.Optional[str], data: bytes) -> Response:
+    if kind == "pdf":
+        try:
+            pdf = pymupdf.open(stream=data, filetype="pdf")
+        except RuntimeError as e:
+            return {"status": "error", "message": f"Error opening PDF: {e}"}, b""
+        with pdf:
+            result = pdf_scan.find_barcode(pdf, hint)
+        if not result:
+            return {"status": "not_found", "message": "Failed to find any Aztec codes in the PDF"}, b""
+        return {"status": "ok", "pass": result.pass_name, "page": result.page}, result.data
+    elif kind == "image":
+        try:
+            result = aztec.get_decoder_pool().decode(data, hint)
+        except aztec.AztecError as e:
+            return {"status": "not_found", "message": str(e)}, b""
+        return {"status": "ok", "pass": result.pass_name}, result.data
+    else:
+        return {"status": "error", "message": f"Unknown job kind {kind}"}, b""
+
+
+def send(conn: multiprocessing.connection.Connection, header: typing.Dict[str, typing.Any], payload: bytes = b""):
+    conn.send_bytes(json.dumps(header).encode("utf-8"))
+    conn.send_bytes(payload)
+
+
+def receive(conn: multiprocessing.connection.Connection) -> Response:
+    header = json.loads(conn.recv_bytes(MAX_HEADER_BYTES))
+    return header, conn.recv_bytes(MAX_PAYLOAD_BYTES)
+
+
+def worker_main(conn: multiprocessing.connection.Connection, memory_limit: typing.Optional[int]):
+    # Address space rather than RSS, as that's all the kernel will enforce per process
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    while True:
+        try:
+            header, data = receive(conn)
+        except EOFError:
+            return
+
+        try:
+            response, payload = decode_job(header.get("kind"), header.get("hint"), data)
+        except MemoryError:
+            # Whatever the native decoder was doing can't be trusted any more, so let the server replace us
+            send(conn, {"status": "error", "message": "The image is too large to decode", "exit": True})
+            return
+        except Exception as e:
+            logger.exception("Decode job failed")
+            response, payload = {"status": "error", "message": f"Decoding failed: {e}"}, b""
+        send(conn, response, payload)
+
+
+class Worker:
+    def __init__(self, context, memory_limit: typing.Optional[int]):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child_conn, memory_limit), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class DecodeServer:
+    def __init__(
+            self, address: str, workers: int, queue_size: int, timeout: float, memory_limit: typing.Optional[int]
+    ):
+        self.address = address
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        # Workers are replaced from handler threads, and forking a threaded process can leave locks held in the child
+        self.context = multiprocessing.get_context("forkserver")
+        self.context.set_forkserver_preload([__name__])
+        self.idle = queue.Queue()
+        # Jobs either running or waiting for a worker, beyond that new ones are turned away
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.capacity = workers + queue_size
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.counts = {name: 0 for name in ("ok", "not_found", "error", "busy", "timeout", "crashed")}
+        self.latency = LatencyHistogram()
+        self.queue_wait = LatencyHistogram()
+
+    def start(self):
+        for _ in range(self.workers):
+            self.idle.put(Worker(self.context, self.memory_limit))
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        with multiprocessing.connection.Listener(self.address, family="AF_UNIX") as listener:
+            logger.info("Decode service listening on %s with %d workers", self.address, self.workers)
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError:
+                    logger.warning("Failed to accept decode connection", exc_info=True)
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn: multiprocessing.connection.Connection):
+        with conn:
+            try:
+                header, data = receive(conn)
+                if header.get("kind") == "stats":
+                    send(conn, self.stats())
+                    return
+                send(conn, *self.submit(header, data))
+            except (EOFError, OSError, ValueError):
+                logger.debug("Decode client went away", exc_info=True)
+
+    def submit(self, header: typing.Dict[str, typing.Any], data: bytes) -> Response:
+        if not self.slots.acquire(blocking=False):
+            return self.finish("busy", {"status": "busy", "message": "The barcode decoder is busy"})
+        try:
+            return self.run(header, data)
+        finally:
+            self.slots.release()
+
+    def run(self, header: typing.Dict[str, typing.Any], data: bytes) -> Response:
+        queued = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            worker = self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            return self.finish("busy", {"status": "busy", "message": "The barcode decoder is busy"})
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+        start = time.monotonic()
+        self.queue_wait.observe(start - queued)
+        with self._lock:
+            self.running += 1
+        try:
+            send(worker.conn, {"kind": header.get("kind"), "hint": header.get("hint")}, data)
+            if not worker.conn.poll(self.timeout):
+                logger.warning("Decode job timed out after %.0fs, replacing worker %d", self.timeout, worker.process.pid)
+                worker.stop()
+                worker = Worker(self.context, self.memory_limit)
+                return self.finish("timeout", {"status": "timeout", "message": "Decoding the barcode took too long"})
+            response, payload = receive(worker.conn)
+            if response.pop("exit", False):
+                worker.stop()
+                worker = Worker(self.context, self.memory_limit)
+        except (EOFError, OSError):
+            logger.warning("Decode worker %d crashed with exit code %s, replacing it",
+                           worker.process.pid, worker.process.exitcode)
+            worker.stop()
+            worker = Worker(self.context, self.memory_limit)
+            return self.finish("crashed", {"status": "error", "message": "The barcode decoder crashed"})
+        finally:
+            with self._lock:
+                self.running -= 1
+            self.idle.put(worker)
+            self.latency.observe(time.monotonic() - start)
+
+        return self.finish(response.get("status", "error"), response, payload)
+
+    def finish(self, outcome: str, response: typing.Dict[str, typing.Any], payload: bytes = b"") -> Response:
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+        if outcome == "busy":
+            logger.warning("Rejected decode job with %d waiting and %d running", self.waiting, self.running)
+        return response, payload
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "waiting": self.waiting,
+                "running": self.running,
+                "counts": dict(self.counts),
+                "latency": self.latency.to_dict(),
+                "queue_wait": self.queue_wait.to_dict(),
+            }
+
+
+def request(
+        header: typing.Dict[str, typing.Any], data: bytes = b"", address: typing.Optional[str] = None
+) -> Response:
+    try:
+        conn = multiprocessing.connection.Client(address or settings.DECODE_SERVICE_SOCKET, family="AF_UNIX")
+    except OSError as e:
+        raise DecodeServiceError("The barcode decoder is unavailable") from e
+
+    with conn:
+        try:
+            send(conn, header, data)
+            # A job can wait up to the timeout for a worker and then run for up to the timeout again
+            if not conn.poll(2 * settings.DECODE_SERVICE_TIMEOUT + CLIENT_GRACE):
+                raise DecodeBusy("The barcode decoder is busy, please try again in a moment")
+            return receive(conn)
+        except (EOFError, OSError) as e:
+            raise DecodeServiceError("The barcode decoder is unavailable") from e
+
+
+def decode(kind: str, data: bytes, hint: typing.Optional[str] = None) -> bytes:
+    if settings.DECODE_SERVICE_SOCKET:
+        response, payload = request({"kind": kind, "hint": hint}, data)
+    else:
+        response, payload = decode_job(kind, hint, data)
+
+    status = response.get("status")
+    if status == "ok":
+        return payload
+    elif status in ("busy", "timeout"):
+        raise DecodeBusy(f"{response.get('message')}, please try again in a moment")
+    else:
+        raise aztec.AztecError(response.get("message", "Unable to decode the barcode"))
+
+
+def decode_image(data: bytes, hint: typing.Optional[str] = None) -> bytes:
+    return decode("image", data, hint)
+
+
+def decode_pdf(data: bytes, hint: typing.Optional[str] = None) -> bytes:
+    return decode("pdf", data, hint)
+
+
+def service_stats(address: typing.Optional[str] = None) -> typing.Dict[str, typing.Any]:
+    return request({"kind": "stats"}, address=address)[0]
@@ -0,0 +1,194 @@
+import base64
+import binascii
+import concurrent.futures
+import dataclasses
+import functools
+import json
+import logging
+import multiprocessing
+import typing
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import models, ticket, apn, gwallet
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("jsonl", "hex", "base64")
+
+
+@dataclasses.dataclass
+class DecodedBarcode:
+    ticket_id: str
+    ticket_type: str
+    model: typing.Type["models.Model"]
+    lookup: dict
+    defaults: dict
+
+
+@dataclasses.dataclass
+class IngestResult:
+    decoded: int = 0
+    failed: int = 0
+    created_tickets: int = 0
+    updated_tickets: int = 0
+    notified: int = 0
+
+
+def read_barcodes(lines: typing.Iterable[str], file_format: str) -> typing.Iterator[typing.Tuple[int, bytes]]:
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            if file_format == "jsonl":
+                obj = json.loads(line)
+                if isinstance(obj, dict) and "hex" in obj:
+                    yield line_no, bytes.fromhex(obj["hex"])
+                else:
+                    yield line_no, decode_base64(obj["barcode"] if isinstance(obj, dict) else obj)
+            elif file_format == "hex":
+                yield line_no, bytes.fromhex(line)
+            else:
+                yield line_no, decode_base64(line)
+        except (ValueError, KeyError, TypeError, binascii.Error) as e:
+            logger.error("Line %d: invalid barcode data: %s", line_no, e)
+
+
+def decode_base64(data: str) -> bytes:
+    return base64.b64decode(data.translate(str.maketrans("-_", "+/")) + "=" * (-len(data) % 4), validate=True)
+
+
+def decode_barcode(
+        barcode: bytes, account: typing.Optional["models.Account"]
+) -> typing.Tuple[typing.Optional[DecodedBarcode], typing.Optional[str]]:
+    try:
+        decoded = ticket.parse_ticket(barcode, account=account)
+        model, lookup, defaults = ticket.ticket_instance_values(barcode, decoded)
+    except ticket.TicketError as e:
+        return None, f"{e.title}: {e.message}"
+    except Exception as e:
+        # A parser bug tripped by one barcode mustn't abort the whole import
+        logger.exception("Unexpected error decoding barcode")
+        return None, f"Unexpected error: {e!r}"
+
+    return DecodedBarcode(
+        ticket_id=decoded.pk(),
+        ticket_type=decoded.type(),
+        model=model,
+        lookup=lookup,
+        defaults=defaults,
+    ), None
+
+
+def conflict_fields(model: typing.Type["models.Model"], lookup: dict) -> typing.List[str]:
+    if model._meta.unique_together:
+        return list(model._meta.unique_together[0])
+    return [f for f in lookup if model._meta.get_field(f).unique]
+
+
+def write_batch(
+        decoded: typing.List[DecodedBarcode], account: typing.Optional["models.Account"], result: IngestResult
+) -> typing.Set[str]:
+    # Later barcodes for the same ticket or instance win, as they would when ingested one at a time
+    tickets = {d.ticket_id: d for d in decoded}
+    instances = {}
+    for d in decoded:
+        fields = conflict_fields(d.model, d.lookup)
+        instances.setdefault(d.model, {})[tuple(d.lookup[f] for f in fields)] = d
+
+    now = timezone.now()
+    with transaction.atomic():
+        existing_tickets = dict(models.Ticket.objects.filter(pk__in=tickets).values_list("pk", "last_updated"))
+        updated = set(tickets) - set(existing_tickets)
+        for model, by_key in instances.items():
+            fields = conflict_fields(model, next(iter(by_key.values())).lookup)
+            query = functools.reduce(lambda a, b: a | b, (Q(**dict(zip(fields, key))) for key in by_key))
+            existing = set(model.objects.filter(query).values_list(*fields))
+            updated.update(d.ticket_id for key, d in by_key.items() if key not in existing)
+
+        update_fields = ["ticket_type", "last_updated"]
+        if account:
+            update_fields.append("account")
+        models.Ticket.objects.bulk_create([
+            models.Ticket(
+                id=ticket_id,
+                ticket_type=d.ticket_type,
+                account=account,
+                last_updated=now if ticket_id in updated else existing_tickets[ticket_id],
+            ) for ticket_id, d in tickets.items()
+        ], update_conflicts=True, unique_fields=["id"], update_fields=update_fields)
+
+        for model, by_key in instances.items():
+            fields = conflict_fields(model, next(iter(by_key.values())).lookup)
+            objs = [model(ticket_id=d.ticket_id, **d.lookup, **d.defaults) for d in by_key.values()]
+            model.objects.bulk_create(
+                objs, update_conflicts=True, unique_fields=fields,
+                update_fields=[f.name for f in model._meta.concrete_fields
+                               if not f.primary_key and f.name not in fields],
+            )
+
+    result.created_tickets += len(set(tickets) - set(existing_tickets))
+    result.updated_tickets += len(updated & set(existing_tickets))
+    return updated
+
+
+def ingest(
+        barcodes: typing.Iterable[typing.Tuple[int, bytes]],
+        account: typing.Optional["models.Account"] = None,
+        workers: typing.Optional[int] = None,
+        batch_size: int = 500,
+        notify: bool = True,
+) -> IngestResult:
+    result = IngestResult()
+    to_notify = set()
+
+    def batches():
+        batch = []
+        for item in barcodes:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def write(batch, decoded):
+        ok = []
+        for (line_no, _), (d, error) in zip(batch, decoded):
+            if d:
+                ok.append(d)
+            else:
+                result.failed += 1
+                logger.error("Line %d: %s", line_no, error)
+        if ok:
+            result.decoded += len(ok)
+            to_notify.update(write_batch(ok, account, result))
+
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    decode = functools.partial(decode_barcode, account=account)
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+    ) as executor:
+        # Keep one batch decoding on the pool while the previous one is written
+        pending = None
+        for batch in batches():
+            decoded = executor.map(decode, [b for _, b in batch], chunksize=max(1, batch_size // 32))
+            if pending:
+                write(*pending)
+            pending = (batch, decoded)
+        if pending:
+            write(*pending)
+
+    if notify:
+        to_notify = sorted(to_notify)
+        for i in range(0, len(to_notify), batch_size):
+            for ticket_obj in models.Ticket.objects.filter(pk__in=to_notify[i:i + batch_size]):
+                apn.notify_ticket(ticket_obj)
+                gwallet.sync_ticket(ticket_obj)
+                result.notified += 1
+
+    return result
@@ -0,0 +1,57 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+import main.bits
+import main.rsp
+import main.ssb
+
+
+class Command(BaseCommand):
+    help = "Time the fixed-layout RSP and SSB ticket parsers on random payloads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=2000)
+        parser.add_argument("--rounds", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        rsp_payloads = [rng.randbytes(108) for _ in range(options["count"])]
+        ssb_payloads = [
+            main.ssb.Envelope.parse(bytes([0x30 | (b[0] & 0x0f)]) + b[1:]).data
+            for b in (rng.randbytes(114) for _ in range(options["count"]))
+        ]
+
+        parsers = [
+            ("RSP TicketData", rsp_payloads, main.rsp.TicketData.parse),
+            ("RSP RailcardData", rsp_payloads, main.rsp.RailcardData.parse),
+            ("SSB IntegratedReservationTicket", ssb_payloads,
+             lambda d: main.ssb.IntegratedReservationTicket.parse(d, 1080)),
+            ("SSB NonReservationTicket", ssb_payloads, lambda d: main.ssb.NonReservationTicket.parse(d, 1080)),
+            ("SSB Pass", ssb_payloads, main.ssb.Pass.parse),
+            ("SSB Keycard", ssb_payloads, main.ssb.ns_keycard.Keycard.parse),
+        ]
+        for name, payloads, parse in parsers:
+            valid = []
+            for payload in payloads:
+                try:
+                    parse(payload)
+                    valid.append(payload)
+                except (ValueError, OverflowError, main.rsp.RSPException, main.ssb.SSBException):
+                    pass
+
+            best = None
+            for _ in range(options["rounds"]):
+                start = time.perf_counter()
+                for payload in valid:
+                    parse(payload)
+                elapsed = (time.perf_counter() - start) / len(valid) if valid else 0
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write(f"{name}: {best * 1e6:.1f}µs/parse over {len(valid)} payloads")
+
+        start = time.perf_counter()
+        for payload in rsp_payloads:
+            main.bits.BitReader(payload).read_string(8, 62)
+        self.stdout.write(
+            f"BitReader 9 character string: {(time.perf_counter() - start) / len(rsp_payloads) * 1e6:.2f}µs/read"
+        )
@@ -0,0 +1,143 @@
+import json
+import pathlib
+import statistics
+import time
+import traceback
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+import main.gwallet
+import main.models
+import main.rsp
+import main.synthetic
+import main.ticket
+import main.uic.certs
+import main.vdv
+import main.views.passes
+
+
+class Command(BaseCommand):
+    help = "Time parsing, signature verification and pass rendering per ticket format on a synthetic corpus"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=50)
+        parser.add_argument("--rounds", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--pki", type=pathlib.Path, help="Test PKI directory from generate-tickets")
+        parser.add_argument("--variant", action="append", choices=list(main.synthetic.CORPUS_VARIANTS))
+        parser.add_argument("--skip-render", action="store_true")
+        parser.add_argument("--output", type=str, help="Write the JSON report here instead of stdout")
+
+    def handle(self, *args, **options):
+        pki = main.synthetic.TestPKI.load(options["pki"]) if options["pki"] else main.synthetic.TestPKI.generate()
+        variants = options["variant"] or list(main.synthetic.CORPUS_VARIANTS)
+
+        report = {
+            "git_hash": settings.GIT_HASH,
+            "generated_at": timezone.now().isoformat(),
+            "count": options["count"],
+            "rounds": options["rounds"],
+            "seed": options["seed"],
+            "variants": {},
+        }
+        with pki.installed(), override_settings(**main.synthetic.pass_signing_settings()):
+            corpus = main.synthetic.corpus(pki, options["count"], options["seed"], variants)
+            for name in variants:
+                report["variants"][name] = self.benchmark(corpus[name], options)
+                self.stderr.write(f"{name}: {self.summary(report['variants'][name])}")
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def benchmark(self, samples, options) -> dict:
+        parsed = [main.ticket.parse_ticket(data, None) for data in samples]
+        stages = {
+            "size": {"mean": statistics.mean(len(data) for data in samples)},
+            "parse": self.time(lambda data, _: main.ticket.parse_ticket(data, None), samples, parsed, options),
+            "verify": self.time(verify, samples, parsed, options),
+        }
+        if not options["skip_render"]:
+            stages["pkpass"] = self.time(
+                lambda data, t: render(data, t, lambda o: main.views.passes.make_pkpass(o)),
+                samples, parsed, options
+            )
+            stages["gwallet"] = self.time(
+                lambda data, t: render(data, t, lambda o: main.gwallet.make_ticket_obj(o, o.pk)),
+                samples, parsed, options
+            )
+        return stages
+
+    @staticmethod
+    def time(func, samples, parsed, options) -> dict:
+        timings = [[] for _ in samples]
+        errors = {}
+        for _ in range(options["rounds"]):
+            for i, (data, t) in enumerate(zip(samples, parsed)):
+                start = time.perf_counter()
+                try:
+                    if func(data, t) is NotImplemented:
+                        return {"supported": False}
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    if error not in errors:
+                        errors[error] = traceback.format_exc()
+                    continue
+                timings[i].append(time.perf_counter() - start)
+
+        # Each sample's best round, to keep one-off GC pauses and cache warm-up out of the percentiles
+        best = sorted(min(t) * 1e6 for t in timings if t)
+        result = {"supported": True, "ok": len(best), "errors": len(samples) - len(best)}
+        if best:
+            result.update({
+                "mean_us": statistics.mean(best),
+                "p50_us": best[len(best) // 2],
+                "p95_us": best[min(len(best) - 1, int(len(best) * 0.95))],
+                "min_us": best[0],
+                "max_us": best[-1],
+            })
+        if errors:
+            result["error_messages"] = list(errors)
+        return result
+
+    @staticmethod
+    def summary(stages: dict) -> str:
+        return ", ".join(
+            f"{stage} {s['p50_us']:.0f}µs" if "p50_us" in s else f"{stage} {s.get('errors', 0)} errors"
+            for stage, s in stages.items() if stage != "size" and s.get("supported")
+        )
+
+
+def verify(data: bytes, t):
+    if isinstance(t, (main.ticket.UICTicket, main.ticket.SSBTicket)):
+        if not main.uic.certs.verify_envelope(t.envelope).valid:
+            raise ValueError("Invalid signature")
+    elif isinstance(t, main.ticket.VDVTicket):
+        # The certificate chain is cached after the first ticket, so start cold to time the whole chain
+        main.ticket.VDV_CA_CACHE.clear()
+        main.ticket.VDV_ENVELOPE_CERTIFICATE_CACHE.clear()
+        main.ticket.parse_ticket_vdv(data, main.vdv.ticket.Context(account_forename=None, account_surname=None))
+    elif isinstance(t, main.ticket.RSPTicket):
+        envelope = main.rsp.Envelope.parse(data)
+        if not any(
+                envelope.decrypt_with_cert(cert)
+                for cert in main.rsp.pki.get_certificate_store().certificates.get(envelope.issuer_id, [])
+        ):
+            raise ValueError("No certificate decrypts the payload")
+    else:
+        return NotImplemented
+
+
+def render(data: bytes, t, make):
+    with transaction.atomic():
+        ticket_obj = main.models.Ticket.objects.create(id=t.pk(), ticket_type=t.type(), last_updated=timezone.now())
+        main.ticket.create_ticket_obj(ticket_obj, data, t)
+        try:
+            return make(ticket_obj)
+        finally:
+            transaction.set_rollback(True)
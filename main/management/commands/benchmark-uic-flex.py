@@ -0,0 +1,53 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+import main.uic.flex
+import main.uic.uper
+
+
+class Command(BaseCommand):
+    help = "Compare the per-ticket decode time of asn1tools and the generated UIC FCB decoder"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=500)
+        parser.add_argument("--rounds", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        for version, spec_file in main.uic.flex.ASN1_SPEC_FILES.items():
+            spec = main.uic.flex.get_spec(version)
+            start = time.perf_counter()
+            decoder, source = main.uic.uper.generate(spec, "UicRailTicketData")
+            generated = time.perf_counter() - start
+
+            root = spec.types["UicRailTicketData"].type
+            rng = random.Random(options["seed"])
+            samples = [
+                bytes(spec.encode("UicRailTicketData", main.uic.uper.example_value(root, rng)))
+                for _ in range(options["count"])
+            ]
+            for data in samples:
+                if spec.decode("UicRailTicketData", data) != decoder(data):
+                    self.stderr.write(f"{spec_file.name}: decoders disagree on {data.hex()}")
+                    return
+
+            asn1tools_time = self.time(lambda data: spec.decode("UicRailTicketData", data), samples, options["rounds"])
+            fast_time = self.time(decoder, samples, options["rounds"])
+            average_size = sum(len(data) for data in samples) / len(samples)
+            self.stdout.write(
+                f"{spec_file.name}: {len(samples)} tickets, {average_size:.0f} bytes average, "
+                f"asn1tools {asn1tools_time * 1e6:.1f}µs/ticket, generated {fast_time * 1e6:.1f}µs/ticket "
+                f"({asn1tools_time / fast_time:.1f}x), generated {source.count(chr(10))} lines "
+                f"in {generated * 1000:.0f}ms"
+            )
+
+    @staticmethod
+    def time(decode, samples, rounds: int) -> float:
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for data in samples:
+                decode(data)
+            elapsed = (time.perf_counter() - start) / len(samples)
+            best = elapsed if best is None else min(best, elapsed)
+        return best
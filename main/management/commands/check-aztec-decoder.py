@@ -0,0 +1,32 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+import main.aztec
+
+
+class Command(BaseCommand):
+    help = "Check the Barkoder decoder works and optionally time it on sample images"
+
+    def add_arguments(self, parser):
+        parser.add_argument("images", nargs="*", type=str)
+        parser.add_argument("--rounds", type=int, default=1)
+        parser.add_argument("--hint", choices=list(main.aztec.DECODER_HINTS))
+
+    def handle(self, *args, **options):
+        pool = main.aztec.get_decoder_pool()
+        ok, error = pool.health_check()
+        if not ok:
+            raise CommandError(f"Barkoder decoder unhealthy: {error}")
+
+        for image in options["images"]:
+            with open(image, "rb") as f:
+                data = f.read()
+            for _ in range(options["rounds"]):
+                try:
+                    result = pool.decode(data, options["hint"])
+                except main.aztec.AztecError as e:
+                    self.stderr.write(f"{image}: {e}")
+                    break
+            else:
+                self.stderr.write(f"{image}: found in the {result.pass_name} pass")
+
+        self.stdout.write(json.dumps(pool.stats(), indent=2))
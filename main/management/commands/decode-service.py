@@ -0,0 +1,36 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import main.decode_service
+
+
+class Command(BaseCommand):
+    help = "Run the barcode decode service the upload views submit images and PDFs to"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", type=str, default=settings.DECODE_SERVICE_SOCKET)
+        parser.add_argument("--workers", type=int, default=settings.DECODE_SERVICE_WORKERS)
+        parser.add_argument("--queue-size", type=int, default=settings.DECODE_SERVICE_QUEUE_SIZE)
+        parser.add_argument("--timeout", type=float, default=settings.DECODE_SERVICE_TIMEOUT)
+        parser.add_argument("--memory-limit", type=int, default=settings.DECODE_SERVICE_MEMORY_LIMIT,
+                            help="Address space limit per worker in bytes, 0 for none")
+        parser.add_argument("--stats", action="store_true", help="Print the stats of the running service and exit")
+
+    def handle(self, *args, **options):
+        if not options["socket"]:
+            raise CommandError("No socket given and DECODE_SERVICE_SOCKET isn't set")
+
+        if options["stats"]:
+            try:
+                self.stdout.write(json.dumps(main.decode_service.service_stats(options["socket"]), indent=2))
+            except main.decode_service.DecodeServiceError as e:
+                raise CommandError(str(e))
+            return
+
+        server = main.decode_service.DecodeServer(
+            options["socket"], options["workers"], options["queue_size"], options["timeout"],
+            options["memory_limit"] or None
+        )
+        server.start()
+        server.serve_forever()
+
@@ -5,6 +5,7 @@ import xsdata.formats.dataclass.parsers
 import xsdata.models.datatype
 import json
 import main.uic.gen.bar_code_key_exchange
+import main.uic.certs
 
 xml_parser = xsdata.formats.dataclass.parsers.XmlParser()
 
@@ -18,6 +19,7 @@ class Command(BaseCommand):
         r.raise_for_status()
 
         data = xml_parser.from_string(r.text, main.uic.gen.bar_code_key_exchange.Keys)
+        keys = []
         for key in data.key:
             if key.public_key.keytype != "CERTIFICATE":
                 continue
@@ -25,16 +27,47 @@ class Command(BaseCommand):
             key_meta_name = f"cert-{key.issuer_code}_{key.id}.json"
             with uic_storage.open(key_name, "wb") as f:
                 f.write(key.public_key.value)
+            meta = {
+                "issuer_name": key.issuer_name,
+                "issuer_code": key.issuer_code,
+                "version_type": key.version_type,
+                "signature_algorithm": key.signature_algorithm,
+                "key_id": key.id,
+                "barcode_version": key.barcode_version,
+                "start_date": key.start_date.to_date().isoformat(),
+                "end_date": key.end_date.to_date().isoformat(),
+                "allowed_product_owner_codes": key.allowed_product_owner_codes.product_owner_code if key.allowed_product_owner_codes.product_owner_code else None,
+                "allowed_product_owner_name": key.allowed_product_owner_codes.product_owner_name if key.allowed_product_owner_codes.product_owner_name else None,
+            }
             with uic_storage.open(key_meta_name, "w") as f:
-                json.dump({
-                    "issuer_name": key.issuer_name,
-                    "issuer_code": key.issuer_code,
-                    "version_type": key.version_type,
-                    "signature_algorithm": key.signature_algorithm,
-                    "key_id": key.id,
-                    "barcode_version": key.barcode_version,
-                    "start_date": key.start_date.to_date().isoformat(),
-                    "end_date": key.end_date.to_date().isoformat(),
-                    "allowed_product_owner_codes": key.allowed_product_owner_codes.product_owner_code if key.allowed_product_owner_codes.product_owner_code else None,
-                    "allowed_product_owner_name": key.allowed_product_owner_codes.product_owner_name if key.allowed_product_owner_codes.product_owner_name else None,
-                }, f)
\ No newline at end of file
+                json.dump(meta, f)
+            keys.append(main.uic.certs.Key(
+                rics=int(key.issuer_code),
+                key_id=str(key.id),
+                meta=meta,
+                certificate_der=key.public_key.value,
+            ))
+
+        cert_keys = {(k.rics, k.key_id) for k in keys}
+        for file_name in uic_storage.listdir("")[1]:
+            if not (file_name.startswith("pk-") and file_name.endswith(".der")):
+                continue
+            try:
+                rics, key_id = file_name[3:-4].split("_", 1)
+                rics = int(rics)
+            except ValueError:
+                continue
+            if (rics, key_id) in cert_keys:
+                continue
+            with uic_storage.open(file_name, "rb") as f:
+                keys.append(main.uic.certs.Key(
+                    rics=rics,
+                    key_id=key_id,
+                    meta=None,
+                    public_key_der=f.read(),
+                ))
+
+        with uic_storage.open(main.uic.certs.MANIFEST_NAME, "w") as f:
+            json.dump({
+                "keys": [k.to_json() for k in keys],
+            }, f)
@@ -0,0 +1,74 @@
+import base64
+import gzip
+import json
+import pathlib
+import sys
+from django.core.management.base import BaseCommand, CommandError
+import main.ingest
+import main.synthetic
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic barcode corpus signed by a test PKI, in a format import-barcodes reads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("pki", type=pathlib.Path,
+                            help="Test PKI directory, created if it doesn't have one yet")
+        parser.add_argument("--count", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--mix", action="append", metavar="VARIANT=WEIGHT",
+                            help=f"Relative share of a variant, defaults to all equally. "
+                                 f"Variants: {', '.join(main.synthetic.CORPUS_VARIANTS)}")
+        parser.add_argument("--travelers", type=int, default=1)
+        parser.add_argument("--layout-lines", type=int, default=0)
+        parser.add_argument("--format", choices=main.ingest.FORMATS, default="jsonl")
+        parser.add_argument("--workers", type=int)
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--output", type=pathlib.Path, help="Defaults to stdout, gzipped if it ends in .gz")
+
+    def handle(self, *args, **options):
+        mix = {}
+        for entry in options["mix"] or []:
+            name, _, weight = entry.partition("=")
+            if name not in main.synthetic.CORPUS_VARIANTS:
+                raise CommandError(f"Unknown variant {name}")
+            try:
+                mix[name] = float(weight or 1)
+            except ValueError:
+                raise CommandError(f"Invalid weight for {name}: {weight}")
+
+        if (options["pki"] / main.synthetic.PRIVATE_KEYS_NAME).exists():
+            pki = main.synthetic.TestPKI.load(options["pki"])
+        else:
+            pki = main.synthetic.TestPKI.generate()
+            pki.save(options["pki"])
+            self.stderr.write(f"Created a test PKI in {options['pki']}")
+
+        if not options["output"]:
+            out = sys.stdout
+        elif options["output"].suffix == ".gz":
+            out = gzip.open(options["output"], "wt")
+        else:
+            out = open(options["output"], "w")
+
+        sizes = main.synthetic.Sizes(travelers=options["travelers"], layout_lines=options["layout_lines"])
+        counts = {}
+        try:
+            for name, barcode in main.synthetic.generate(
+                    pki, options["count"], mix or None, options["seed"], sizes, options["workers"],
+                    options["chunk_size"]
+            ):
+                if options["format"] == "jsonl":
+                    out.write(json.dumps({
+                        "barcode": base64.b64encode(barcode).decode("ascii"), "variant": name
+                    }) + "\n")
+                elif options["format"] == "hex":
+                    out.write(barcode.hex() + "\n")
+                else:
+                    out.write(base64.b64encode(barcode).decode("ascii") + "\n")
+                counts[name] = counts.get(name, 0) + 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+        self.stderr.write(", ".join(f"{name}: {n}" for name, n in sorted(counts.items())))
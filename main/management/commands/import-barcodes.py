@@ -0,0 +1,49 @@
+import gzip
+import pathlib
+from django.core.management.base import BaseCommand, CommandError
+import main.ingest
+import main.models
+
+
+class Command(BaseCommand):
+    help = "Bulk import ticket barcodes from JSONL, hex or base64 files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+", type=pathlib.Path)
+        parser.add_argument("--format", choices=main.ingest.FORMATS,
+                            help="Input format, guessed from the file extension if not given")
+        parser.add_argument("--account", help="Username of the account to attach imported tickets to")
+        parser.add_argument("--workers", type=int, help="Number of decoding processes, defaults to the CPU count")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--no-notify", action="store_true",
+                            help="Don't push updated tickets to Apple and Google Wallet")
+
+    def handle(self, *args, **options):
+        account = None
+        if options["account"]:
+            account = main.models.Account.objects.select_related("user") \
+                .filter(user__username=options["account"]).first()
+            if not account:
+                raise CommandError(f"Unknown account {options['account']}")
+
+        for path in options["files"]:
+            compressed = path.suffix == ".gz"
+            file_format = options["format"] or {
+                ".jsonl": "jsonl", ".json": "jsonl", ".hex": "hex", ".b64": "base64", ".base64": "base64",
+            }.get(path.with_suffix("").suffix if compressed else path.suffix)
+            if not file_format:
+                raise CommandError(f"Can't guess the format of {path}, use --format")
+
+            with (gzip.open(path, "rt", encoding="utf-8") if compressed else path.open("r", encoding="utf-8")) as f:
+                result = main.ingest.ingest(
+                    main.ingest.read_barcodes(f, file_format),
+                    account=account,
+                    workers=options["workers"],
+                    batch_size=options["batch_size"],
+                    notify=not options["no_notify"],
+                )
+
+            self.stdout.write(
+                f"{path}: {result.decoded} decoded, {result.failed} failed, {result.created_tickets} new tickets, "
+                f"{result.updated_tickets} updated tickets, {result.notified} notified"
+            )
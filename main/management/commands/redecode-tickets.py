@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+import main.redecode
+
+
+class Command(BaseCommand):
+    help = "Re-parse stored ticket instances and update the fields derived from them after a parser change"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=main.redecode.INSTANCE_MODELS, action="append",
+                            help="Only re-decode this ticket format, may be given multiple times")
+        parser.add_argument("--job", help="Checkpoint name, defaults to the parser version and deployed commit")
+        parser.add_argument("--workers", type=int, help="Number of decoding processes, defaults to the CPU count")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+        parser.add_argument("--restart", action="store_true", help="Start from the beginning, ignoring the checkpoint")
+
+    def handle(self, *args, **options):
+        job = options["job"] or main.redecode.default_job_name()
+        for name in options["format"] or main.redecode.INSTANCE_MODELS:
+            model = main.redecode.INSTANCE_MODELS[name]
+            checkpoint, result = main.redecode.redecode(
+                model, job,
+                workers=options["workers"],
+                chunk_size=options["chunk_size"],
+                dry_run=options["dry_run"],
+                restart=options["restart"],
+            )
+            if not result.processed and checkpoint.finished_at:
+                self.stdout.write(f"{model._meta.verbose_name}: already finished for job {job}")
+                continue
+
+            self.stdout.write(
+                f"{model._meta.verbose_name}: {result.processed} processed, {result.changed} changed, "
+                f"{result.moved} moved to a new ticket, {result.failed} failed"
+            )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+import main.db_abo
+import main.refresh_scheduler
+import main.saarvv
+
+
+class Command(BaseCommand):
+    help = "Refresh due DB subscriptions and SaarVV accounts, safe to run on several pods at once"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", action="append", choices=main.refresh_scheduler.SOURCES,
+                            help="Defaults to all")
+        parser.add_argument("--once", action="store_true", help="Exit once nothing is due instead of polling")
+        parser.add_argument("--claim-size", type=int, default=main.refresh_scheduler.CLAIM_SIZE)
+        parser.add_argument("--poll-interval", type=float, default=main.refresh_scheduler.POLL_INTERVAL)
+        parser.add_argument("--batch-size", type=int, default=main.db_abo.BATCH_SIZE)
+        parser.add_argument("--concurrency", type=int, default=main.db_abo.CONCURRENCY)
+        parser.add_argument("--workers", type=int, default=main.db_abo.WORKERS)
+        parser.add_argument("--saarvv-concurrency", type=int, default=main.saarvv.CONCURRENCY,
+                            help="SaarVV accounts synced at once")
+
+    def handle(self, *args, **options):
+        sources = options["source"] or main.refresh_scheduler.SOURCES
+        db_abo_options = {
+            "batch_size": options["batch_size"],
+            "concurrency": options["concurrency"],
+            "workers": options["workers"],
+        }
+        if options["once"]:
+            main.refresh_scheduler.run_once(
+                sources, options["claim_size"], saarvv_concurrency=options["saarvv_concurrency"], **db_abo_options
+            )
+        else:
+            main.refresh_scheduler.run_forever(
+                sources, options["claim_size"], options["poll_interval"], options["saarvv_concurrency"],
+                **db_abo_options
+            )
@@ -0,0 +1,98 @@
+import collections
+import concurrent.futures
+import logging
+import time
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+import main.models
+import main.redecode
+import main.uic.certs
+import main.uic.util
+import main.ssb.util
+
+logger = logging.getLogger(__name__)
+
+
+def verify_group(key, items):
+    results = []
+    for instance, envelope in items:
+        try:
+            results.append((instance, main.uic.certs.verify_envelope(envelope, key)))
+        except Exception:
+            logger.exception("Unable to verify signature of %s %s", instance._meta.verbose_name, instance.pk)
+    return results
+
+
+class Command(BaseCommand):
+    help = "Re-verify the signatures of stored UIC and SSB tickets against the current key ring"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument(
+            "--batch-size", type=int, default=100,
+            help="Tickets per verification task, so tickets signed with one key are still spread over the workers"
+        )
+        parser.add_argument(
+            "--stale-only", action="store_true",
+            help="Only check tickets verified against a different key ring version"
+        )
+
+    def handle(self, *args, **options):
+        key_ring = main.uic.certs.get_key_ring()
+        key_ring.reload_if_changed()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            for model in (main.models.UICTicketInstance, main.models.SSBTicketInstance):
+                qs = model.objects.only("pk", "barcode_data", *model.SIGNATURE_FIELDS)
+                if options["stale_only"]:
+                    stale = Q(signature_verified_at__isnull=True)
+                    if key_ring.version is not None:
+                        stale |= Q(signature_key_ring_version__isnull=True) | \
+                                 ~Q(signature_key_ring_version=key_ring.version)
+                    qs = qs.filter(stale)
+
+                start = time.monotonic()
+                total = 0
+                changed = 0
+                for chunk in main.redecode.keyset_chunks(qs, options["chunk_size"]):
+                    changed += self.verify_chunk(executor, key_ring, model, chunk, options["batch_size"])
+                    total += len(chunk)
+
+                elapsed = time.monotonic() - start
+                self.stdout.write(
+                    f"{model._meta.verbose_name}: verified {total} tickets in {elapsed:.1f}s "
+                    f"({total / elapsed if elapsed else 0:.1f} tickets/s), {changed} changed"
+                )
+
+    def verify_chunk(self, executor, key_ring, model, chunk, batch_size: int) -> int:
+        groups = collections.defaultdict(list)
+        for instance in chunk:
+            try:
+                envelope = instance.parse_envelope()
+            except (main.uic.util.UICException, main.ssb.util.SSBException) as e:
+                logger.error("Unable to parse envelope of %s %s: %s", model._meta.verbose_name, instance.pk, e)
+                continue
+            except Exception:
+                logger.exception("Unable to parse envelope of %s %s", model._meta.verbose_name, instance.pk)
+                continue
+            groups[(envelope.issuer_rics, envelope.signature_key_id)].append((instance, envelope))
+
+        futures = []
+        for (rics, key_id), items in groups.items():
+            key = key_ring.get(rics, key_id)
+            for i in range(0, len(items), batch_size):
+                futures.append(executor.submit(verify_group, key, items[i:i + batch_size]))
+
+        updated = []
+        changed = 0
+        for future in concurrent.futures.as_completed(futures):
+            for instance, result in future.result():
+                if instance.signature_valid != result.valid or \
+                        instance.signature_key_fingerprint != result.key_fingerprint:
+                    changed += 1
+                instance.apply_verification_result(result)
+                updated.append(instance)
+
+        model.objects.bulk_update(updated, model.SIGNATURE_FIELDS, batch_size=500)
+        return changed
@@ -1,9 +1,20 @@
 from django.core.management.base import BaseCommand
 import main.db_abo
+import main.refresh_scheduler
 
 
 class Command(BaseCommand):
     help = "Update DB subscription tickets"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=main.db_abo.BATCH_SIZE)
+        parser.add_argument("--concurrency", type=int, default=main.db_abo.CONCURRENCY,
+                            help="Batches in flight at once")
+        parser.add_argument("--workers", type=int, default=main.db_abo.WORKERS,
+                            help="Threads decoding and saving the returned tickets")
+
     def handle(self, *args, **options):
-        main.db_abo.update_all()
+        main.refresh_scheduler.run_once(
+            ["db-abo"], batch_size=options["batch_size"], concurrency=options["concurrency"],
+            workers=options["workers"]
+        )
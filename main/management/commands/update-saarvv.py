@@ -1,9 +1,14 @@
 from django.core.management.base import BaseCommand
+import main.refresh_scheduler
 import main.saarvv
 
 
 class Command(BaseCommand):
     help = "Update SaarVV tickets"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=main.saarvv.CONCURRENCY,
+                            help="Accounts synced at once")
+
     def handle(self, *args, **options):
-        main.saarvv.update_all()
+        main.refresh_scheduler.run_once(["saarvv"], saarvv_concurrency=options["concurrency"])
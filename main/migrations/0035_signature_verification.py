@@ -0,0 +1,53 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0034_alter_ssbticketinstance_pnr'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ssbticketinstance',
+            name='signature_key_fingerprint',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Signature key fingerprint'),
+        ),
+        migrations.AddField(
+            model_name='ssbticketinstance',
+            name='signature_key_ring_version',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Signature key ring version'),
+        ),
+        migrations.AddField(
+            model_name='ssbticketinstance',
+            name='signature_valid',
+            field=models.BooleanField(blank=True, null=True, verbose_name='Signature valid'),
+        ),
+        migrations.AddField(
+            model_name='ssbticketinstance',
+            name='signature_verified_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Signature verified at'),
+        ),
+        migrations.AddField(
+            model_name='uicticketinstance',
+            name='signature_key_fingerprint',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Signature key fingerprint'),
+        ),
+        migrations.AddField(
+            model_name='uicticketinstance',
+            name='signature_key_ring_version',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Signature key ring version'),
+        ),
+        migrations.AddField(
+            model_name='uicticketinstance',
+            name='signature_valid',
+            field=models.BooleanField(blank=True, null=True, verbose_name='Signature valid'),
+        ),
+        migrations.AddField(
+            model_name='uicticketinstance',
+            name='signature_verified_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Signature verified at'),
+        ),
+    ]
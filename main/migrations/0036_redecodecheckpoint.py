@@ -0,0 +1,32 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0035_signature_verification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RedecodeCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(max_length=255, verbose_name='Job')),
+                ('model', models.CharField(max_length=255, verbose_name='Ticket instance model')),
+                ('last_pk', models.BigIntegerField(blank=True, null=True, verbose_name='Last processed ID')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Processed')),
+                ('changed', models.PositiveIntegerField(default=0, verbose_name='Changed')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Failed')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Started at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished at')),
+            ],
+            options={
+                'verbose_name': 'Re-decode checkpoint',
+                'unique_together': {('job', 'model')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0036_redecodecheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriptionBarcode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image_digest', models.CharField(max_length=64, unique=True, verbose_name='Image SHA-256')),
+                ('barcode_digest', models.CharField(db_index=True, max_length=64, verbose_name='Barcode SHA-256')),
+                ('barcode_data', models.BinaryField()),
+                ('parser_version', models.PositiveIntegerField(verbose_name='Parser version')),
+                ('ingested_at', models.DateTimeField(verbose_name='Ingested at')),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='subscription_barcodes', to='main.ticket')),
+            ],
+            options={
+                'verbose_name': 'Subscription barcode',
+            },
+        ),
+    ]
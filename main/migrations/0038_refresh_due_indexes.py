@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0037_subscriptionbarcode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='saarvv_next_sync_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='SaarVV next sync at'),
+        ),
+        migrations.AlterField(
+            model_name='dbsubscription',
+            name='refresh_at',
+            field=models.DateTimeField(db_index=True, verbose_name='Refresh at'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0038_refresh_due_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='saarvv_sync_state',
+            field=models.JSONField(blank=True, default=dict, verbose_name='SaarVV ticket fingerprints'),
+        ),
+    ]
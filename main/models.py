@@ -11,6 +11,7 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.db.models import Q
 from . import ticket as t
+from . import ticket_cache
 from . import vdv, uic, rsp, sncf, elb, ssb
 
 
@@ -27,6 +28,8 @@ class Account(models.Model):
     db_account_id = models.CharField(max_length=255, null=True, blank=True, verbose_name="Deutsche Bahn Account ID")
     saarvv_token = models.TextField(null=True, blank=True, verbose_name="SaarVV Token")
     saarvv_device_id = models.CharField(max_length=255, null=True, blank=True, verbose_name="SaarVV Device ID")
+    saarvv_next_sync_at = models.DateTimeField(blank=True, null=True, db_index=True, verbose_name="SaarVV next sync at")
+    saarvv_sync_state = models.JSONField(default=dict, blank=True, verbose_name="SaarVV ticket fingerprints")
 
     def __str__(self):
         return str(self.user)
@@ -96,6 +99,12 @@ class Ticket(models.Model):
     def public_id(self):
         return self.pk.upper()[0:8]
 
+    def ticket_context(self) -> vdv.ticket.Context:
+        return vdv.ticket.Context(
+            account_forename=self.account.user.first_name if self.account else None,
+            account_surname=self.account.user.last_name if self.account else None,
+        )
+
 
     def active_instance(self):
         now = timezone.now()
@@ -162,6 +171,15 @@ class VDVTicketInstance(models.Model):
         return f"{self.ticket_org_id} - {self.ticket_number}"
 
     def as_ticket(self) -> t.VDVTicket:
+        context = self.ticket.ticket_context()
+        return ticket_cache.get_ticket_cache().get_or_parse(
+            ticket_cache.TicketCache.make_key(
+                "vdv", bytes(self.barcode_data), context.account_forename, context.account_surname
+            ),
+            lambda: self.parse_ticket(context)
+        )
+
+    def parse_ticket(self, context: vdv.ticket.Context) -> t.VDVTicket:
         config = dacite.Config(type_hooks={bytes: base64.b64decode})
         raw_ticket = base64.b64decode(self.decoded_data["ticket"])
 
@@ -170,14 +188,38 @@ class VDVTicketInstance(models.Model):
             issuing_ca=dacite.from_dict(data_class=vdv.CertificateData, data=self.decoded_data["issuing_ca"], config=config),
             envelope_certificate=dacite.from_dict(data_class=vdv.CertificateData, data=self.decoded_data["envelope_certificate"], config=config),
             raw_ticket=raw_ticket,
-            ticket=vdv.VDVTicket.parse(raw_ticket, vdv.ticket.Context(
-                account_forename=self.ticket.account.user.first_name if self.ticket.account else None,
-                account_surname=self.ticket.account.user.last_name if self.ticket.account else None,
-            ))
+            ticket=vdv.VDVTicket.parse(raw_ticket, context)
         )
 
 
-class UICTicketInstance(models.Model):
+class SignedTicketInstance(models.Model):
+    signature_valid = models.BooleanField(blank=True, null=True, verbose_name="Signature valid")
+    signature_key_fingerprint = models.CharField(
+        max_length=64, blank=True, null=True, verbose_name="Signature key fingerprint"
+    )
+    signature_key_ring_version = models.CharField(
+        max_length=255, blank=True, null=True, verbose_name="Signature key ring version"
+    )
+    signature_verified_at = models.DateTimeField(blank=True, null=True, verbose_name="Signature verified at")
+
+    SIGNATURE_FIELDS = [
+        "signature_valid", "signature_key_fingerprint", "signature_key_ring_version", "signature_verified_at"
+    ]
+
+    class Meta:
+        abstract = True
+
+    def parse_envelope(self):
+        raise NotImplementedError()
+
+    def apply_verification_result(self, result: uic.certs.VerificationResult):
+        self.signature_valid = result.valid
+        self.signature_key_fingerprint = result.key_fingerprint
+        self.signature_key_ring_version = result.key_ring_version
+        self.signature_verified_at = result.verified_at
+
+
+class UICTicketInstance(SignedTicketInstance):
     ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name="uic_instances")
     reference = models.CharField(max_length=20, verbose_name="Ticket ID")
     distributor_rics = models.PositiveIntegerField(validators=[validators.MaxValueValidator(9999)], verbose_name="Distributor RICS")
@@ -197,14 +239,20 @@ class UICTicketInstance(models.Model):
     def __str__(self):
         return f"{self.distributor_rics} - {self.reference}"
 
+    def parse_envelope(self) -> uic.Envelope:
+        return uic.Envelope.parse(bytes(self.barcode_data))
+
     def as_ticket(self) -> t.UICTicket:
-        config = dacite.Config(type_hooks={bytes: base64.b64decode})
-        context = vdv.ticket.Context(
-            account_forename=self.ticket.account.user.first_name if self.ticket.account else None,
-            account_surname=self.ticket.account.user.last_name if self.ticket.account else None,
+        context = self.ticket.ticket_context()
+        return ticket_cache.get_ticket_cache().get_or_parse(
+            ticket_cache.TicketCache.make_key(
+                "uic", bytes(self.barcode_data), context.account_forename, context.account_surname
+            ),
+            lambda: self.parse_ticket(context)
         )
 
-        ticket_envelope = dacite.from_dict(data_class=uic.Envelope, data=self.decoded_data["envelope"], config=config)
+    def parse_ticket(self, context: vdv.ticket.Context) -> t.UICTicket:
+        ticket_envelope = uic.Envelope.from_json(self.decoded_data["envelope"])
         return t.UICTicket.from_envelope(bytes(self.barcode_data), ticket_envelope, context)
 
 
@@ -228,6 +276,12 @@ class RSPTicketInstance(models.Model):
         return f"{self.issuer_id} - {self.reference}"
 
     def as_ticket(self) -> t.RSPTicket:
+        return ticket_cache.get_ticket_cache().get_or_parse(
+            ticket_cache.TicketCache.make_key("rsp", bytes(self.barcode_data), self.ticket_type),
+            self.parse_ticket
+        )
+
+    def parse_ticket(self) -> t.RSPTicket:
         raw_ticket = base64.b64decode(self.decoded_data["raw_ticket"])
         if self.ticket_type == "08":
             data = rsp.RailcardData.parse(raw_ticket)
@@ -256,8 +310,14 @@ class SNCFTicketInstance(models.Model):
         return str(self.reference)
 
     def as_ticket(self) -> t.SNCFTicket:
+        return ticket_cache.get_ticket_cache().get_or_parse(
+            ticket_cache.TicketCache.make_key("sncf", bytes(self.barcode_data)),
+            self.parse_ticket
+        )
+
+    def parse_ticket(self) -> t.SNCFTicket:
         return t.SNCFTicket(
-            raw_ticket=self.barcode_data,
+            raw_ticket=bytes(self.barcode_data),
             data=sncf.SNCFTicket.parse(bytes(self.barcode_data))
         )
 
@@ -278,13 +338,19 @@ class ELBTicketInstance(models.Model):
         return f"{self.pnr} - {self.sequence_number}"
 
     def as_ticket(self) -> t.ELBTicket:
+        return ticket_cache.get_ticket_cache().get_or_parse(
+            ticket_cache.TicketCache.make_key("elb", bytes(self.barcode_data)),
+            self.parse_ticket
+        )
+
+    def parse_ticket(self) -> t.ELBTicket:
         return t.ELBTicket(
             raw_ticket=bytes(self.barcode_data),
             data=elb.ELBTicket.parse(bytes(self.barcode_data)),
         )
 
 
-class SSBTicketInstance(models.Model):
+class SSBTicketInstance(SignedTicketInstance):
     ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name="ssb_instances")
     distributor_rics = models.PositiveIntegerField(validators=[validators.MaxValueValidator(9999)], verbose_name="Distributor RICS")
     pnr = models.CharField(max_length=32, verbose_name="PNR", blank=True, null=True, unique=True)
@@ -296,7 +362,16 @@ class SSBTicketInstance(models.Model):
     def __str__(self):
         return str(self.pnr)
 
+    def parse_envelope(self) -> ssb.Envelope:
+        return ssb.Envelope.parse(bytes(self.barcode_data))
+
     def as_ticket(self) -> t.SSBTicket:
+        return ticket_cache.get_ticket_cache().get_or_parse(
+            ticket_cache.TicketCache.make_key("ssb", bytes(self.barcode_data)),
+            self.parse_ticket
+        )
+
+    def parse_ticket(self) -> t.SSBTicket:
         envelope = ssb.Envelope.parse(bytes(self.barcode_data))
 
         if envelope.ticket_type == 1:
@@ -346,7 +421,7 @@ class AppleRegistration(models.Model):
 class DBSubscription(models.Model):
     account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name="subscriptions")
     device_token = models.CharField(max_length=255, verbose_name="Device token", unique=True)
-    refresh_at = models.DateTimeField(verbose_name="Refresh at")
+    refresh_at = models.DateTimeField(verbose_name="Refresh at", db_index=True)
     info = models.JSONField(verbose_name="Info", default=dict)
 
     class Meta:
@@ -369,3 +444,41 @@ class DBSubscription(models.Model):
                 end = datetime.datetime.fromisoformat(info["anzeigeBis"])
                 if start > now and end < now:
                     return info["huelleInfo"]
+
+
+class RedecodeCheckpoint(models.Model):
+    job = models.CharField(max_length=255, verbose_name="Job")
+    model = models.CharField(max_length=255, verbose_name="Ticket instance model")
+    last_pk = models.BigIntegerField(blank=True, null=True, verbose_name="Last processed ID")
+    processed = models.PositiveIntegerField(default=0, verbose_name="Processed")
+    changed = models.PositiveIntegerField(default=0, verbose_name="Changed")
+    failed = models.PositiveIntegerField(default=0, verbose_name="Failed")
+    started_at = models.DateTimeField(auto_now_add=True, verbose_name="Started at")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated at")
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name="Finished at")
+
+    class Meta:
+        unique_together = [
+            ["job", "model"],
+        ]
+        verbose_name = "Re-decode checkpoint"
+
+    def __str__(self):
+        return f"{self.job} - {self.model}"
+
+
+class SubscriptionBarcode(models.Model):
+    image_digest = models.CharField(max_length=64, unique=True, verbose_name="Image SHA-256")
+    barcode_digest = models.CharField(max_length=64, db_index=True, verbose_name="Barcode SHA-256")
+    barcode_data = models.BinaryField()
+    ticket = models.ForeignKey(
+        Ticket, on_delete=models.CASCADE, null=True, blank=True, related_name="subscription_barcodes"
+    )
+    parser_version = models.PositiveIntegerField(verbose_name="Parser version")
+    ingested_at = models.DateTimeField(verbose_name="Ingested at")
+
+    class Meta:
+        verbose_name = "Subscription barcode"
+
+    def __str__(self):
+        return self.image_digest
@@ -0,0 +1,178 @@
+import concurrent.futures
+import dataclasses
+import logging
+import threading
+import typing
+import numpy as np
+import pymupdf
+
+from . import aztec
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 4
+RENDER_DPI = 200
+MAX_RENDER_PAGES = 10
+MIN_IMAGE_SIDE = 64
+MAX_IMAGE_SIDE = 4000
+# Images queued or decoding at once across every scan sharing the pool, each one holds a decoded bitmap
+MAX_PENDING = 2 * WORKERS
+
+
+@dataclasses.dataclass
+class Candidate:
+    score: float
+    page: int
+    xref: int
+
+
+@dataclasses.dataclass
+class ScanResult:
+    data: bytes
+    page: int
+    source: str
+    pass_name: str
+
+
+def image_score(width: int, height: int, bpc: int, colorspace: str) -> float:
+    # Ranked from the image metadata alone, so nothing is extracted until it's decoded
+    if min(width, height) < MIN_IMAGE_SIDE or max(width, height) > MAX_IMAGE_SIDE:
+        return 0
+    score = min(width, height) / max(width, height)
+    # Aztec and QR codes are square, PDF417 codes are wide but still bi-level
+    if bpc == 1:
+        score += 1
+    elif colorspace in ("DeviceGray", "Indexed", "ICCBased"):
+        score += 0.5
+    if 150 <= min(width, height) <= 1500:
+        score += 0.5
+    return score
+
+
+def candidates(pdf: pymupdf.Document) -> typing.List[Candidate]:
+    seen = set()
+    found = []
+    for page_index in range(len(pdf)):
+        for xref, _, width, height, bpc, colorspace, *_ in pdf.get_page_images(page_index):
+            if xref in seen:
+                continue
+            seen.add(xref)
+            score = image_score(width, height, bpc, colorspace)
+            if score > 0:
+                found.append(Candidate(score=score, page=page_index, xref=xref))
+    # Earlier pages first among equally likely images
+    found.sort(key=lambda c: (-c.score, c.page))
+    return found
+
+
+def pixmap_array(pixmap: pymupdf.Pixmap) -> np.ndarray:
+    if pixmap.alpha:
+        pixmap = pymupdf.Pixmap(pixmap, 0)
+    if pixmap.n != 1:
+        pixmap = pymupdf.Pixmap(pymupdf.csGRAY, pixmap)
+    img = np.frombuffer(pixmap.samples, dtype="uint8").reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+    return np.ascontiguousarray(img)
+
+
+def extracted_images(pdf: pymupdf.Document, found: typing.List[Candidate]):
+    # Going through a pixmap also covers JBIG2 and other encodings OpenCV can't read
+    for candidate in found:
+        try:
+            img = pixmap_array(pymupdf.Pixmap(pdf, candidate.xref))
+        except (RuntimeError, ValueError):
+            logger.debug("Unable to extract image %d on page %d", candidate.xref, candidate.page + 1)
+            continue
+        yield candidate.page, "image", img
+
+
+def rendered_pages(pdf: pymupdf.Document):
+    for page_index in range(min(len(pdf), MAX_RENDER_PAGES)):
+        try:
+            pixmap = pdf[page_index].get_pixmap(dpi=RENDER_DPI, colorspace=pymupdf.csGRAY)
+        except RuntimeError:
+            logger.debug("Unable to render page %d", page_index + 1)
+            continue
+        yield page_index, "render", pixmap_array(pixmap)
+
+
+def decode_job(
+        page: int, source: str, img: np.ndarray, hint: typing.Optional[str]
+) -> typing.Optional[ScanResult]:
+    try:
+        result = aztec.get_decoder_pool().decode_array(img, hint)
+    except aztec.AztecError:
+        return None
+    return ScanResult(data=result.data, page=page, source=source, pass_name=result.pass_name)
+
+
+EXECUTOR = None
+EXECUTOR_LOCK = threading.Lock()
+PENDING_SLOTS = threading.BoundedSemaphore(MAX_PENDING)
+
+
+def get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global EXECUTOR
+
+    with EXECUTOR_LOCK:
+        if not EXECUTOR:
+            EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="pdf-scan")
+
+    return EXECUTOR
+
+
+def submit_decode(
+        executor: concurrent.futures.Executor, page: int, source: str, img: np.ndarray, hint: typing.Optional[str]
+) -> concurrent.futures.Future:
+    # Decodes left running by a finished scan keep their slot, so later scans wait rather than pile up behind them
+    PENDING_SLOTS.acquire()
+    try:
+        future = executor.submit(decode_job, page, source, img, hint)
+    except BaseException:
+        PENDING_SLOTS.release()
+        raise
+    future.add_done_callback(lambda _: PENDING_SLOTS.release())
+    return future
+
+
+def first_decoded(
+        executor: concurrent.futures.Executor, jobs: typing.Iterator, hint: typing.Optional[str], workers: int
+) -> typing.Optional[ScanResult]:
+    # PyMuPDF isn't thread safe, so images are extracted on this thread and only as fast as the pool decodes them
+    pending = set()
+    try:
+        for page, source, img in jobs:
+            pending.add(submit_decode(executor, page, source, img, hint))
+            while len(pending) >= workers:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if result := future.result():
+                        return result
+
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if result := future.result():
+                    return result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def find_barcode(
+        pdf: pymupdf.Document, hint: typing.Optional[str] = None, workers: int = WORKERS
+) -> typing.Optional[ScanResult]:
+    found = candidates(pdf)
+    executor = get_executor()
+    result = first_decoded(executor, extracted_images(pdf, found), hint, workers)
+    if not result:
+        # Vector-drawn codes have no embedded image to find
+        result = first_decoded(executor, rendered_pages(pdf), hint, workers)
+
+    if result:
+        logger.info(
+            "Found barcode on page %d of %d from %s in the %s pass", result.page + 1, len(pdf), result.source,
+            result.pass_name
+        )
+    else:
+        logger.info("No barcode in %d page PDF with %d candidate images", len(pdf), len(found))
+    return result
@@ -0,0 +1,233 @@
+import concurrent.futures
+import dataclasses
+import json
+import logging
+import multiprocessing
+import typing
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, JSONField
+from django.utils import timezone
+
+from . import models, ticket, ticket_cache, vdv
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_MODELS = {
+    "vdv": models.VDVTicketInstance,
+    "uic": models.UICTicketInstance,
+    "rsp": models.RSPTicketInstance,
+    "sncf": models.SNCFTicketInstance,
+    "elb": models.ELBTicketInstance,
+    "ssb": models.SSBTicketInstance,
+}
+
+
+def default_job_name() -> str:
+    return f"parser-{ticket_cache.PARSER_VERSION}-{settings.GIT_HASH or 'dev'}"
+
+
+@dataclasses.dataclass
+class Redecoded:
+    ticket_id: str
+    ticket_type: str
+    model: typing.Type["models.Model"]
+    fields: dict
+
+
+@dataclasses.dataclass
+class ChunkResult:
+    processed: int = 0
+    changed: int = 0
+    failed: int = 0
+    moved: int = 0
+
+
+def redecode_instance(
+        item: typing.Tuple[int, bytes, typing.Optional[str], typing.Optional[str]]
+) -> typing.Tuple[int, typing.Optional[Redecoded], typing.Optional[str]]:
+    pk, barcode_data, forename, surname = item
+    context = vdv.ticket.Context(account_forename=forename, account_surname=surname)
+    try:
+        decoded = ticket.decode_ticket(barcode_data, context)
+        # Signatures are re-checked by reverify-signatures, only the parsed fields are compared here
+        model, lookup, defaults = ticket.ticket_instance_values(barcode_data, decoded, verify_signature=False)
+    except ticket.TicketError as e:
+        return pk, None, f"{e.title}: {e.message}"
+    except Exception as e:
+        # A parser bug tripped by one stored barcode mustn't abort the whole job
+        logger.exception("Unexpected error re-decoding instance %s", pk)
+        return pk, None, f"Unexpected error: {e!r}"
+
+    defaults.pop("barcode_data")
+    return pk, Redecoded(
+        ticket_id=decoded.pk(),
+        ticket_type=decoded.type(),
+        model=model,
+        fields={**lookup, **defaults},
+    ), None
+
+
+def keyset_chunks(qs, chunk_size: int, last_pk=None) -> typing.Iterator[list]:
+    # iterator() can't stream on CockroachDB, which has no server-side cursors, so each chunk is its own bounded
+    # query starting after the last key seen
+    qs = qs.order_by("pk")
+    while True:
+        chunk = list((qs if last_pk is None else qs.filter(pk__gt=last_pk))[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def normalise(field, value):
+    # JSON columns come back from the database with lists for tuples etc.
+    if isinstance(field, JSONField):
+        return json.loads(json.dumps(value, cls=field.encoder))
+    return value
+
+
+def apply_chunk(
+        checkpoint: "models.RedecodeCheckpoint", model: typing.Type["models.Model"],
+        instances: typing.List["models.Model"], results, dry_run: bool
+) -> ChunkResult:
+    result = ChunkResult(processed=len(instances))
+    by_pk = {instance.pk: instance for instance in instances}
+    changed = []
+    changed_fields = set()
+    tickets = {}
+    ticket_types = {}
+
+    for pk, redecoded, error in results:
+        instance = by_pk[pk]
+        if not redecoded:
+            result.failed += 1
+            logger.error("Unable to re-decode %s %s: %s", model._meta.verbose_name, pk, error)
+            continue
+        if redecoded.model is not model:
+            result.failed += 1
+            logger.error(
+                "%s %s now decodes as a %s, leaving it alone", model._meta.verbose_name, pk,
+                redecoded.model._meta.verbose_name
+            )
+            continue
+
+        fields = set()
+        for name, value in redecoded.fields.items():
+            field = model._meta.get_field(name)
+            if normalise(field, getattr(instance, name)) != normalise(field, value):
+                setattr(instance, name, value)
+                fields.add(name)
+        if instance.ticket_id != redecoded.ticket_id:
+            tickets.setdefault(redecoded.ticket_id, instance.ticket)
+            instance.ticket_id = redecoded.ticket_id
+            fields.add("ticket")
+            result.moved += 1
+        if instance.ticket.ticket_type != redecoded.ticket_type:
+            ticket_types[redecoded.ticket_id] = redecoded.ticket_type
+
+        if fields:
+            changed.append(instance)
+            changed_fields.update(fields)
+
+    result.changed = len(changed)
+    if dry_run:
+        return result
+
+    with transaction.atomic():
+        existing = set(models.Ticket.objects.filter(pk__in=tickets).values_list("pk", flat=True))
+        # Keep the account and subscription links of the ticket the instance used to belong to
+        models.Ticket.objects.bulk_create([
+            models.Ticket(
+                id=ticket_id,
+                ticket_type=ticket_types.get(ticket_id, old.ticket_type),
+                last_updated=old.last_updated,
+                account_id=old.account_id,
+                db_subscription_id=old.db_subscription_id,
+                saarvv_account_id=old.saarvv_account_id,
+                photos=old.photos,
+            ) for ticket_id, old in tickets.items() if ticket_id not in existing
+        ])
+        if changed:
+            model.objects.bulk_update(changed, sorted(changed_fields), batch_size=500)
+        for ticket_type in set(ticket_types.values()):
+            models.Ticket.objects.filter(
+                pk__in=[pk for pk, t in ticket_types.items() if t == ticket_type]
+            ).update(ticket_type=ticket_type)
+
+        models.RedecodeCheckpoint.objects.filter(pk=checkpoint.pk).update(
+            last_pk=instances[-1].pk,
+            processed=F("processed") + result.processed,
+            changed=F("changed") + result.changed,
+            failed=F("failed") + result.failed,
+            updated_at=timezone.now(),
+        )
+
+    return result
+
+
+def redecode(
+        model: typing.Type["models.Model"],
+        job: str,
+        workers: typing.Optional[int] = None,
+        chunk_size: int = 1000,
+        dry_run: bool = False,
+        restart: bool = False,
+) -> typing.Tuple["models.RedecodeCheckpoint", ChunkResult]:
+    lookup = {"job": job, "model": model._meta.label_lower}
+    if dry_run:
+        # A dry run looks at every instance and leaves any stored checkpoint as it was
+        checkpoint = models.RedecodeCheckpoint(**lookup)
+    else:
+        checkpoint, _ = models.RedecodeCheckpoint.objects.get_or_create(**lookup)
+        if restart:
+            checkpoint.last_pk = None
+            checkpoint.processed = checkpoint.changed = checkpoint.failed = 0
+            checkpoint.finished_at = None
+            checkpoint.save()
+
+    total = ChunkResult()
+    if checkpoint.finished_at:
+        return checkpoint, total
+
+    qs = model.objects.select_related("ticket__account__user")
+
+    def apply(chunk, results):
+        r = apply_chunk(checkpoint, model, chunk, results, dry_run)
+        total.processed += r.processed
+        total.changed += r.changed
+        total.failed += r.failed
+        total.moved += r.moved
+        logger.info(
+            "%s: re-decoded up to %s, %d processed, %d changed", model._meta.verbose_name, chunk[-1].pk,
+            total.processed, total.changed
+        )
+
+    # Forked workers must not share the parent's database connections, so they're started before the first query
+    connections.close_all()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+    ) as executor:
+        executor.submit(int).result()
+        # Keep one chunk decoding on the pool while the previous one is compared and written
+        pending = None
+        for chunk in keyset_chunks(qs, chunk_size, checkpoint.last_pk):
+            results = executor.map(redecode_instance, [
+                (
+                    instance.pk, bytes(instance.barcode_data),
+                    instance.ticket.account.user.first_name if instance.ticket.account else None,
+                    instance.ticket.account.user.last_name if instance.ticket.account else None,
+                ) for instance in chunk
+            ], chunksize=max(1, chunk_size // 32))
+            if pending:
+                apply(*pending)
+            pending = (chunk, results)
+        if pending:
+            apply(*pending)
+
+    if not dry_run:
+        checkpoint.refresh_from_db()
+        checkpoint.finished_at = timezone.now()
+        checkpoint.save()
+
+    return checkpoint, total
@@ -0,0 +1,121 @@
+import datetime
+import logging
+import random
+import time
+import typing
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import apn, barcode_cache, db_abo, models, saarvv
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("db-abo", "saarvv")
+# How long a claimed row is left to the worker that claimed it before another one retries it
+LEASE = datetime.timedelta(minutes=10)
+JITTER = datetime.timedelta(minutes=5)
+SAARVV_INTERVAL = datetime.timedelta(hours=1)
+CLAIM_SIZE = 100
+POLL_INTERVAL = 30
+RENEWAL_INTERVAL = datetime.timedelta(minutes=15)
+
+
+def jitter() -> datetime.timedelta:
+    return datetime.timedelta(seconds=random.uniform(0, JITTER.total_seconds()))
+
+
+def claim(queryset, field: str, limit: int, until: datetime.datetime) -> list:
+    # Rows another worker is claiming are skipped rather than waited on, and pushing their due time forward before
+    # committing keeps them out of every other claim until the lease runs out
+    with transaction.atomic():
+        rows = list(queryset.select_for_update(skip_locked=True, of=("self",)).order_by(field)[:limit])
+        if rows:
+            queryset.model.objects.filter(pk__in=[row.pk for row in rows]).update(**{field: until})
+    return rows
+
+
+def claim_due_subscriptions(limit: int = CLAIM_SIZE) -> typing.List[models.DBSubscription]:
+    now = timezone.now()
+    return claim(
+        models.DBSubscription.objects.filter(refresh_at__lte=now).select_related("account"),
+        "refresh_at", limit, now + LEASE + jitter()
+    )
+
+
+def claim_due_saarvv_accounts(limit: int = CLAIM_SIZE) -> typing.List[models.Account]:
+    now = timezone.now()
+    # Nothing upstream says when a SaarVV account changes, so each one is synced on a fixed interval
+    return claim(
+        models.Account.objects.filter(saarvv_device_id__isnull=False, saarvv_token__isnull=False)
+        .filter(Q(saarvv_next_sync_at__lte=now) | Q(saarvv_next_sync_at__isnull=True)),
+        "saarvv_next_sync_at", limit, now + SAARVV_INTERVAL + jitter()
+    )
+
+
+def refresh_db_abo(claim_size: int = CLAIM_SIZE, **options) -> int:
+    stats = db_abo.BatchStats()
+    processed = 0
+    while abos := claim_due_subscriptions(claim_size):
+        db_abo.refresh_all(abos, stats=stats, **options)
+        processed += len(abos)
+    if processed:
+        stats.log()
+    return processed
+
+
+def refresh_saarvv(claim_size: int = CLAIM_SIZE, concurrency: typing.Optional[int] = None) -> int:
+    stats = barcode_cache.CacheStats()
+    processed = 0
+    while accounts := claim_due_saarvv_accounts(claim_size):
+        saarvv.get_client().sync_accounts(accounts, stats, concurrency)
+        processed += len(accounts)
+    if processed:
+        stats.log("SaarVV accounts")
+    return processed
+
+
+def notify_renewals(sources: typing.Iterable[str]):
+    query = Q()
+    if "db-abo" in sources:
+        query |= Q(db_subscription__isnull=False)
+    if "saarvv" in sources:
+        query |= Q(saarvv_account__isnull=False)
+    if query:
+        if renewed := apn.notify_renewed_tickets(models.Ticket.objects.filter(query)):
+            logger.info("Notified %d renewed tickets", len(renewed))
+
+
+def run_once(
+        sources: typing.Iterable[str] = SOURCES, claim_size: int = CLAIM_SIZE, renewals: bool = True,
+        saarvv_concurrency: typing.Optional[int] = None, **db_abo_options
+) -> int:
+    processed = 0
+    if "db-abo" in sources:
+        processed += refresh_db_abo(claim_size, **db_abo_options)
+    if "saarvv" in sources:
+        processed += refresh_saarvv(claim_size, saarvv_concurrency)
+    if renewals:
+        notify_renewals(sources)
+    return processed
+
+
+def run_forever(
+        sources: typing.Iterable[str] = SOURCES, claim_size: int = CLAIM_SIZE, poll_interval: float = POLL_INTERVAL,
+        saarvv_concurrency: typing.Optional[int] = None, **db_abo_options
+):
+    logger.info("Refreshing %s every %ds", ", ".join(sources), poll_interval)
+    last_renewals = None
+    while True:
+        close_old_connections()
+        now = time.monotonic()
+        renewals = last_renewals is None or now - last_renewals >= RENEWAL_INTERVAL.total_seconds()
+        try:
+            if processed := run_once(sources, claim_size, renewals, saarvv_concurrency, **db_abo_options):
+                logger.info("Refreshed %d due subscriptions and accounts", processed)
+            if renewals:
+                last_renewals = now
+        except Exception:
+            logger.exception("Subscription refresh failed")
+        # Workers started together shouldn't keep polling in lockstep
+        time.sleep(poll_interval * random.uniform(0.5, 1.5))
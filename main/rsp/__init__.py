@@ -1,5 +1,5 @@
 from .envelope import Envelope
 from .util import RSPException
-from .pki import CertificateStore, Certificate
+from .pki import CertificateStore, Certificate, get_certificate_store
 from .data import RailcardData, TicketData
 from . import locations, ticket_data, issuers
\ No newline at end of file
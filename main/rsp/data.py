@@ -1,35 +1,17 @@
 import dataclasses
 import datetime
-import bitstring
 import pytz
 import typing
 import decimal
 from . import locations, util, issuers
+from .. import bits
 
 TZ = pytz.timezone("Europe/London")
 
 
-class BitStream:
-    data: bitstring.ConstBitStream
-
+class BitStream(bits.BitReader):
     def __init__(self, data: bytes):
-        self.data = bitstring.ConstBitStream(data)
-
-    def read_bool(self, index: int) -> bool:
-        return bool(self.data[index])
-
-    def read_bytes(self, start: int, end: int) -> bytes:
-        return self.data[start:end].bytes
-
-    def read_string(self, start: int, end: int) -> str:
-        out = bytearray()
-        for i in range(start, end, 6):
-            out.append(self.data[i:i+6].uint + 0x20)
-
-        return out.decode("ascii").strip()
-
-    def read_int(self, start: int, end: int) -> int:
-        return self.data[start:end].uint
+        super().__init__(data, util.RSPException)
 
     def read_date(self, start: int, end: int) -> datetime.date:
         i = self.read_int(start, end)
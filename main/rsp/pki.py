@@ -2,8 +2,15 @@ import dataclasses
 import json
 import datetime
 import typing
+import time
+import threading
 import django.core.files.storage
 
+from .. import storage_util
+
+RELOAD_INTERVAL = 5 * 60
+MATCH_SCORE_DECAY = 0.9
+
 @dataclasses.dataclass
 class Certificate:
     issuer_id: str
@@ -28,9 +35,17 @@ class Certificate:
 
 class CertificateStore:
     certificates: typing.Dict[str, typing.List[Certificate]]
+    match_scores: typing.Dict[typing.Tuple[str, int], float]
+    attempts: typing.Dict[int, int]
 
     def __init__(self):
         self.certificates = {}
+        self.match_scores = {}
+        self.attempts = {}
+        self.failures = 0
+        self.version = None
+        self.checked_at = None
+        self._lock = threading.Lock()
 
     def load_certificates(self):
         certificates = {}
@@ -40,4 +55,69 @@ class CertificateStore:
             for issuer, keys in data.items():
                 keys = list(map(lambda k: Certificate.from_json(k), keys))
                 certificates[issuer] = keys
-        self.certificates = certificates
\ No newline at end of file
+        self.certificates = certificates
+
+    def reload_if_changed(self):
+        if self.checked_at is not None and time.monotonic() - self.checked_at < RELOAD_INTERVAL:
+            return
+
+        with self._lock:
+            if self.checked_at is not None and time.monotonic() - self.checked_at < RELOAD_INTERVAL:
+                return
+
+            certificate_storage = django.core.files.storage.storages["rsp-data"]
+            version = storage_util.file_version(certificate_storage, "keys.json")
+            if self.checked_at is None or version != self.version:
+                self.load_certificates()
+                self.match_scores = {}
+                self.version = version
+            self.checked_at = time.monotonic()
+
+    def candidate_keys(self, issuer_id: str, at: typing.Optional[datetime.datetime] = None) -> typing.List[Certificate]:
+        if at is None:
+            at = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+
+        def sort_key(cert: Certificate):
+            return (
+                not (cert.valid_from <= at <= cert.valid_until),
+                -self.match_scores.get((issuer_id, cert.modulus), 0),
+                -cert.valid_from.timestamp(),
+            )
+
+        return sorted(self.certificates.get(issuer_id, []), key=sort_key)
+
+    def record_match(self, issuer_id: str, cert: typing.Optional[Certificate], attempts: int):
+        self.attempts[attempts] = self.attempts.get(attempts, 0) + 1
+        if not cert:
+            self.failures += 1
+            return
+
+        for key in list(self.match_scores):
+            if key[0] == issuer_id:
+                self.match_scores[key] *= MATCH_SCORE_DECAY
+        score_key = (issuer_id, cert.modulus)
+        self.match_scores[score_key] = self.match_scores.get(score_key, 0) + 1
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        decodes = sum(self.attempts.values())
+        return {
+            "issuers": len(self.certificates),
+            "keys": sum(len(k) for k in self.certificates.values()),
+            "decodes": decodes,
+            "failures": self.failures,
+            "mean_attempts": sum(a * c for a, c in self.attempts.items()) / decodes if decodes else 0,
+            "attempts": dict(sorted(self.attempts.items())),
+        }
+
+
+CERTIFICATE_STORE = None
+
+
+def get_certificate_store() -> CertificateStore:
+    global CERTIFICATE_STORE
+
+    if not CERTIFICATE_STORE:
+        CERTIFICATE_STORE = CertificateStore()
+
+    CERTIFICATE_STORE.reload_if_changed()
+    return CERTIFICATE_STORE
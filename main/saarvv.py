@@ -1,3 +1,4 @@
+import concurrent.futures
 import niquests
 import secrets
 import hashlib
@@ -7,15 +8,22 @@ import hmac
 import urllib3.util
 import base64
 import logging
+import typing
 from Crypto.Cipher import AES
 from django.core.files.storage import storages
-from . import models, aztec, ticket, apn
+from django.db import connection
+from . import models, aztec, ticket, barcode_cache
 
 logger = logging.getLogger(__name__)
 
 VERSION = "3.10.17"
 COMMIT_HASH = "h183ab339"
+BASE_URL = "https://saarvv.tickeos.de/index.php/mobileService"
+CONCURRENCY = 4
+REQUEST_TIMEOUT = 60
 EOS_INSTANCE = None
+SIGNER = None
+CLIENT = None
 
 
 def get_device_id():
@@ -41,79 +49,163 @@ def get_eos_instance():
     return eos_instance
 
 
+class RequestSigner:
+    def __init__(self, eos: dict):
+        self.user_agent = (f"{eos['clientName']}/{VERSION}/{eos['mobileServiceAPIVersion']}/"
+                           f"{eos['identifier']} (VDV PKPass q@magicalcodewit.ch)")
+        self.mac_key = eos["applicationKey"].encode("utf-8")
+
+    def sign(self, request: niquests.PreparedRequest, device_id: str) -> niquests.PreparedRequest:
+        request.headers["User-Agent"] = self.user_agent
+        request.headers["X-Eos-Date"] = datetime.datetime.now(datetime.UTC).strftime('%a, %d %b %Y %H:%M:%S GMT')
+        request.headers["Device-Identifier"] = device_id
+
+        mac1 = hmac.new(self.mac_key, request.body, "sha512").hexdigest()
+        scheme, auth, host, port, path, query, fragment = urllib3.util.parse_url(request.url)
+        default_port = 443 if scheme == "https" else 80
+        mac2_msg = f"{mac1}|{host}|{port or default_port}|{path}"
+        if query:
+            mac2_msg += f"?{query}"
+        x_eos_date = request.headers.get("X-Eos-Date", "")
+        content_type = request.headers.get("Content-Type", "")
+        authorization = request.headers.get("Authorization", "")
+        x_eos_anonymous = request.headers.get("X-TICKeos-Anonymous", "")
+        x_eos_sso = request.headers.get("X-TICKeos-SSO", "")
+        user_agent = request.headers.get("User-Agent", "")
+        mac2_msg += f"|{x_eos_date}|{content_type}|{authorization}|{x_eos_anonymous}|{x_eos_sso}|{user_agent}"
+        mac2 = hmac.new(self.mac_key, mac2_msg.encode("utf-8"), "sha512").hexdigest()
+        request.headers["X-Api-Signature"] = mac2
+
+        return request
+
+
+def get_signer() -> RequestSigner:
+    global SIGNER
+
+    if not SIGNER:
+        SIGNER = RequestSigner(get_eos_instance())
+
+    return SIGNER
+
+
 def sign_request(request: niquests.PreparedRequest, device_id: str) -> niquests.PreparedRequest:
-    eos = get_eos_instance()
-
-    request.headers["User-Agent"] = (f"{eos['clientName']}/{VERSION}/{eos['mobileServiceAPIVersion']}/"
-                                     f"{eos['identifier']} (VDV PKPass q@magicalcodewit.ch)")
-    request.headers["X-Eos-Date"] = datetime.datetime.now(datetime.UTC).strftime('%a, %d %b %Y %H:%M:%S GMT')
-    request.headers["Device-Identifier"] = device_id
-
-    mac_key = eos["applicationKey"].encode("utf-8")
-    mac1 = hmac.new(mac_key, request.body, "sha512").hexdigest()
-    scheme, auth, host, port, path, query, fragment = urllib3.util.parse_url(request.url)
-    default_port = 443 if scheme == "https" else 80
-    mac2_msg = f"{mac1}|{host}|{port or default_port}|{path}"
-    if query:
-        mac2_msg += f"?{query}"
-    x_eos_date = request.headers.get("X-Eos-Date", "")
-    content_type = request.headers.get("Content-Type", "")
-    authorization = request.headers.get("Authorization", "")
-    x_eos_anonymous = request.headers.get("X-TICKeos-Anonymous", "")
-    x_eos_sso = request.headers.get("X-TICKeos-SSO", "")
-    user_agent = request.headers.get("User-Agent", "")
-    mac2_msg += f"|{x_eos_date}|{content_type}|{authorization}|{x_eos_anonymous}|{x_eos_sso}|{user_agent}"
-    mac2 = hmac.new(mac_key, mac2_msg.encode("utf-8"), "sha512").hexdigest()
-    request.headers["X-Api-Signature"] = mac2
-
-    return request
-
-
-def update_all():
-    for account in models.Account.objects.filter(saarvv_device_id__isnull=False):
-        update_saarvv_tickets(account)
-
-        for t in account.saarvv_tickets.all():
-            apn.notify_ticket_if_renewed(t)
-
-
-def update_saarvv_tickets(account: models.Account):
-    if not account.saarvv_token or not account.saarvv_device_id:
-        return
-
-    r = niquests.post(f"https://saarvv.tickeos.de/index.php/mobileService/sync", json={}, hooks={
-        "pre_request": [lambda req: sign_request(req, account.saarvv_device_id)],
-    }, headers={
-        "Authorization": account.saarvv_token
-    })
-    if r.status_code != 200:
-        logger.error(f"Failed to update SaarVV {account.saarvv_device_id}: {r.text}")
-    data = r.json()
-
-    r = niquests.post(f"https://saarvv.tickeos.de/index.php/mobileService/ticket", json={
-        "details": True,
-        "tickets": data["tickets"],
-        "provide_aztec_content": False,
-        "parameters": False,
-    }, hooks={
-        "pre_request": [lambda req: sign_request(req, account.saarvv_device_id)],
-    }, headers={
-        "Authorization": account.saarvv_token
-    })
-    if r.status_code != 200:
-        logger.error(f"Failed to update SaarVV {account.saarvv_device_id}: {r.text}")
-    data = r.json()
-    for t in data["tickets"].values():
-        template = json.loads(t["template"])
-        barcode_img = base64.b64decode(template["content"]["images"]["aztec_barcode"])
-        barcode_data = aztec.decode(barcode_img)
-
-        try:
-            ticket_obj = ticket.update_from_subscription_barcode(barcode_data, account=account)
-            ticket_obj.saarvv_account = account
-            ticket_obj.save()
-        except ticket.TicketError as e:
-            logger.error("Error decoding barcode ticket: %s", e)
-            continue
-
-    logger.info(f"Successfully updated SaarVV {account.saarvv_device_id}")
\ No newline at end of file
+    return get_signer().sign(request, device_id)
+
+
+def sync_fingerprints(tickets: typing.Union[dict, list]) -> typing.Dict[str, str]:
+    # Whatever the sync endpoint says about a ticket changes when the ticket does, so hash all of it
+    if isinstance(tickets, dict):
+        items = tickets.items()
+    else:
+        items = ((t.get("id") if isinstance(t, dict) else t, t) for t in tickets)
+    return {
+        str(ticket_id): hashlib.sha256(json.dumps(entry, sort_keys=True).encode("utf-8")).hexdigest()
+        for ticket_id, entry in items
+    }
+
+
+def changed_tickets(fingerprints: typing.Dict[str, str], previous: typing.Dict[str, str]) -> typing.Set[str]:
+    return {ticket_id for ticket_id, fingerprint in fingerprints.items() if previous.get(ticket_id) != fingerprint}
+
+
+def select_tickets(tickets: typing.Union[dict, list], ticket_ids: typing.Set[str]) -> typing.Union[dict, list]:
+    # Sent back in the same shape the sync endpoint gave them in
+    if isinstance(tickets, dict):
+        return {ticket_id: entry for ticket_id, entry in tickets.items() if str(ticket_id) in ticket_ids}
+    return [t for t in tickets if str(t.get("id") if isinstance(t, dict) else t) in ticket_ids]
+
+
+class SaarVVClient:
+    def __init__(self, concurrency: int = CONCURRENCY):
+        self.concurrency = concurrency
+        self.signer = get_signer()
+        # One pooled session for every account, niquests negotiates HTTP/2 where the server offers it
+        self.session = niquests.Session(pool_connections=1, pool_maxsize=concurrency)
+
+    def post(self, path: str, data: dict, account: models.Account) -> niquests.Response:
+        request = self.session.prepare_request(niquests.Request("POST", f"{BASE_URL}{path}", json=data, headers={
+            "Authorization": account.saarvv_token
+        }))
+        return self.session.send(self.signer.sign(request, account.saarvv_device_id), timeout=REQUEST_TIMEOUT)
+
+    def sync_account(self, account: models.Account, stats: barcode_cache.CacheStats):
+        if not account.saarvv_token or not account.saarvv_device_id:
+            return
+
+        r = self.post("/sync", {}, account)
+        if r.status_code != 200:
+            logger.error(f"Failed to update SaarVV {account.saarvv_device_id}: {r.text}")
+            return
+        sync_tickets = r.json()["tickets"]
+
+        fingerprints = sync_fingerprints(sync_tickets)
+        previous = account.saarvv_sync_state or {}
+        changed = changed_tickets(fingerprints, previous)
+        # Tickets that disappeared upstream are forgotten, so they're fetched again should they come back
+        state = {ticket_id: previous[ticket_id] for ticket_id in fingerprints if ticket_id not in changed}
+
+        if changed:
+            r = self.post("/ticket", {
+                "details": True,
+                "tickets": select_tickets(sync_tickets, changed),
+                "provide_aztec_content": False,
+                "parameters": False,
+            }, account)
+            if r.status_code != 200:
+                logger.error(f"Failed to update SaarVV {account.saarvv_device_id}: {r.text}")
+                return
+
+            for ticket_id, t in r.json()["tickets"].items():
+                template = json.loads(t["template"])
+                barcode_img = base64.b64decode(template["content"]["images"]["aztec_barcode"])
+                try:
+                    barcode_cache.ingest_image(barcode_img, account, {"saarvv_account": account}, stats)
+                except aztec.AztecError as e:
+                    logger.error("Error decoding barcode image: %s", e)
+                    continue
+                except ticket.TicketError as e:
+                    logger.error("Error decoding barcode ticket: %s", e)
+                    continue
+                # Only remembered once ingested, so failures are tried again next time
+                if str(ticket_id) in fingerprints:
+                    state[str(ticket_id)] = fingerprints[str(ticket_id)]
+
+        # Saving the whole account could undo a claim on it made since it was loaded
+        account.saarvv_sync_state = state
+        models.Account.objects.filter(pk=account.pk).update(saarvv_sync_state=state)
+        logger.info(
+            f"Successfully updated SaarVV {account.saarvv_device_id}, "
+            f"{len(changed)} of {len(fingerprints)} tickets changed"
+        )
+
+    def sync_accounts(
+            self, accounts: typing.List[models.Account], stats: barcode_cache.CacheStats,
+            concurrency: typing.Optional[int] = None
+    ):
+        def sync(account):
+            account_stats = barcode_cache.CacheStats()
+            try:
+                self.sync_account(account, account_stats)
+            except Exception:
+                logger.exception("Failed to update SaarVV %s", account.saarvv_device_id)
+            finally:
+                # Pool threads aren't request threads, so nothing else will close their connections
+                connection.close()
+            return account_stats
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency or self.concurrency) as executor:
+            for account_stats in executor.map(sync, accounts):
+                stats.merge(account_stats)
+
+
+def get_client() -> SaarVVClient:
+    global CLIENT
+
+    if not CLIENT:
+        CLIENT = SaarVVClient()
+
+    return CLIENT
+
+
+def update_saarvv_tickets(account: models.Account, stats: typing.Optional[barcode_cache.CacheStats] = None):
+    get_client().sync_account(account, stats or barcode_cache.CacheStats())
@@ -1,10 +1,9 @@
 import dataclasses
 import typing
 import cryptography.x509
-import cryptography.exceptions
 import cryptography.hazmat.primitives.hashes
-import cryptography.hazmat.primitives.asymmetric.dsa
 from . import util
+from .. import bits
 from ..uic import rics, certs
 
 
@@ -14,7 +13,7 @@ class Envelope:
     issuer_rics: int
     signature_key_id: int
     ticket_type: int
-    data: util.BitStream
+    data: bits.BitReader
     signed_data: bytes
     signature: bytes
 
@@ -27,59 +26,27 @@ class Envelope:
     def can_verify(self):
         return bool(certs.public_key(self.issuer_rics, self.signature_key_id))
 
-    def verify_signature(self):
-        pk = certs.public_key(self.issuer_rics, self.signature_key_id)
+    def verify_signature(self, pk=None):
+        if pk is None:
+            pk = certs.public_key(self.issuer_rics, self.signature_key_id)
         if not pk:
             return False
 
         if all(x == 0 for x in self.signature[-10:]):
-            sig = bytearray([0x30, 0x2c])
-            if self.signature[0] & 0x80:
-                sig[1] += 1
-                sig.extend([0x02, 0x15, 0x00])
-            else:
-                sig.extend([0x02, 0x14])
-            sig.extend(self.signature[0:20])
-            if self.signature[20] & 0x80:
-                sig[1] += 1
-                sig.extend([0x02, 0x15, 0x00])
-            else:
-                sig.extend([0x02, 0x14])
-            sig.extend(self.signature[20:40])
-            sig = bytes(sig)
+            sig = certs.raw_dss_signature(self.signature, 20)
             hasher = cryptography.hazmat.primitives.hashes.SHA1()
         else:
-            sig = bytearray([0x30, 0x3c])
-            if self.signature[0] & 0x80:
-                sig[1] += 1
-                sig.extend([0x02, 0x1d, 0x00])
-            else:
-                sig.extend([0x02, 0x1c])
-            sig.extend(self.signature[0:28])
-            if self.signature[28] & 0x80:
-                sig[1] += 1
-                sig.extend([0x02, 0x1d, 0x00])
-            else:
-                sig.extend([0x02, 0x1c])
-            sig.extend(self.signature[28:56])
-            sig = bytes(sig)
+            sig = certs.raw_dss_signature(self.signature, 28)
             hasher = cryptography.hazmat.primitives.hashes.SHA224()
 
-        if isinstance(pk, cryptography.hazmat.primitives.asymmetric.dsa.DSAPublicKey):
-            try:
-                pk.verify(sig, self.signed_data, hasher)
-                return True
-            except cryptography.exceptions.InvalidSignature:
-                return False
-        else:
-            return False
+        return certs.verify_dss_signature(pk, sig, self.signed_data, hasher)
 
     @classmethod
     def parse(cls, data: bytes) -> "Envelope":
         if len(data) != 114:
             raise util.SSBException("Invalid length for an SSB barcode")
 
-        d = util.BitStream(data[:58])
+        d = bits.BitReader(data[:58], util.SSBException)
 
         version = d.read_int(0, 4)
         if version != 3:
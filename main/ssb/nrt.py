@@ -2,7 +2,7 @@ import dataclasses
 import datetime
 import typing
 from django.utils import timezone
-from . import util
+from .. import bits
 
 @dataclasses.dataclass
 class NonReservationTicket:
@@ -27,7 +27,7 @@ class NonReservationTicket:
         return "NRT"
 
     @classmethod
-    def parse(cls, data: util.BitStream, issuer_rics: int):
+    def parse(cls, data: bits.BitReader, issuer_rics: int):
         year = data.read_int(105, 109)
         issuing_day = data.read_int(109, 118)
         validity_start_day = data.read_int(119, 128)
@@ -1,7 +1,7 @@
 import dataclasses
 import datetime
 from django.utils import timezone
-from . import util
+from .. import bits
 
 @dataclasses.dataclass
 class Keycard:
@@ -21,7 +21,7 @@ class Keycard:
         return self.card_id
 
     @classmethod
-    def parse(cls, data: util.BitStream):
+    def parse(cls, data: bits.BitReader):
         year = data.read_int(105, 109)
         issuing_day = data.read_int(109, 118)
         validity_start_day = data.read_int(129, 138)
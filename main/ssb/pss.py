@@ -2,7 +2,7 @@ import dataclasses
 import datetime
 import typing
 from django.utils import timezone
-from . import util
+from .. import bits
 
 @dataclasses.dataclass
 class Pass:
@@ -26,7 +26,7 @@ class Pass:
         return "PASS"
 
     @classmethod
-    def parse(cls, data: util.BitStream):
+    def parse(cls, data: bits.BitReader):
         year = data.read_int(105, 109)
         issuing_day = data.read_int(109, 118)
         first_day = data.read_int(120, 129)
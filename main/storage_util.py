@@ -0,0 +1,22 @@
+import typing
+import botocore.exceptions
+import django.core.files.storage
+
+
+def list_versions(storage: django.core.files.storage.Storage) -> typing.Dict[str, str]:
+    if hasattr(storage, "bucket"):
+        return {o.key: o.e_tag for o in storage.bucket.objects.all()}
+
+    return {f: storage.get_modified_time(f).isoformat() for f in storage.listdir("")[1]}
+
+
+def file_version(storage: django.core.files.storage.Storage, name: str) -> typing.Optional[str]:
+    if hasattr(storage, "bucket"):
+        try:
+            return storage.bucket.Object(name).e_tag
+        except botocore.exceptions.ClientError:
+            return None
+
+    if not storage.exists(name):
+        return None
+    return storage.get_modified_time(name).isoformat()
@@ -0,0 +1,591 @@
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import pathlib
+import random
+import typing
+import zlib
+import base26
+import ber_tlv.tlv
+import cryptography.hazmat.primitives.hashes
+import cryptography.hazmat.primitives.serialization
+import cryptography.hazmat.primitives.asymmetric.dsa
+import cryptography.hazmat.primitives.asymmetric.ec
+import cryptography.hazmat.primitives.asymmetric.padding
+import cryptography.hazmat.primitives.asymmetric.rsa
+import cryptography.hazmat.primitives.asymmetric.utils
+import cryptography.x509
+import cryptography.x509.oid
+
+from . import ticket, vdv, uic, rsp, ssb
+from .uic import flex
+
+# Barcodes built here only verify against the keys of the TestPKI that made them - never install one in
+# production.
+
+VDV_PROFILE_1024 = 4
+VDV_ISO9796_OID = bytes([0x2B, 0x24, 0x03, 0x04, 0x02, 0x02, 0x01])
+VDV_ISSUING_CA = vdv.CAReference(b"DETST", 16, 1, 2024)
+VDV_TICKET_CERTIFICATE = vdv.CAReference(b"DETKT", 16, 1, 2024)
+VDV_ORG_ID = 6310
+
+UIC_RICS = 1080
+UIC_KEY_IDS = {1: 1, 2: 2}
+UIC_ECDSA_KEY_ID = 3
+SSB_RICS = 1088
+SSB_KEY_ID = 1
+RSP_ISSUER_ID = "TS"
+PRIVATE_KEYS_NAME = "test-pki.json"
+
+FIRST_NAMES = ["Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hugo", "Ida", "Jonas"]
+LAST_NAMES = ["Bauer", "Fischer", "Klein", "Meyer", "Neumann", "Richter", "Schulz", "Wagner", "Weber", "Wolf"]
+
+
+def rsa_key(bits: int = 1024) -> cryptography.hazmat.primitives.asymmetric.rsa.RSAPrivateKey:
+    return cryptography.hazmat.primitives.asymmetric.rsa.generate_private_key(65537, bits)
+
+
+def rsa_private_op(key, data: bytes) -> bytes:
+    numbers = key.private_numbers()
+    n = numbers.public_numbers.n
+    return pow(int.from_bytes(data, "big"), numbers.d, n).to_bytes(key.key_size // 8, "big")
+
+
+def iso9796_sign(key, message: bytes) -> typing.Tuple[bytes, bytes]:
+    # ISO 9796-2 scheme 1 with partial message recovery, as undone by vdv.iso9796.decrypt_with_cert
+    part1_len = key.key_size // 8 - 22
+    if len(message) < part1_len:
+        raise ValueError("Message too short for partial recovery")
+    encoded = b"\x6a" + message[:part1_len] + hashlib.sha1(message).digest() + b"\xbc"
+    return rsa_private_op(key, encoded), message[part1_len:]
+
+
+def vdv_date(date: datetime.date) -> bytes:
+    return bytes.fromhex(f"{date.year:04d}{date.month:02d}{date.day:02d}")
+
+
+def vdv_certificate_content(
+        car: vdv.CAReference, chr: vdv.CAReference, key, expiry: datetime.date
+) -> bytes:
+    numbers = key.public_key().public_numbers()
+    return bytes([VDV_PROFILE_1024]) + car.to_bytes() + bytes(4) + chr.to_bytes() + b"TSTVDV" + bytes([16]) + \
+        vdv_date(expiry) + VDV_ISO9796_OID + numbers.n.to_bytes(key.key_size // 8, "big") + \
+        numbers.e.to_bytes(3, "big")
+
+
+def vdv_recoverable_certificate(
+        issuer_key, car: vdv.CAReference, chr: vdv.CAReference, key, expiry: datetime.date
+) -> typing.List[typing.Tuple[int, bytes]]:
+    signature, residual = iso9796_sign(issuer_key, vdv_certificate_content(car, chr, key, expiry))
+    return [(vdv.util.TAG_CERTIFICATE_SIGNATURE, signature), (vdv.util.TAG_CERTIFICATE_SIGNATURE_REMAINDER, residual)]
+
+
+def dsa_signature(key, data: bytes, hasher, size: int) -> bytes:
+    r, s = cryptography.hazmat.primitives.asymmetric.utils.decode_dss_signature(key.sign(data, hasher))
+    return r.to_bytes(size, "big") + s.to_bytes(size, "big")
+
+
+def public_key_der(key) -> bytes:
+    return key.public_key().public_bytes(
+        cryptography.hazmat.primitives.serialization.Encoding.DER,
+        cryptography.hazmat.primitives.serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+
+
+def private_key_pem(key) -> str:
+    return key.private_bytes(
+        cryptography.hazmat.primitives.serialization.Encoding.PEM,
+        cryptography.hazmat.primitives.serialization.PrivateFormat.PKCS8,
+        cryptography.hazmat.primitives.serialization.NoEncryption(),
+    ).decode("ascii")
+
+
+def load_private_key(pem: str):
+    return cryptography.hazmat.primitives.serialization.load_pem_private_key(pem.encode("ascii"), None)
+
+
+@dataclasses.dataclass
+class TestPKI:
+    vdv_root_key: typing.Any
+    vdv_issuing_key: typing.Any
+    vdv_ticket_key: typing.Any
+    vdv_certificates: typing.Dict[bytes, bytes]
+    vdv_envelope_certificate: typing.List[typing.Tuple[int, bytes]]
+    uic_keys: typing.Dict[typing.Tuple[int, int], typing.Any]
+    rsp_keys: typing.Dict[str, typing.Any]
+
+    @classmethod
+    def generate(cls, expiry: typing.Optional[datetime.date] = None) -> "TestPKI":
+        expiry = expiry or datetime.date.today() + datetime.timedelta(days=5 * 365)
+        root = vdv.CAReference.root()
+        root_key = rsa_key()
+        issuing_key = rsa_key()
+        ticket_key = rsa_key()
+
+        root_content = vdv_certificate_content(root, root, root_key, expiry)
+        root_signature = root_key.sign(
+            root_content, cryptography.hazmat.primitives.asymmetric.padding.PKCS1v15(),
+            cryptography.hazmat.primitives.hashes.SHA1()
+        )
+
+        return cls(
+            vdv_root_key=root_key,
+            vdv_issuing_key=issuing_key,
+            vdv_ticket_key=ticket_key,
+            vdv_certificates={
+                root.to_bytes(): ber_tlv.tlv.Tlv.build([(vdv.util.TAG_CERTIFICATE, [
+                    (vdv.util.TAG_CERTIFICATE_CONTENT, root_content),
+                    (vdv.util.TAG_CERTIFICATE_SIGNATURE, root_signature),
+                ])]),
+                VDV_ISSUING_CA.to_bytes(): ber_tlv.tlv.Tlv.build([(
+                    vdv.util.TAG_CERTIFICATE,
+                    vdv_recoverable_certificate(root_key, root, VDV_ISSUING_CA, issuing_key, expiry)
+                )]),
+            },
+            vdv_envelope_certificate=vdv_recoverable_certificate(
+                issuing_key, VDV_ISSUING_CA, VDV_TICKET_CERTIFICATE, ticket_key, expiry
+            ),
+            uic_keys={
+                (UIC_RICS, UIC_KEY_IDS[1]): cryptography.hazmat.primitives.asymmetric.dsa.generate_private_key(1024),
+                (UIC_RICS, UIC_KEY_IDS[2]): cryptography.hazmat.primitives.asymmetric.dsa.generate_private_key(2048),
+                # cryptography can't make the 224 bit subgroup of newer SSB keys, the older SHA-1 form is used instead
+                (UIC_RICS, UIC_ECDSA_KEY_ID): cryptography.hazmat.primitives.asymmetric.ec.generate_private_key(
+                    cryptography.hazmat.primitives.asymmetric.ec.SECP256R1()
+                ),
+                (SSB_RICS, SSB_KEY_ID): cryptography.hazmat.primitives.asymmetric.dsa.generate_private_key(1024),
+            },
+            rsp_keys={
+                RSP_ISSUER_ID: rsa_key(),
+            }
+        )
+
+    def uic_keys_json(self) -> dict:
+        return {"keys": [
+            uic.certs.Key(rics=rics, key_id=str(key_id), meta=None, public_key_der=public_key_der(key)).to_json()
+            for (rics, key_id), key in self.uic_keys.items()
+        ]}
+
+    def rsp_keys_json(self) -> dict:
+        keys = {}
+        for issuer_id, key in self.rsp_keys.items():
+            numbers = key.public_key().public_numbers()
+            keys[issuer_id] = [{
+                "issuer_id": issuer_id,
+                "modulus_hex": numbers.n.to_bytes(key.key_size // 8, "big").hex(),
+                "public_exponent_hex": f"{numbers.e:x}",
+                "valid_from": "2000-01-01T00:00:00",
+                "valid_until": "2100-01-01T00:00:00",
+            }]
+        return keys
+
+    def save(self, directory: pathlib.Path):
+        # The public halves go where the vdv-certs, uic-data and rsp-data storages expect them, so pointing those
+        # at this directory makes the real certificate stores load the test PKI
+        (directory / "vdv-certs").mkdir(parents=True, exist_ok=True)
+        for car, data in self.vdv_certificates.items():
+            (directory / "vdv-certs" / f"{car.hex()}.der").write_bytes(data)
+        (directory / "uic-data").mkdir(exist_ok=True)
+        (directory / "uic-data" / uic.certs.MANIFEST_NAME).write_text(json.dumps(self.uic_keys_json(), indent=2))
+        (directory / "rsp-data").mkdir(exist_ok=True)
+        (directory / "rsp-data" / "keys.json").write_text(json.dumps(self.rsp_keys_json(), indent=2))
+
+        (directory / PRIVATE_KEYS_NAME).write_text(json.dumps({
+            "vdv_root_key": private_key_pem(self.vdv_root_key),
+            "vdv_issuing_key": private_key_pem(self.vdv_issuing_key),
+            "vdv_ticket_key": private_key_pem(self.vdv_ticket_key),
+            "vdv_envelope_certificate": [[tag, value.hex()] for tag, value in self.vdv_envelope_certificate],
+            "uic_keys": [
+                {"rics": rics, "key_id": key_id, "private_key": private_key_pem(key)}
+                for (rics, key_id), key in self.uic_keys.items()
+            ],
+            "rsp_keys": {issuer_id: private_key_pem(key) for issuer_id, key in self.rsp_keys.items()},
+        }, indent=2))
+
+    @classmethod
+    def load(cls, directory: pathlib.Path) -> "TestPKI":
+        data = json.loads((directory / PRIVATE_KEYS_NAME).read_text())
+        return cls(
+            vdv_root_key=load_private_key(data["vdv_root_key"]),
+            vdv_issuing_key=load_private_key(data["vdv_issuing_key"]),
+            vdv_ticket_key=load_private_key(data["vdv_ticket_key"]),
+            vdv_certificates={
+                bytes.fromhex(path.stem): path.read_bytes() for path in (directory / "vdv-certs").glob("*.der")
+            },
+            vdv_envelope_certificate=[(tag, bytes.fromhex(value)) for tag, value in data["vdv_envelope_certificate"]],
+            uic_keys={(k["rics"], k["key_id"]): load_private_key(k["private_key"]) for k in data["uic_keys"]},
+            rsp_keys={issuer_id: load_private_key(pem) for issuer_id, pem in data["rsp_keys"].items()},
+        )
+
+    def vdv_certificate_store(self) -> vdv.CertificateStore:
+        store = vdv.CertificateStore()
+        for car, data in self.vdv_certificates.items():
+            store.certificates[car] = vdv.pki.RawCertificate(
+                filename=f"{car.hex()}.der", ca_reference=vdv.CAReference.from_bytes(car), data=data
+            )
+        # Never refresh from storage
+        store.loaded_at = float("inf")
+        return store
+
+    def uic_key_ring(self) -> uic.certs.KeyRing:
+        key_ring = uic.certs.KeyRing()
+        for key_data in self.uic_keys_json()["keys"]:
+            key = uic.certs.Key.from_json(key_data)
+            key_ring.keys[uic.certs.key_index(key.rics, key.key_id)] = key
+        key_ring.version = "synthetic"
+        key_ring.has_manifest = True
+        key_ring.checked_at = float("inf")
+        return key_ring
+
+    def rsp_certificate_store(self) -> rsp.pki.CertificateStore:
+        store = rsp.pki.CertificateStore()
+        for issuer_id, keys in self.rsp_keys_json().items():
+            store.certificates[issuer_id] = [rsp.pki.Certificate.from_json(k) for k in keys]
+        store.version = "synthetic"
+        store.checked_at = float("inf")
+        return store
+
+    @contextlib.contextmanager
+    def installed(self):
+        saved = (vdv.pki.CERTIFICATE_STORE, uic.certs.KEY_RING, rsp.pki.CERTIFICATE_STORE)
+        vdv.pki.CERTIFICATE_STORE = self.vdv_certificate_store()
+        uic.certs.KEY_RING = self.uic_key_ring()
+        rsp.pki.CERTIFICATE_STORE = self.rsp_certificate_store()
+        ticket.VDV_CA_CACHE.clear()
+        ticket.VDV_ENVELOPE_CERTIFICATE_CACHE.clear()
+        try:
+            yield self
+        finally:
+            vdv.pki.CERTIFICATE_STORE, uic.certs.KEY_RING, rsp.pki.CERTIFICATE_STORE = saved
+            ticket.VDV_CA_CACHE.clear()
+            ticket.VDV_ENVELOPE_CERTIFICATE_CACHE.clear()
+
+
+def pass_signing_settings() -> typing.Dict[str, typing.Any]:
+    # Self-signed stand-ins for the Apple pass certificates, for override_settings
+    key = cryptography.hazmat.primitives.asymmetric.rsa.generate_private_key(65537, 2048)
+    name = cryptography.x509.Name([
+        cryptography.x509.NameAttribute(cryptography.x509.oid.NameOID.COMMON_NAME, "Synthetic pass signing")
+    ])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = cryptography.x509.CertificateBuilder() \
+        .subject_name(name) \
+        .issuer_name(name) \
+        .public_key(key.public_key()) \
+        .serial_number(cryptography.x509.random_serial_number()) \
+        .not_valid_before(now) \
+        .not_valid_after(now + datetime.timedelta(days=1)) \
+        .sign(key, cryptography.hazmat.primitives.hashes.SHA256())
+    return {
+        "PKPASS_CERTIFICATE": certificate,
+        "PKPASS_KEY": key,
+        "WWDR_CERTIFICATE": certificate,
+    }
+
+
+def random_datetime(rng: random.Random) -> datetime.datetime:
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    return today + datetime.timedelta(minutes=rng.randrange(-30 * 24 * 60, 24 * 60))
+
+
+def vdv_ticket(pki: TestPKI, rng: random.Random) -> bytes:
+    valid_from = random_datetime(rng)
+    valid_until = valid_from + datetime.timedelta(days=30)
+    name = f"{rng.choice(FIRST_NAMES)}#{rng.choice(LAST_NAMES)}".encode("iso-8859-15")
+    birth = datetime.date(rng.randrange(1950, 2010), rng.randrange(1, 13), rng.randrange(1, 29))
+
+    def dt(d: datetime.datetime) -> bytes:
+        return vdv.util.DateTime(d.year, d.month, d.day, d.hour, d.minute, d.second).to_bytes()
+
+    product_data = ber_tlv.tlv.Tlv.build([
+        (0xDA, bytes([0, 1, 0, 0, 0, 0, 3, 2]) + (4900).to_bytes(3, "big") + (1900).to_bytes(2, "big") +
+         bytes([0]) + rng.randrange(1 << 24).to_bytes(3, "big")),
+        (0xDB, bytes([rng.randrange(4)]) + vdv_date(birth) + name),
+    ])
+    data = rng.randrange(1 << 32).to_bytes(4, "big") + VDV_ORG_ID.to_bytes(2, "big") + \
+        (9999).to_bytes(2, "big") + VDV_ORG_ID.to_bytes(2, "big") + dt(valid_from) + dt(valid_until) + \
+        ber_tlv.tlv.Tlv.build([(0x85, product_data)]) + \
+        VDV_ORG_ID.to_bytes(2, "big") + bytes([1]) + rng.randrange(1 << 16).to_bytes(2, "big") + \
+        VDV_ORG_ID.to_bytes(2, "big") + dt(valid_from) + bytes([0]) + bytes(3) + VDV_ORG_ID.to_bytes(2, "big") + \
+        ber_tlv.tlv.Tlv.build([(0x8A, bytes(8))]) + \
+        rng.randrange(1 << 32).to_bytes(4, "big") + bytes([1]) + rng.randrange(1 << 32).to_bytes(4, "big") + \
+        rng.randrange(1 << 24).to_bytes(3, "big")
+    data += bytes(max(0, 106 - len(data))) + b"VDV\x13\x01"
+
+    signature, residual = iso9796_sign(pki.vdv_ticket_key, data)
+    return ber_tlv.tlv.Tlv.build([
+        (vdv.util.TAG_SIGNATURE, signature),
+        (vdv.util.REMAINING_DATA, residual),
+        (vdv.util.TAG_CERTIFICATE, pki.vdv_envelope_certificate),
+        (vdv.util.TAG_CA_REFERENCE, VDV_ISSUING_CA.to_bytes()),
+    ])
+
+
+def uic_record(record_id: str, version: int, data: bytes) -> bytes:
+    return f"{record_id}{version:02d}{len(data) + 12:04d}".encode("ascii") + data
+
+
+def uic_head(rng: random.Random, ticket_id: str, issued: datetime.datetime) -> bytes:
+    return uic_record("U_HEAD", 1, (
+        f"{UIC_RICS:04d}{ticket_id:<20}{issued:%d%m%Y%H%M}0DE"
+    ).encode("ascii") + b"\x00\x00")
+
+
+def uic_layout(
+        rng: random.Random, ticket_id: str, valid_from: datetime.datetime, name: str, extra_lines: int = 0
+) -> bytes:
+    fields = [
+        (0, 0, 1, 72, 1, "FAHRKARTE"),
+        (1, 0, 1, 20, 0, name),
+        (2, 0, 1, 20, 0, f"Gültig ab {valid_from:%d.%m.%Y}"),
+        (6, 0, 1, 20, 0, "Berlin Hbf"),
+        (6, 20, 1, 20, 0, "München Hbf"),
+        (14, 52, 1, 20, 0, ticket_id),
+    ] + [
+        (7 + i % 7, 20 * (i // 7 % 3), 1, 20, 0, f"{rng.choice(LAST_NAMES)} {rng.randrange(1000)}")
+        for i in range(extra_lines)
+    ]
+    data = f"RCT2{len(fields):04d}".encode("ascii")
+    for line, column, height, width, formatting, text in fields:
+        text = text.encode("utf-8")
+        data += f"{line:02d}{column:02d}{height:02d}{width:02d}{formatting}{len(text):04d}".encode("ascii") + text
+    return uic_record("U_TLAY", 1, data)
+
+
+def uic_flex(
+        rng: random.Random, version: int, ticket_id: str, issued: datetime.datetime, name: str, travelers: int = 1
+) -> bytes:
+    first_name, last_name = name.split(" ", 1)
+    data = {
+        "issuingDetail": {
+            "issuerNum": UIC_RICS,
+            "issuingYear": issued.year,
+            "issuingDay": issued.timetuple().tm_yday,
+            "issuingTime": issued.hour * 60 + issued.minute,
+            "specimen": False,
+            "securePaperTicket": False,
+            "activated": True,
+            "currency": "EUR",
+            "currencyFract": 2,
+        },
+        "transportDocument": [{"ticket": ("openTicket", {
+            "referenceIA5": ticket_id,
+            "productOwnerNum": UIC_RICS,
+            "productIdNum": rng.choice([9999, 1000, 1001]),
+            "returnIncluded": False,
+            "validFromDay": 0,
+            "validUntilDay": rng.randrange(1, 31),
+            "classCode": rng.choice(["first", "second"]),
+        })}],
+        "travelerDetail": {"traveler": [{
+            "firstName": first_name,
+            "lastName": last_name,
+            "yearOfBirth": rng.randrange(1950, 2010),
+            "ticketHolder": True,
+        }] + [{
+            "firstName": rng.choice(FIRST_NAMES),
+            "lastName": rng.choice(LAST_NAMES),
+            "yearOfBirth": rng.randrange(1950, 2020),
+            "ticketHolder": False,
+        } for _ in range(travelers - 1)]},
+    }
+    spec = flex.get_spec(version)
+    return uic_record("U_FLEX", version, bytes(spec.encode("UicRailTicketData", data)))
+
+
+@dataclasses.dataclass
+class Sizes:
+    # Travellers in FCB records and RCT2 fields on top of the basic layout
+    travelers: int = 1
+    layout_lines: int = 0
+
+
+def uic_ticket(
+        pki: TestPKI, rng: random.Random, version: int = 2, flex_version: typing.Optional[int] = 3,
+        layout: bool = False, ecdsa: bool = False, sizes: Sizes = Sizes(),
+) -> bytes:
+    ticket_id = "".join(rng.choices("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789", k=12))
+    issued = random_datetime(rng)
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+    records = uic_head(rng, ticket_id, issued)
+    if flex_version:
+        records += uic_flex(rng, flex_version, ticket_id, issued, name, sizes.travelers)
+    if layout:
+        records += uic_layout(rng, ticket_id, issued, name, sizes.layout_lines)
+    compressed = zlib.compress(records)
+
+    # A P-256 DER signature doesn't fit the 50 bytes of a v1 envelope
+    if ecdsa and version != 2:
+        raise ValueError("ECDSA is only supported in v2 envelopes")
+    key_id = UIC_ECDSA_KEY_ID if ecdsa else UIC_KEY_IDS[version]
+    key = pki.uic_keys[(UIC_RICS, key_id)]
+    if version == 1:
+        signature = key.sign(compressed, cryptography.hazmat.primitives.hashes.SHA1())
+        signature += bytes(50 - len(signature))
+    elif ecdsa:
+        signature = dsa_signature(
+            key, compressed,
+            cryptography.hazmat.primitives.asymmetric.ec.ECDSA(cryptography.hazmat.primitives.hashes.SHA256()), 32
+        )
+    else:
+        signature = dsa_signature(key, compressed, cryptography.hazmat.primitives.hashes.SHA256(), 32)
+
+    return f"#UT{version:02d}{UIC_RICS:04d}{key_id:05d}".encode("ascii") + signature + \
+        f"{len(compressed):04d}".encode("ascii") + compressed
+
+
+def ssb_ticket(pki: TestPKI, rng: random.Random, ticket_type: typing.Optional[int] = None) -> bytes:
+    parsers = {
+        1: lambda d: ssb.IntegratedReservationTicket.parse(d, SSB_RICS),
+        2: lambda d: ssb.NonReservationTicket.parse(d, SSB_RICS),
+        4: ssb.Pass.parse,
+    }
+    ticket_type = ticket_type or rng.choice(list(parsers))
+    # The fixed-layout payloads have few invalid encodings, so draw until one parses
+    while True:
+        header = (3 << 23) | (SSB_RICS << 9) | (SSB_KEY_ID << 5) | ticket_type
+        body = int.from_bytes(rng.randbytes(58), "big") & ((1 << (58 * 8 - 27)) - 1)
+        signed_data = ((header << (58 * 8 - 27)) | body).to_bytes(58, "big")
+        try:
+            parsers[ticket_type](ssb.Envelope.parse(signed_data + bytes(56)).data)
+        except (ssb.SSBException, ValueError, OverflowError):
+            continue
+        break
+
+    key = pki.uic_keys[(SSB_RICS, SSB_KEY_ID)]
+    signature = dsa_signature(key, signed_data, cryptography.hazmat.primitives.hashes.SHA1(), 20)
+    return signed_data + signature + bytes(56 - len(signature))
+
+
+def rsp_ticket(pki: TestPKI, rng: random.Random, ticket_type: str = "06") -> bytes:
+    key = pki.rsp_keys[RSP_ISSUER_ID]
+    size = key.key_size // 8
+    parse = rsp.TicketData.parse if ticket_type == "06" else rsp.RailcardData.parse
+    while True:
+        data = rng.randbytes(108)
+        try:
+            parse(data)
+        except (rsp.RSPException, ValueError, OverflowError):
+            continue
+        message = data + hashlib.sha256(data).digest()[:8]
+        payload = rsa_private_op(key, b"\x00\x01" + b"\xff" * (size - len(message) - 3) + b"\x00" + message)
+        # base26 drops a trailing zero byte
+        if base26.decode(base26.encode(payload)) == payload:
+            break
+
+    ticket_ref = "".join(rng.choices("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789", k=9))
+    return f"{ticket_type}{ticket_ref}00{RSP_ISSUER_ID}".encode("ascii") + base26.encode(payload).encode("ascii")
+
+
+def sncf_ticket(rng: random.Random) -> bytes:
+    travel = random_datetime(rng)
+    birth = datetime.date(rng.randrange(1950, 2010), rng.randrange(1, 13), rng.randrange(1, 29))
+    data = "".join([
+        "i0CV",
+        "".join(rng.choices("ABCDEFGHJKLMNPQRSTUVWXYZ", k=6)),
+        f"{rng.randrange(10 ** 9):09d}",
+        "0000",
+        f"{birth:%d/%m/%Y}",
+        "FRPNO", "FRLYS", f"{rng.randrange(10 ** 5):05d}",
+        f"{travel:%d/%m}",
+        f"{rng.randrange(10 ** 19):019d}",
+        f"{rng.choice(LAST_NAMES).upper():<19}",
+        f"{rng.choice(FIRST_NAMES).upper():<19}",
+        rng.choice("12"), "PT00",
+        "0", " " * 15,
+    ])
+    return data.encode("iso-8859-1")
+
+
+def elb_ticket(rng: random.Random) -> bytes:
+    today = datetime.date.today()
+    day = today.timetuple().tm_yday
+    return "".join([
+        "e1A ", "".join(rng.choices("ABCDEFGHJKLMNPQRSTUVWXYZ", k=6)), f"{rng.randrange(10 ** 9):09d}",
+        "1", "2", str(rng.randrange(1, 10)), "9", " " * 10, "AD", "01", "00",
+        str(today.year % 10), f"{day:03d}", f"{day:03d}", f"{min(day + 30, 365):03d}",
+        "FRPNO", "GBSPX", f"{rng.randrange(10 ** 4):06d}", f"{rng.randrange(10 ** 4):04d}", f"{day:03d}",
+        f"{rng.randrange(1, 20):03d}", f"{rng.randrange(1, 90):03d}", rng.choice("12"), "A  ",
+    ]).encode("ascii")
+
+
+CORPUS_VARIANTS = {
+    "vdv": lambda pki, rng, sizes: vdv_ticket(pki, rng),
+    "uic-v1-fcb13": lambda pki, rng, sizes: uic_ticket(pki, rng, version=1, flex_version=13, sizes=sizes),
+    "uic-v2-fcb2": lambda pki, rng, sizes: uic_ticket(pki, rng, version=2, flex_version=2, sizes=sizes),
+    "uic-v2-fcb3": lambda pki, rng, sizes: uic_ticket(pki, rng, version=2, flex_version=3, sizes=sizes),
+    "uic-v2-ecdsa-fcb3": lambda pki, rng, sizes: uic_ticket(
+        pki, rng, version=2, flex_version=3, ecdsa=True, sizes=sizes
+    ),
+    "uic-v1-rct2": lambda pki, rng, sizes: uic_ticket(
+        pki, rng, version=1, flex_version=None, layout=True, sizes=sizes
+    ),
+    "uic-v2-fcb3-rct2": lambda pki, rng, sizes: uic_ticket(
+        pki, rng, version=2, flex_version=3, layout=True, sizes=sizes
+    ),
+    "rsp-06": lambda pki, rng, sizes: rsp_ticket(pki, rng, "06"),
+    "rsp-08": lambda pki, rng, sizes: rsp_ticket(pki, rng, "08"),
+    "ssb": lambda pki, rng, sizes: ssb_ticket(pki, rng),
+    "sncf": lambda pki, rng, sizes: sncf_ticket(rng),
+    "elb": lambda pki, rng, sizes: elb_ticket(rng),
+}
+
+
+def corpus(
+        pki: TestPKI, count: int, seed: int = 0, variants: typing.Optional[typing.Iterable[str]] = None,
+        sizes: Sizes = Sizes(),
+) -> typing.Dict[str, typing.List[bytes]]:
+    rng = random.Random(seed)
+    return {
+        name: [CORPUS_VARIANTS[name](pki, rng, sizes) for _ in range(count)]
+        for name in (variants or CORPUS_VARIANTS)
+    }
+
+
+WORKER_PKI = None
+
+
+def init_worker(pki: TestPKI):
+    global WORKER_PKI
+    WORKER_PKI = pki
+
+
+def generate_chunk(
+        item: typing.Tuple[int, int, int, typing.Dict[str, float], Sizes]
+) -> typing.List[typing.Tuple[str, bytes]]:
+    seed, chunk, count, mix, sizes = item
+    # Seeded per chunk so the output doesn't depend on how chunks are spread over workers
+    rng = random.Random(f"{seed}-{chunk}")
+    names = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    return [(name, CORPUS_VARIANTS[name](WORKER_PKI, rng, sizes)) for name in names]
+
+
+def generate(
+        pki: TestPKI, count: int, mix: typing.Optional[typing.Dict[str, float]] = None, seed: int = 0,
+        sizes: Sizes = Sizes(), workers: typing.Optional[int] = None, chunk_size: int = 1000,
+) -> typing.Iterator[typing.Tuple[str, bytes]]:
+    mix = mix or {name: 1 for name in CORPUS_VARIANTS}
+    workers = workers or os.cpu_count()
+    chunks = (
+        (seed, chunk, min(chunk_size, count - chunk * chunk_size), mix, sizes)
+        for chunk in range((count + chunk_size - 1) // chunk_size)
+    )
+    # Private keys can't be pickled, forked workers inherit them through the initializer instead
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+            initializer=init_worker, initargs=(pki,),
+    ) as executor:
+        # Only keep a few chunks in flight so millions of tickets don't pile up in memory ahead of the writer
+        pending = collections.deque()
+        for item in chunks:
+            pending.append(executor.submit(generate_chunk, item))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
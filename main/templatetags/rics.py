@@ -14,6 +14,10 @@ def get_rics_code(value):
         return None
     return uic.rics.get_rics(int(value))
 
+@register.filter(name="signing_cert")
+def signing_cert(envelope, fingerprint):
+    return uic.certs.signing_cert_by_fingerprint(envelope.issuer_rics, envelope.signature_key_id, fingerprint)
+
 @register.filter(name="get_station")
 def get_station(value, code_type):
     if not value:
@@ -1,3 +1,717 @@
-from django.test import TestCase
+import base64
+import datetime
+import gzip
+import io
+import json
+import pathlib
+import pickle
+import random
+import tempfile
+import types
+import zlib
+import asn1tools
+import cv2
+import numpy
+import pymupdf
+import ber_tlv.tlv
+import cryptography.hazmat.primitives.hashes
+import cryptography.hazmat.primitives.asymmetric.ec
+import cryptography.hazmat.primitives.serialization
+import django.core.files.storage
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from main import apn, aztec, barcode_cache, bits, db_abo, decode_service, ingest, models, pdf_scan, redecode, refresh_scheduler, rsp, saarvv, synthetic, ticket, ticket_cache, ticket_formats, uic, vdv
+from main.uic import flex, uper
 
-# Create your tests here.
+
+class BitReaderTest(SimpleTestCase):
+    def test_fields(self):
+        # "HELLO" in six bit ASCII, a 5 bit integer and a flag
+        value = 0
+        for c in "HELLO":
+            value = (value << 6) | (ord(c) - 0x20)
+        value = (value << 6) | (21 << 1) | 1
+        d = bits.BitReader(value.to_bytes(9, "big")[-9:])
+        offset = 72 - 36
+
+        self.assertEqual(d.read_string(offset, offset + 30), "HELLO")
+        self.assertEqual(d.read_int(offset + 30, offset + 35), 21)
+        self.assertTrue(d.read_bool(offset + 35))
+        self.assertEqual(d[offset + 30:].read_int(0, 5), 21)
+        self.assertEqual(d.read_bytes(64, 72), bytes([value & 0xff]))
+
+    def test_partial_character_reads_past_field(self):
+        d = bits.BitReader(bytes([0b00000100, 0b00010000]))
+        self.assertEqual(d.read_string(4, 14), "00")
+        self.assertEqual(d.read_string(10, 15), "0")
+
+    def test_out_of_range(self):
+        d = bits.BitReader(b"\x00", KeyError)
+        with self.assertRaises(KeyError):
+            d.read_int(4, 12)
+        with self.assertRaises(KeyError):
+            d.read_string(8, 14)
+
+
+class UPERDecoderTest(SimpleTestCase):
+    samples = 200
+    mutations = 5
+
+    def assertSameDecode(self, spec, decoder, data: bytes):
+        try:
+            expected = ("ok", spec.decode("UicRailTicketData", data))
+        except Exception as e:
+            expected = ("error", type(e).__name__)
+        try:
+            actual = ("ok", decoder(data))
+        except asn1tools.DecodeError as e:
+            actual = ("error", type(e).__name__)
+
+        if expected[0] == "ok" or actual[0] == "ok":
+            self.assertEqual(expected, actual, data.hex())
+
+    def test_differential(self):
+        for version in flex.ASN1_SPEC_FILES:
+            with self.subTest(version=version):
+                spec = flex.get_spec(version)
+                decoder, _ = uper.generate(spec, "UicRailTicketData")
+                root = spec.types["UicRailTicketData"].type
+                rng = random.Random(version)
+                for _ in range(self.samples):
+                    data = bytes(spec.encode("UicRailTicketData", uper.example_value(root, rng)))
+                    self.assertEqual(spec.decode("UicRailTicketData", data), decoder(data))
+
+                    for _ in range(self.mutations):
+                        mutated = bytearray(data)
+                        if mutated and rng.random() < 0.7:
+                            mutated[rng.randrange(len(mutated))] ^= 1 << rng.randrange(8)
+                        else:
+                            del mutated[rng.randrange(len(mutated) + 1):]
+                        self.assertSameDecode(spec, decoder, bytes(mutated))
+
+    def test_extensions_skipped(self):
+        spec = asn1tools.compile_string("""
+        Test DEFINITIONS AUTOMATIC TAGS ::= BEGIN
+            Old ::= SEQUENCE { a INTEGER (0..7), b IA5String OPTIONAL, ... }
+            New ::= SEQUENCE { a INTEGER (0..7), b IA5String OPTIONAL, ..., c UTF8String, d INTEGER }
+        END
+        """, codec="uper")
+        decoder, _ = uper.generate(spec, "Old")
+        data = spec.encode("New", {"a": 5, "b": "x", "c": "Grüße", "d": -300})
+        self.assertEqual(spec.decode("Old", data), decoder(data))
+        self.assertEqual(decoder(data), {"a": 5, "b": "x"})
+
+    def test_flex_uses_generated_decoder(self):
+        for version in flex.ASN1_SPEC_FILES:
+            self.assertEqual(flex.get_decoder(version).__name__, "decode")
+
+    def test_spec_cache_writable_by_others_ignored(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(ASN1_CACHE_DIR=directory):
+            cache_path = flex.spec_cache_path(13)
+            cache_path.write_bytes(pickle.dumps("cached"))
+            cache_path.chmod(0o666)
+            self.assertNotEqual(flex.load_spec(13), "cached")
+
+            cache_path.write_bytes(pickle.dumps("cached"))
+            cache_path.chmod(0o600)
+            self.assertEqual(flex.load_spec(13), "cached")
+
+
+class UICEnvelopeTest(SimpleTestCase):
+    @staticmethod
+    def record(record_id: str, version: int, data: bytes) -> bytes:
+        return f"{record_id}{version:02d}{len(data) + 12:04d}".encode("ascii") + data
+
+    def envelope_bytes(self, *records: bytes) -> bytes:
+        compressed = zlib.compress(b"".join(records))
+        return b"#UT02108000001" + bytes(64) + f"{len(compressed):04d}".encode("ascii") + compressed
+
+    def test_records_indexed_and_decoded_lazily(self):
+        spec = flex.get_spec(3)
+        flex_data = bytes(spec.encode("UicRailTicketData", uper.example_value(
+            spec.types["UicRailTicketData"].type, random.Random(0)
+        )))
+        data = self.envelope_bytes(
+            self.record("U_FLEX", 3, flex_data),
+            self.record("5008TI", 2, b"x"),
+            self.record("0080XX", 1, b"hello"),
+            self.record("5197TI", 1, b""),
+        )
+        envelope = uic.Envelope.parse(data)
+
+        self.assertEqual([r.id for r in envelope.records], ["U_FLEX", "5008TI", "0080XX", "5197TI"])
+        self.assertEqual(envelope.records[2].data, b"hello")
+        self.assertIs(envelope.first_record(("5197TI", None), ("5008TI", 1)), envelope.records[3])
+        self.assertIs(envelope.first_record(("5197TI", None), ("5008TI", None)), envelope.records[1])
+        self.assertIsNone(envelope.first_record(("0080BL", 3)))
+
+        parsed = ticket.UICTicket.from_envelope(data, envelope, vdv.ticket.Context(None, None))
+        self.assertNotIn("flex", parsed.__dict__)
+        self.assertEqual([r.id for r in parsed.other_records], ["0080XX"])
+        self.assertEqual(parsed.flex.data, spec.decode("UicRailTicketData", flex_data))
+        self.assertEqual(pickle.loads(pickle.dumps(parsed)).flex, parsed.flex)
+
+        stored = uic.Envelope.from_json(envelope.to_json())
+        self.assertEqual(envelope.to_json()["records"][2], {"id": "0080XX", "version": 1, "data": "aGVsbG8="})
+        self.assertEqual(stored.to_json(), envelope.to_json())
+        self.assertEqual(stored.first_record(("0080XX", 1)).data, b"hello")
+
+    def test_truncated_record(self):
+        with self.assertRaises(uic.util.UICException):
+            uic.Envelope.parse(self.envelope_bytes(self.record("U_FLEX", 3, b"abc")[:-1]))
+
+    def test_malformed_record_rejected_at_parse(self):
+        data = self.envelope_bytes(self.record("U_TLAY", 1, b"RCT2"))
+        with self.assertRaises(ticket.TicketError):
+            ticket.parse_ticket_uic(data, vdv.ticket.Context(None, None))
+
+    def test_manifest_certificate_wins_over_public_key(self):
+        meta = {"issuer_code": "1080", "key_id": "1"}
+        with tempfile.TemporaryDirectory() as directory:
+            storage = django.core.files.storage.FileSystemStorage(location=directory)
+            (pathlib.Path(directory) / uic.certs.MANIFEST_NAME).write_text(json.dumps({"keys": [
+                uic.certs.Key(rics=1080, key_id="1", meta=meta, certificate_der=b"cert").to_json(),
+                uic.certs.Key(rics=1080, key_id="1", meta=None, public_key_der=b"key").to_json(),
+            ]}))
+            key_ring = uic.certs.KeyRing()
+            key_ring.load(storage, "1")
+
+        key = key_ring.keys[uic.certs.key_index(1080, 1)]
+        self.assertEqual((key.meta, key.certificate_der), (meta, b"cert"))
+
+    def test_signing_cert_shown_for_stored_fingerprint(self):
+        certificate = synthetic.pass_signing_settings()["PKPASS_CERTIFICATE"]
+        key = uic.certs.Key(rics=1080, key_id="1", meta={"issuer_name": "Synthetic issuer"}, certificate_der=(
+            certificate.public_bytes(cryptography.hazmat.primitives.serialization.Encoding.DER)
+        ))
+        key_ring = uic.certs.KeyRing()
+        key_ring.keys[uic.certs.key_index(1080, 1)] = key
+        key_ring.checked_at = float("inf")
+        envelope = types.SimpleNamespace(version=2, issuer_rics=1080, signature_key_id=1)
+
+        saved, uic.certs.KEY_RING = uic.certs.KEY_RING, key_ring
+        try:
+            for fingerprint, shown in ((key.fingerprint(), True), ("0" * 64, False)):
+                instance = models.UICTicketInstance(
+                    signature_valid=True, signature_key_fingerprint=fingerprint, signature_verified_at=timezone.now()
+                )
+                html = render_to_string("main/uic/ticket_details.html", {
+                    "ticket": types.SimpleNamespace(envelope=envelope), "instance": instance
+                })
+                self.assertEqual("Synthetic issuer" in html, shown)
+        finally:
+            uic.certs.KEY_RING = saved
+
+
+class TicketFormatTest(SimpleTestCase):
+    def test_identify(self):
+        identify = ticket.TICKET_FORMATS.identify
+        self.assertEqual(identify(b"#UT01" + bytes(100)).name, "UIC")
+        self.assertEqual(identify(b"i0CV" + bytes(127)).name, "SNCF")
+        self.assertEqual(identify(b"06ABCDEFGHI" + bytes(97)).name, "RSP")
+        self.assertEqual(identify(b"e" + bytes(18) + b"1" + bytes(50)).name, "ELB")
+        self.assertEqual(identify(b"\x9e\x81\x80" + bytes(200)).name, "VDV")
+        self.assertEqual(identify(bytes([0x31]) + bytes(113)).name, "SSB")
+        self.assertIsNone(identify(b"hello world"))
+        self.assertIsNone(identify(b""))
+
+    def test_unknown_rejected_and_counted(self):
+        registry = ticket_formats.FormatRegistry()
+        registry.register("A", lambda data: 0.5 if data[:1] == b"a" else 0, lambda data, context: data.upper())
+        registry.register("B", lambda data: 0.9 if data[:2] == b"ab" else 0, lambda data, context: 1 / 0)
+
+        self.assertIsNone(registry.identify(b"xyz"))
+        self.assertEqual(registry.parse(registry.identify(b"aa"), b"aa", None), b"AA")
+        with self.assertRaises(ZeroDivisionError):
+            registry.parse(registry.identify(b"ab"), b"ab", None)
+
+        stats = registry.stats()
+        self.assertEqual(stats["unknown"], 1)
+        self.assertEqual((stats["formats"]["A"]["parsed"], stats["formats"]["A"]["failed"]), (1, 0))
+        self.assertEqual((stats["formats"]["B"]["parsed"], stats["formats"]["B"]["failed"]), (0, 1))
+        self.assertEqual(stats["formats"]["A"]["latency"]["count"], 1)
+        self.assertEqual(sum(stats["formats"]["B"]["latency"]["buckets"].values()), 1)
+
+    def test_parse_ticket_rejects_unknown(self):
+        with self.assertRaises(ticket.TicketError) as e:
+            ticket.parse_ticket(b"not a ticket", None)
+        self.assertEqual(e.exception.title, "Unknown ticket format")
+
+
+class IngestTest(TestCase):
+    @staticmethod
+    def elb_barcode(pnr: str, sequence_number: int) -> bytes:
+        return "".join([
+            "e1A ", f"{pnr:6}", "123456789", "1", "2", str(sequence_number), "2", " " * 10, "AD", "01", "00",
+            "4", "010", "020", "030", "FRPNO", "FRLPD", "001234", "1234", "020", "007", "012", "2", "A  ",
+        ]).encode("ascii")
+
+    def test_read_barcodes(self):
+        barcode = self.elb_barcode("ABCDEF", 1)
+        with self.assertLogs("main.ingest", "ERROR"):
+            self.assertEqual(list(ingest.read_barcodes([
+                json.dumps({"barcode": base64.b64encode(barcode).decode("ascii")}),
+                "",
+                json.dumps({"hex": barcode.hex()}),
+                "not json",
+            ], "jsonl")), [(1, barcode), (3, barcode)])
+            self.assertEqual(list(ingest.read_barcodes([barcode.hex(), "zz"], "hex")), [(1, barcode)])
+        self.assertEqual(list(ingest.read_barcodes([
+            base64.urlsafe_b64encode(barcode).decode("ascii").rstrip("=")
+        ], "base64")), [(1, barcode)])
+
+    def test_ingest_upserts(self):
+        barcodes = [self.elb_barcode("ABCDEF", 1), self.elb_barcode("ABCDEF", 1), b"junk", self.elb_barcode("GHIJKL", 2)]
+        with self.assertLogs("main.ingest", "ERROR"):
+            result = ingest.ingest(enumerate(barcodes, 1), workers=1, batch_size=2, notify=False)
+        self.assertEqual((result.decoded, result.failed, result.created_tickets), (3, 1, 2))
+        self.assertEqual(models.ELBTicketInstance.objects.count(), 2)
+        self.assertEqual(models.Ticket.objects.filter(ticket_type=models.Ticket.TYPE_FAHRKARTE).count(), 2)
+
+        last_updated = dict(models.Ticket.objects.values_list("pk", "last_updated"))
+        result = ingest.ingest(enumerate(barcodes[:1], 1), workers=1, notify=False)
+        self.assertEqual((result.created_tickets, result.updated_tickets), (0, 0))
+        self.assertEqual(dict(models.Ticket.objects.values_list("pk", "last_updated")), last_updated)
+
+    def test_ingest_survives_parser_errors(self):
+        # The ELB parser raises IndexError on the short one, and the RSP one fails looking up its issuer key
+        barcodes = [self.elb_barcode("ABCDEF", 1), b"e123", b"06" + bytes(30), self.elb_barcode("GHIJKL", 2)]
+        with self.assertLogs("main.ingest", "ERROR"):
+            result = ingest.ingest(enumerate(barcodes, 1), workers=1, batch_size=2, notify=False)
+        self.assertEqual((result.decoded, result.failed, result.created_tickets), (2, 2, 2))
+
+    def test_import_gzipped_jsonl(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory) / "tickets.jsonl.gz"
+            with gzip.open(path, "wt", encoding="utf-8") as f:
+                for pnr in ("ABCDEF", "GHIJKL"):
+                    f.write(json.dumps({"hex": self.elb_barcode(pnr, 1).hex()}) + "\n")
+            call_command("import-barcodes", str(path), "--workers", "1", "--no-notify", stdout=io.StringIO())
+        self.assertEqual(models.ELBTicketInstance.objects.count(), 2)
+
+
+class RedecodeTest(TestCase):
+    def test_stale_fields_updated_and_resumed(self):
+        barcodes = [IngestTest.elb_barcode(pnr, 1) for pnr in ("AAAAAA", "BBBBBB", "CCCCCC")]
+        ingest.ingest(enumerate(barcodes, 1), workers=1, notify=False)
+        instances = list(models.ELBTicketInstance.objects.order_by("pk"))
+        good_ticket = instances[0].ticket_id
+
+        stale = models.Ticket.objects.create(id="STALE", ticket_type=models.Ticket.TYPE_UNKNOWN, last_updated=timezone.now())
+        models.ELBTicketInstance.objects.filter(pk=instances[1].pk).update(sequence_number=9, ticket=stale)
+        models.ELBTicketInstance.objects.filter(pk=instances[2].pk).update(sequence_number=9)
+        # Simulate a run that stopped after the second instance
+        models.RedecodeCheckpoint.objects.create(job="test", model="main.elbticketinstance", last_pk=instances[1].pk)
+
+        _, result = redecode.redecode(models.ELBTicketInstance, "test", workers=1, chunk_size=1)
+        self.assertEqual((result.processed, result.changed, result.moved), (1, 1, 0))
+        self.assertEqual(models.ELBTicketInstance.objects.get(pk=instances[1].pk).sequence_number, 9)
+        self.assertEqual(models.ELBTicketInstance.objects.get(pk=instances[2].pk).sequence_number, 1)
+
+        checkpoint, result = redecode.redecode(models.ELBTicketInstance, "test", workers=1, restart=True)
+        self.assertEqual((result.processed, result.changed, result.moved), (3, 1, 1))
+        self.assertIsNotNone(checkpoint.finished_at)
+        self.assertEqual(checkpoint.last_pk, instances[2].pk)
+        moved = models.ELBTicketInstance.objects.get(pk=instances[1].pk)
+        self.assertEqual(moved.sequence_number, 1)
+        self.assertNotEqual(moved.ticket_id, "STALE")
+        self.assertEqual(moved.ticket.ticket_type, models.Ticket.TYPE_FAHRKARTE)
+        self.assertEqual(models.ELBTicketInstance.objects.get(pk=instances[0].pk).ticket_id, good_ticket)
+
+        pks = [instance.pk for instance in instances]
+        with CaptureQueriesContext(connection) as queries:
+            chunks = list(redecode.keyset_chunks(models.ELBTicketInstance.objects.all(), 2, pks[0]))
+        self.assertEqual([[instance.pk for instance in chunk] for chunk in chunks], [pks[1:]])
+        self.assertTrue(all("LIMIT 2" in query["sql"] for query in queries.captured_queries))
+
+    def test_dry_run_survives_parser_errors_without_checkpoint(self):
+        ingest.ingest(enumerate([IngestTest.elb_barcode("AAAAAA", 1)], 1), workers=1, notify=False)
+        # The ELB parser raises IndexError rather than a TicketError on this one
+        broken = models.ELBTicketInstance.objects.get()
+        broken.pk = None
+        broken.sequence_number = 2
+        broken.barcode_data = b"e123"
+        broken.save()
+
+        with self.assertLogs("main.redecode", "ERROR"):
+            _, result = redecode.redecode(models.ELBTicketInstance, "test", workers=1, dry_run=True)
+        self.assertEqual((result.processed, result.failed), (2, 1))
+        self.assertFalse(models.RedecodeCheckpoint.objects.exists())
+
+
+class SyntheticCorpusTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pki = synthetic.TestPKI.generate()
+
+    def test_every_variant_parses_and_verifies(self):
+        with self.pki.installed():
+            corpus = synthetic.corpus(self.pki, 2, seed=1)
+            for name, barcodes in corpus.items():
+                for barcode in barcodes:
+                    with self.subTest(name):
+                        decoded = ticket.parse_ticket(barcode, None)
+                        if isinstance(decoded, (ticket.UICTicket, ticket.SSBTicket)):
+                            self.assertTrue(decoded.envelope.verify_signature())
+
+    def test_saved_pki_loads_through_storage(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            self.pki.save(directory)
+            pki = synthetic.TestPKI.load(directory)
+            storages = {
+                **settings.STORAGES,
+                **{name: {
+                    "BACKEND": "django.core.files.storage.FileSystemStorage",
+                    "OPTIONS": {"location": directory / name},
+                } for name in ("vdv-certs", "uic-data", "rsp-data")}
+            }
+            barcodes = [
+                synthetic.CORPUS_VARIANTS[name](pki, random.Random(0), synthetic.Sizes(travelers=3, layout_lines=4))
+                for name in ("vdv", "uic-v2-ecdsa-fcb3", "uic-v2-fcb3-rct2", "rsp-08", "ssb")
+            ]
+            saved = (vdv.pki.CERTIFICATE_STORE, uic.certs.KEY_RING, rsp.pki.CERTIFICATE_STORE)
+            vdv.pki.CERTIFICATE_STORE = uic.certs.KEY_RING = rsp.pki.CERTIFICATE_STORE = None
+            try:
+                with override_settings(STORAGES=storages):
+                    for barcode in barcodes:
+                        decoded = ticket.parse_ticket(barcode, None)
+                        if isinstance(decoded, (ticket.UICTicket, ticket.SSBTicket)):
+                            self.assertTrue(decoded.envelope.verify_signature())
+            finally:
+                vdv.pki.CERTIFICATE_STORE, uic.certs.KEY_RING, rsp.pki.CERTIFICATE_STORE = saved
+                ticket.VDV_CA_CACHE.clear()
+                ticket.VDV_ENVELOPE_CERTIFICATE_CACHE.clear()
+
+    def test_signature_with_leading_zero_verifies(self):
+        key = self.pki.uic_keys[(synthetic.UIC_RICS, synthetic.UIC_ECDSA_KEY_ID)]
+        rng = random.Random(0)
+        while True:
+            data = rng.randbytes(32)
+            signature = synthetic.dsa_signature(key, data, cryptography.hazmat.primitives.asymmetric.ec.ECDSA(
+                cryptography.hazmat.primitives.hashes.SHA256()
+            ), 32)
+            if signature[0] == 0:
+                break
+        self.assertTrue(uic.certs.verify_dss_signature(
+            key.public_key(), uic.certs.raw_dss_signature(signature, 32), data,
+            cryptography.hazmat.primitives.hashes.SHA256()
+        ))
+
+    def test_uic_v1_signature_resembling_nested_tlv_verifies(self):
+        with self.pki.installed():
+            for seed in range(10000):
+                barcode = synthetic.uic_ticket(self.pki, random.Random(seed), version=1, flex_version=13)
+                envelope = uic.Envelope.parse(barcode)
+                der = envelope.signature[:envelope.signature[1] + 2]
+                if ber_tlv.tlv.Tlv.build(ber_tlv.tlv.Tlv.parse(envelope.signature, True)) != der:
+                    break
+            self.assertTrue(envelope.verify_signature())
+
+    def test_vdv_signature_resembling_tlv_parses(self):
+        signature = bytes([0xBD, 0x0A]) + bytes(10) + bytes([0xDE, 0x72]) + bytes(114)
+        envelope = vdv.EnvelopeV2.parse(ber_tlv.tlv.Tlv.build([
+            (vdv.util.TAG_SIGNATURE, signature),
+            (vdv.util.REMAINING_DATA, b"VDV\x13\x01"),
+            (vdv.util.TAG_CERTIFICATE, self.pki.vdv_envelope_certificate),
+            (vdv.util.TAG_CA_REFERENCE, synthetic.VDV_ISSUING_CA.to_bytes()),
+        ]))
+        self.assertEqual(envelope.signature, signature)
+
+    def test_tampered_vdv_ticket_rejected(self):
+        with self.pki.installed():
+            barcode = bytearray(synthetic.vdv_ticket(self.pki, random.Random(0)))
+            barcode[10] ^= 1
+            with self.assertRaises(ticket.TicketError):
+                ticket.parse_ticket(bytes(barcode), None)
+
+    def test_vdv_certificate_cache_evicts_least_recently_used(self):
+        cache = ticket.CertificateCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+
+
+class AztecRegionTest(SimpleTestCase):
+    def test_candidate_region_finds_barcode(self):
+        rng = numpy.random.default_rng(0)
+        img = numpy.full((3000, 4000), 230, dtype="uint8") + rng.integers(0, 10, (3000, 4000), dtype="uint8")
+        modules = rng.integers(0, 2, (30, 30), dtype="uint8") * 255
+        img[1200:1800, 2500:3100] = numpy.kron(modules, numpy.ones((20, 20), dtype="uint8"))
+        cv2.putText(img, "Fahrkarte", (200, 300), cv2.FONT_HERSHEY_SIMPLEX, 4, 0, 8)
+
+        small, scale = aztec.downscale(img, aztec.FAST_PASS_MAX_SIDE)
+        self.assertEqual(max(small.shape), aztec.FAST_PASS_MAX_SIDE)
+        x, y, w, h = (round(v / scale) for v in aztec.candidate_region(small))
+        self.assertTrue(x <= 2500 and y <= 1200 and x + w >= 3050 and y + h >= 1750)
+        self.assertLess(aztec.crop_region(img, aztec.candidate_region(small), scale).size, img.size / 10)
+
+    def test_whole_image_region_not_cropped(self):
+        img = numpy.zeros((100, 100), dtype="uint8")
+        self.assertIsNone(aztec.crop_region(img, (5, 5, 90, 90), 1))
+
+
+class PDFScanTest(SimpleTestCase):
+    def test_candidates_ranked_and_extracted(self):
+        rng = numpy.random.default_rng(0)
+        barcode = numpy.kron(rng.integers(0, 2, (25, 25), dtype="uint8") * 255, numpy.ones((12, 12), dtype="uint8"))
+        photo = rng.integers(0, 255, (200, 600, 3), dtype="uint8")
+        tiny = numpy.zeros((20, 20), dtype="uint8")
+
+        pdf = pymupdf.open()
+        pdf.new_page().insert_image(pymupdf.Rect(0, 0, 300, 100), stream=cv2.imencode(".png", photo)[1].tobytes())
+        page = pdf.new_page()
+        page.insert_image(pymupdf.Rect(0, 0, 20, 20), stream=cv2.imencode(".png", tiny)[1].tobytes())
+        page.insert_image(pymupdf.Rect(50, 50, 250, 250), stream=cv2.imencode(".png", barcode)[1].tobytes())
+
+        found = pdf_scan.candidates(pdf)
+        self.assertEqual([c.page for c in found], [1, 0])
+        page_index, source, img = next(pdf_scan.extracted_images(pdf, found))
+        self.assertEqual((page_index, source), (1, "image"))
+        numpy.testing.assert_array_equal(img, barcode)
+
+        page_index, source, img = next(pdf_scan.rendered_pages(pdf))
+        self.assertEqual((page_index, source, img.ndim), (0, "render", 2))
+        self.assertEqual(img.shape[1], round(pdf[0].rect.width * pdf_scan.RENDER_DPI / 72))
+
+    def test_scans_share_one_bounded_pool(self):
+        pdf = pymupdf.open()
+        for _ in range(3):
+            pdf.new_page().insert_text((50, 50), "No barcode here")
+
+        executor = pdf_scan.get_executor()
+        for _ in range(2):
+            self.assertIsNone(pdf_scan.find_barcode(pdf))
+        self.assertIs(pdf_scan.get_executor(), executor)
+        # Every decode handed its slot back once it finished
+        for _ in range(pdf_scan.MAX_PENDING):
+            self.assertTrue(pdf_scan.PENDING_SLOTS.acquire(timeout=5))
+        for _ in range(pdf_scan.MAX_PENDING):
+            pdf_scan.PENDING_SLOTS.release()
+
+
+class DecodeServiceTest(SimpleTestCase):
+    def setUp(self):
+        self.server = decode_service.DecodeServer("unused", 1, 0, 10, 512 * 1024 * 1024)
+        self.server.start()
+
+    def tearDown(self):
+        while not self.server.idle.empty():
+            self.server.idle.get().stop()
+
+    def test_jobs_run_in_worker(self):
+        response, payload = self.server.submit({"kind": "image"}, b"not an image")
+        self.assertEqual(response, {"status": "not_found", "message": "Unable to read image"})
+        response, _ = self.server.submit({"kind": "pdf"}, b"not a pdf")
+        self.assertEqual(response["status"], "error")
+        self.assertEqual(self.server.stats()["counts"]["not_found"], 1)
+
+    def test_full_queue_rejected(self):
+        self.server.slots.acquire()
+        try:
+            response, _ = self.server.submit({"kind": "image"}, b"")
+        finally:
+            self.server.slots.release()
+        self.assertEqual(response["status"], "busy")
+        self.assertEqual(self.server.stats()["counts"]["busy"], 1)
+
+    def test_crashed_worker_replaced(self):
+        worker = self.server.idle.get()
+        worker.process.kill()
+        worker.process.join()
+        self.server.idle.put(worker)
+
+        response, _ = self.server.submit({"kind": "image"}, b"")
+        self.assertEqual(response["status"], "error")
+        self.assertEqual(self.server.stats()["counts"]["crashed"], 1)
+        response, _ = self.server.submit({"kind": "image"}, b"not an image")
+        self.assertEqual(response["status"], "not_found")
+
+
+class TicketCacheTest(SimpleTestCase):
+    def test_local_cache_bounded_by_entries_without_pickling(self):
+        cache = ticket_cache.TicketCache(max_bytes=1024, max_entries=2, shared_alias=None)
+        for key in ("a", "b", "a", "c"):
+            # A lambda can't be pickled, so this would not be cached if the size were still measured
+            cache.get_or_parse(key, lambda: (lambda: key))
+
+        stats = cache.stats()
+        self.assertEqual(list(cache.entries), ["a", "c"])
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"], stats["bytes"]), (1, 3, 1, 0))
+
+
+class BarcodeCacheTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+
+        self.account = get_user_model().objects.create(username="abo").account
+        self.abo = models.DBSubscription.objects.create(
+            account=self.account, device_token="token", refresh_at=timezone.now()
+        )
+        self.barcode = IngestTest.elb_barcode("AAAAAA", 1)
+        self.ticket = models.Ticket.objects.create(
+            id="ABO", ticket_type=models.Ticket.TYPE_FAHRKARTE, last_updated=timezone.now(),
+            account=self.account, db_subscription=self.abo
+        )
+        self.entry = models.SubscriptionBarcode.objects.create(
+            image_digest=barcode_cache.digest(b"image"), barcode_digest=barcode_cache.digest(self.barcode),
+            barcode_data=self.barcode, ticket=self.ticket, parser_version=ticket_cache.PARSER_VERSION,
+            ingested_at=timezone.now()
+        )
+
+    def test_unchanged_image_skipped(self):
+        stats = barcode_cache.CacheStats()
+        with self.assertNumQueries(1):
+            ticket_obj = barcode_cache.ingest_image(b"image", self.account, {"db_subscription": self.abo}, stats)
+        self.assertEqual(ticket_obj.pk, "ABO")
+        self.assertEqual((stats.images, stats.unchanged, stats.decodes_skipped), (1, 1, 1))
+        self.assertEqual(stats.skip_ratio(), 1)
+
+    def test_stale_entry_not_current(self):
+        links = {"db_subscription": self.abo}
+        self.assertTrue(barcode_cache.is_current(self.entry, self.account, links))
+        self.assertFalse(barcode_cache.is_current(self.entry, self.account, {"saarvv_account": self.account}))
+        self.entry.parser_version -= 1
+        self.assertFalse(barcode_cache.is_current(self.entry, self.account, links))
+
+    def test_superseded_images_pruned(self):
+        other_ticket = models.Ticket.objects.create(
+            id="OTHER", ticket_type=models.Ticket.TYPE_FAHRKARTE, last_updated=timezone.now(), account=self.account
+        )
+        for image, ticket_obj in ((b"newer image", self.ticket), (b"other image", other_ticket)):
+            models.SubscriptionBarcode.objects.create(
+                image_digest=barcode_cache.digest(image), barcode_digest=self.entry.barcode_digest,
+                barcode_data=self.barcode, ticket=ticket_obj, parser_version=ticket_cache.PARSER_VERSION,
+                ingested_at=timezone.now()
+            )
+
+        barcode_cache.prune(self.ticket, barcode_cache.digest(b"newer image"))
+        self.assertEqual(
+            set(models.SubscriptionBarcode.objects.values_list("image_digest", flat=True)),
+            {barcode_cache.digest(b"newer image"), barcode_cache.digest(b"other image")}
+        )
+
+
+class DBAboBatchTest(SimpleTestCase):
+    def test_results_matched_to_subscriptions(self):
+        abos = [models.DBSubscription(device_token=token) for token in ("a", "b", "c")]
+        self.assertEqual(db_abo.refresh_request(abos)["aboTicketCheckRequestList"][1], {"deviceToken": "b"})
+
+        results = db_abo.match_results(abos, [{"deviceToken": "c", "n": 3}, {"deviceToken": "a", "n": 1}])
+        self.assertEqual([(abo.device_token, r and r["n"]) for abo, r in results], [("a", 1), ("b", None), ("c", 3)])
+        self.assertEqual(db_abo.match_results(abos[:1], []), [(abos[0], None)])
+        with self.assertRaises(ValueError):
+            db_abo.match_results(abos, [{"n": 1}])
+
+
+class RefreshSchedulerTest(TestCase):
+    def test_due_rows_claimed_once(self):
+        from django.contrib.auth import get_user_model
+
+        now = timezone.now()
+        account = get_user_model().objects.create(username="abo").account
+        due = [
+            models.DBSubscription.objects.create(account=account, device_token=f"due-{i}", refresh_at=now)
+            for i in range(3)
+        ]
+        models.DBSubscription.objects.create(
+            account=account, device_token="later", refresh_at=now + datetime.timedelta(hours=1)
+        )
+
+        claimed = refresh_scheduler.claim_due_subscriptions(2)
+        claimed += refresh_scheduler.claim_due_subscriptions(2)
+        self.assertEqual(sorted(abo.pk for abo in claimed), [abo.pk for abo in due])
+        self.assertEqual(refresh_scheduler.claim_due_subscriptions(), [])
+        self.assertFalse(models.DBSubscription.objects.filter(refresh_at__lte=now + refresh_scheduler.LEASE).exists())
+
+    def test_saarvv_accounts_claimed_until_next_sync(self):
+        from django.contrib.auth import get_user_model
+
+        account = get_user_model().objects.create(username="saarvv").account
+        account.saarvv_token = "token"
+        account.saarvv_device_id = "device"
+        account.save()
+        get_user_model().objects.create(username="other")
+
+        self.assertEqual([a.pk for a in refresh_scheduler.claim_due_saarvv_accounts()], [account.pk])
+        self.assertEqual(refresh_scheduler.claim_due_saarvv_accounts(), [])
+        account.refresh_from_db()
+        self.assertGreater(account.saarvv_next_sync_at, timezone.now() + refresh_scheduler.SAARVV_INTERVAL / 2)
+
+    def test_stale_refresh_date_not_due_again(self):
+        from django.contrib.auth import get_user_model
+
+        account = get_user_model().objects.create(username="stale").account
+        abo = models.DBSubscription.objects.create(account=account, device_token="stale", refresh_at=timezone.now())
+
+        claimed = refresh_scheduler.claim_due_subscriptions()
+        db_abo.apply_refresh(claimed[0], {
+            "refreshDatum": "2020-01-01T00:00:00+00:00", "ticketHuelle": {}, "tickets": []
+        }, barcode_cache.CacheStats())
+        self.assertEqual(refresh_scheduler.claim_due_subscriptions(), [])
+        abo.refresh_from_db()
+        self.assertGreaterEqual(abo.refresh_at, timezone.now() + db_abo.MIN_REFRESH_INTERVAL / 2)
+
+
+class SaarVVSyncTest(SimpleTestCase):
+    def test_only_changed_tickets_selected(self):
+        tickets = {"1": {"modified": 1}, "2": {"modified": 2}}
+        previous = saarvv.sync_fingerprints(tickets)
+        tickets["2"]["modified"] = 3
+        current = saarvv.sync_fingerprints(tickets)
+        changed = saarvv.changed_tickets(current, previous)
+        self.assertEqual(changed, {"2"})
+        self.assertEqual(saarvv.select_tickets(tickets, changed), {"2": {"modified": 3}})
+        self.assertEqual(saarvv.select_tickets([{"id": 1}, {"id": 2}], {"1"}), [{"id": 1}])
+        self.assertEqual(list(saarvv.sync_fingerprints(["a", "b"])), ["a", "b"])
+
+
+class RenewalTest(TestCase):
+    def make_ticket(self, pk, last_updated, uic_starts=(), vdv_starts=()):
+        now = timezone.now()
+        ticket_obj = models.Ticket.objects.create(id=pk, last_updated=now + last_updated)
+        for i, start in enumerate(uic_starts):
+            models.UICTicketInstance.objects.create(
+                ticket=ticket_obj, reference=f"{pk}-{i}", distributor_rics=1080, issuing_time=now + start,
+                barcode_data=b"", decoded_data={}, validity_start=now + start
+            )
+        for i, start in enumerate(vdv_starts):
+            models.VDVTicketInstance.objects.create(
+                ticket=ticket_obj, ticket_number=models.VDVTicketInstance.objects.count() + 1, ticket_org_id=6310,
+                validity_start=now + start, validity_end=now + start + datetime.timedelta(days=30),
+                barcode_data=b"", decoded_data={}
+            )
+        return ticket_obj
+
+    def test_renewed_tickets_found(self):
+        hour = datetime.timedelta(hours=1)
+        self.make_ticket("UIC", -2 * hour, uic_starts=[-3 * hour, -hour, hour])
+        self.make_ticket("VDV", -2 * hour, vdv_starts=[-hour])
+        # The newest valid UIC instance wins over a newer VDV one
+        self.make_ticket("UIC-OLD", -2 * hour, uic_starts=[-3 * hour], vdv_starts=[-hour])
+        self.make_ticket("FUTURE", -2 * hour, uic_starts=[hour])
+        self.make_ticket("CURRENT", 0 * hour, uic_starts=[-hour])
+
+        renewed = apn.renew_tickets(models.Ticket.objects.all())
+        self.assertEqual(sorted(t.pk for t in renewed), ["UIC", "VDV"])
+        self.assertEqual(apn.renew_tickets(models.Ticket.objects.all()), [])
+
+    def test_query_count_independent_of_ticket_count(self):
+        counts = []
+        for n in (1, 5):
+            for i in range(n):
+                self.make_ticket(f"{n}-{i}", -datetime.timedelta(hours=2), uic_starts=[-datetime.timedelta(hours=1)])
+            with CaptureQueriesContext(connection) as queries:
+                renewed = apn.notify_renewed_tickets(models.Ticket.objects.filter(pk__startswith=f"{n}-"))
+            self.assertEqual(len(renewed), n)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
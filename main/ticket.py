@@ -1,12 +1,15 @@
 import base64
+import collections
 import dataclasses
+import functools
+import threading
 import traceback
 import typing
 import datetime
 import Crypto.Hash.TupleHash128
 from django.utils import timezone
 import django.core.files.storage
-from . import models, vdv, uic, rsp, templatetags, apn, gwallet, sncf, elb, ssb
+from . import models, vdv, uic, rsp, templatetags, apn, gwallet, sncf, elb, ssb, ticket_formats
 
 
 class TicketError(Exception):
@@ -61,20 +64,56 @@ class VDVTicket:
         return base64.b32encode(hd.digest()).decode("utf-8")
 
 
+UIC_TYPED_RECORDS = {"0080BL", "0080VU", "1154UT", "118199", "5197TI", "5008TI", "5197PA", "5008PA"}
+
+
 @dataclasses.dataclass
 class UICTicket:
     raw_bytes: bytes
     envelope: uic.Envelope
-    head: uic.HeadV1
-    layout: typing.Optional[uic.LayoutV1]
-    flex: typing.Optional[uic.Flex]
-    dt_ti: typing.Optional[uic.dt.DTRecordTI]
-    dt_pa: typing.Optional[uic.dt.DTRecordPA]
-    db_bl: typing.Optional[uic.db.DBRecordBL]
-    cd_ut: typing.Optional[uic.cd.CDRecordUT]
-    oebb_99: typing.Optional[uic.oebb.OeBBRecord99]
-    db_vu: typing.Optional[uic.db_vu.DBRecordVU]
-    other_records: typing.List[uic.envelope.Record]
+    context: vdv.ticket.Context
+
+    # Typed records are only decoded when first read, so callers pay only for the records they use
+
+    @functools.cached_property
+    def head(self) -> typing.Optional[uic.HeadV1]:
+        return parse_ticket_uic_head(self.envelope)
+
+    @functools.cached_property
+    def layout(self) -> typing.Optional[uic.LayoutV1]:
+        return parse_ticket_uic_layout(self.envelope)
+
+    @functools.cached_property
+    def flex(self) -> typing.Optional[uic.Flex]:
+        return parse_ticket_uic_flex(self.envelope)
+
+    @functools.cached_property
+    def dt_ti(self) -> typing.Optional[uic.dt.DTRecordTI]:
+        return parse_ticket_uic_dt_ti(self.envelope)
+
+    @functools.cached_property
+    def dt_pa(self) -> typing.Optional[uic.dt.DTRecordPA]:
+        return parse_ticket_uic_dt_pa(self.envelope)
+
+    @functools.cached_property
+    def db_bl(self) -> typing.Optional[uic.db.DBRecordBL]:
+        return parse_ticket_uic_db_bl(self.envelope)
+
+    @functools.cached_property
+    def cd_ut(self) -> typing.Optional[uic.cd.CDRecordUT]:
+        return parse_ticket_uic_cd_ut(self.envelope)
+
+    @functools.cached_property
+    def oebb_99(self) -> typing.Optional[uic.oebb.OeBBRecord99]:
+        return parse_ticket_uic_oebb_99(self.envelope)
+
+    @functools.cached_property
+    def db_vu(self) -> typing.Optional[uic.db_vu.DBRecordVU]:
+        return parse_ticket_uic_db_vu(self.envelope, self.context)
+
+    @functools.cached_property
+    def other_records(self) -> typing.List[uic.envelope.Record]:
+        return [r for r in self.envelope.records if not (r.id.startswith("U_") or r.id in UIC_TYPED_RECORDS)]
 
     @property
     def ticket_type(self) -> str:
@@ -245,22 +284,13 @@ class UICTicket:
         return cls(
             raw_bytes=ticket_bytes,
             envelope=ticket_envelope,
-            head=parse_ticket_uic_head(ticket_envelope),
-            layout=parse_ticket_uic_layout(ticket_envelope),
-            flex=parse_ticket_uic_flex(ticket_envelope),
-            dt_ti=parse_ticket_uic_dt_ti(ticket_envelope),
-            dt_pa=parse_ticket_uic_dt_pa(ticket_envelope),
-            db_bl=parse_ticket_uic_db_bl(ticket_envelope),
-            db_vu=parse_ticket_uic_db_vu(ticket_envelope, context),
-            cd_ut=parse_ticket_uic_cd_ut(ticket_envelope),
-            oebb_99=parse_ticket_uic_oebb_99(ticket_envelope),
-            other_records=[r for r in ticket_envelope.records if not (
-                    r.id.startswith("U_") or r.id == "0080BL" or r.id == "0080VU"
-                    or r.id == "1154UT" or r.id == "118199" or r.id == "5197TI"
-                    or r.id == "5008TI" or r.id == "5197PA" or r.id == "5008PA"
-            )]
+            context=context,
         )
 
+    def validate(self):
+        for name in ("head", "layout", "flex", "dt_ti", "dt_pa", "db_bl", "cd_ut", "oebb_99", "db_vu"):
+            getattr(self, name)
+
 
 @dataclasses.dataclass
 class RSPTicket:
@@ -381,17 +411,46 @@ class SSBTicket:
         return base64.b32encode(hd.digest()).decode("utf-8")
 
 
-def parse_ticket_vdv(ticket_bytes: bytes, context: vdv.ticket.Context) -> VDVTicket:
-    pki_store = vdv.CertificateStore()
-    try:
-        pki_store.load_certificates()
-    except vdv.util.VDVException:
-        raise TicketError(
-            title="Internal error",
-            message="The PKI certificates could not be loaded. This is almost certainly a bug.",
-            exception=traceback.format_exc()
-        )
+class CertificateCache:
+    entries: "collections.OrderedDict[typing.Hashable, vdv.CertificateData]"
+
+    def __init__(self, max_size: int):
+        self.entries = collections.OrderedDict()
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def get(self, key: typing.Hashable) -> typing.Optional[vdv.CertificateData]:
+        with self._lock:
+            if data := self.entries.get(key):
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key: typing.Hashable, data: vdv.CertificateData) -> vdv.CertificateData:
+        with self._lock:
+            self.entries[key] = data
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
 
+
+VDV_CACHE_MAX_SIZE = 4096
+VDV_CA_CACHE = CertificateCache(VDV_CACHE_MAX_SIZE)
+VDV_ENVELOPE_CERTIFICATE_CACHE = CertificateCache(VDV_CACHE_MAX_SIZE)
+
+
+def vdv_ca_identity(ca_data: vdv.CertificateData) -> typing.Tuple[bytes, int, int]:
+    return ca_data.certificate_holder_reference.to_bytes(), ca_data.public_key.modulus, ca_data.public_key.exponent
+
+
+def verify_vdv_root_ca(pki_store: vdv.CertificateStore) -> vdv.CertificateData:
     raw_root_ca = pki_store.find_certificate(vdv.CAReference.root())
     if not raw_root_ca:
         raise TicketError(
@@ -399,6 +458,10 @@ def parse_ticket_vdv(ticket_bytes: bytes, context: vdv.ticket.Context) -> VDVTic
             message="The root CA couldn't be found. This is almost certainly a bug.",
         )
 
+    cache_key = (None, raw_root_ca.data)
+    if root_ca_data := VDV_CA_CACHE.get(cache_key):
+        return root_ca_data
+
     try:
         root_ca = vdv.Certificate.parse(raw_root_ca)
     except vdv.util.VDVException:
@@ -439,22 +502,16 @@ def parse_ticket_vdv(ticket_bytes: bytes, context: vdv.ticket.Context) -> VDVTic
             exception=traceback.format_exc()
         )
 
-    try:
-        envelope = vdv.EnvelopeV2.parse(ticket_bytes)
-    except vdv.util.VDVException:
-        raise TicketError(
-            title="This doesn't look like a valid VDV ticket",
-            message="You may have scanned something that is not a VDV ticket, the ticket is corrupted, or there "
-                    "is a bug in this program.",
-            exception=traceback.format_exc()
-        )
+    return VDV_CA_CACHE.put(cache_key, root_ca_data)
 
-    raw_issuing_ca = pki_store.find_certificate(envelope.ca_reference)
-    if not raw_issuing_ca:
-        raise TicketError(
-            title="Unknown issuing certificate",
-            message="The certificate that issued this ticket is not known - the ticket is likely invalid."
-        )
+
+def verify_vdv_issuing_ca(
+        raw_issuing_ca: vdv.pki.RawCertificate, root_ca_data: vdv.CertificateData
+) -> vdv.CertificateData:
+    # The same bytes only make the same certificate under the same root, as decryption depends on its key
+    cache_key = (vdv_ca_identity(root_ca_data), raw_issuing_ca.data)
+    if issuing_ca_data := VDV_CA_CACHE.get(cache_key):
+        return issuing_ca_data
 
     try:
         issuing_ca = vdv.Certificate.parse(raw_issuing_ca)
@@ -499,15 +556,23 @@ def parse_ticket_vdv(ticket_bytes: bytes, context: vdv.ticket.Context) -> VDVTic
             message="The issuing CA isn't issued by the root CA - the ticket is likely invalid."
         )
 
-    if envelope.ca_reference != issuing_ca_data.certificate_holder_reference:
-        raise TicketError(
-            title="Broken certificate chain",
-            message="The ticket certificate isn't issued by the issuing CA - the ticket is likely invalid."
-        )
+    return VDV_CA_CACHE.put(cache_key, issuing_ca_data)
+
+
+def verify_vdv_envelope_certificate(
+        envelope: vdv.EnvelopeV2, issuing_ca_data: vdv.CertificateData
+) -> vdv.CertificateData:
+    certificate = envelope.certificate
+    cache_key = (
+        vdv_ca_identity(issuing_ca_data), envelope.ca_reference.to_bytes(),
+        certificate.signature, certificate.signature_residual, certificate.content
+    )
+    if envelope_certificate_data := VDV_ENVELOPE_CERTIFICATE_CACHE.get(cache_key):
+        return envelope_certificate_data
 
-    if envelope.certificate.needs_ca_key():
+    if certificate.needs_ca_key():
         try:
-            envelope.certificate.decrypt_with_ca_key(issuing_ca_data)
+            certificate.decrypt_with_ca_key(issuing_ca_data)
         except vdv.util.VDVException:
             raise TicketError(
                 title="Unable to decrypt ticket certificate",
@@ -516,7 +581,7 @@ def parse_ticket_vdv(ticket_bytes: bytes, context: vdv.ticket.Context) -> VDVTic
             )
     else:
         try:
-            envelope.certificate.verify_signature(issuing_ca_data)
+            certificate.verify_signature(issuing_ca_data)
         except vdv.util.VDVException:
             raise TicketError(
                 title="Invalid ticket certificate signature",
@@ -525,7 +590,7 @@ def parse_ticket_vdv(ticket_bytes: bytes, context: vdv.ticket.Context) -> VDVTic
             )
 
     try:
-        envelope_certificate_data = vdv.CertificateData.parse(envelope.certificate)
+        envelope_certificate_data = vdv.CertificateData.parse(certificate)
     except vdv.util.VDVException:
         raise TicketError(
             title="Invalid ticket certificate data",
@@ -533,6 +598,48 @@ def parse_ticket_vdv(ticket_bytes: bytes, context: vdv.ticket.Context) -> VDVTic
             exception=traceback.format_exc()
         )
 
+    return VDV_ENVELOPE_CERTIFICATE_CACHE.put(cache_key, envelope_certificate_data)
+
+
+def parse_ticket_vdv(ticket_bytes: bytes, context: vdv.ticket.Context) -> VDVTicket:
+    try:
+        pki_store = vdv.get_certificate_store()
+    except vdv.util.VDVException:
+        raise TicketError(
+            title="Internal error",
+            message="The PKI certificates could not be loaded. This is almost certainly a bug.",
+            exception=traceback.format_exc()
+        )
+
+    root_ca_data = verify_vdv_root_ca(pki_store)
+
+    try:
+        envelope = vdv.EnvelopeV2.parse(ticket_bytes)
+    except vdv.util.VDVException:
+        raise TicketError(
+            title="This doesn't look like a valid VDV ticket",
+            message="You may have scanned something that is not a VDV ticket, the ticket is corrupted, or there "
+                    "is a bug in this program.",
+            exception=traceback.format_exc()
+        )
+
+    raw_issuing_ca = pki_store.find_certificate(envelope.ca_reference)
+    if not raw_issuing_ca:
+        raise TicketError(
+            title="Unknown issuing certificate",
+            message="The certificate that issued this ticket is not known - the ticket is likely invalid."
+        )
+
+    issuing_ca_data = verify_vdv_issuing_ca(raw_issuing_ca, root_ca_data)
+
+    if envelope.ca_reference != issuing_ca_data.certificate_holder_reference:
+        raise TicketError(
+            title="Broken certificate chain",
+            message="The ticket certificate isn't issued by the issuing CA - the ticket is likely invalid."
+        )
+
+    envelope_certificate_data = verify_vdv_envelope_certificate(envelope, issuing_ca_data)
+
     try:
         ticket_data = envelope.decrypt_with_cert(envelope_certificate_data)
     except vdv.util.VDVException:
@@ -561,7 +668,7 @@ def parse_ticket_vdv(ticket_bytes: bytes, context: vdv.ticket.Context) -> VDVTic
 
 
 def parse_ticket_uic_head(ticket_envelope: uic.Envelope) -> typing.Optional[uic.HeadV1]:
-    head_record = next(filter(lambda r: r.id == "U_HEAD", ticket_envelope.records), None)
+    head_record = ticket_envelope.first_record(("U_HEAD", None))
     if not head_record:
         return None
 
@@ -582,7 +689,7 @@ def parse_ticket_uic_head(ticket_envelope: uic.Envelope) -> typing.Optional[uic.
 
 
 def parse_ticket_uic_layout(ticket_envelope: uic.Envelope) -> typing.Optional[uic.LayoutV1]:
-    layout_record = next(filter(lambda r: r.id == "U_TLAY", ticket_envelope.records), None)
+    layout_record = ticket_envelope.first_record(("U_TLAY", None))
     if not layout_record:
         return None
 
@@ -603,7 +710,7 @@ def parse_ticket_uic_layout(ticket_envelope: uic.Envelope) -> typing.Optional[ui
 
 
 def parse_ticket_uic_flex(ticket_envelope: uic.Envelope) -> typing.Optional[uic.Flex]:
-    flex_record = next(filter(lambda r: r.id == "U_FLEX", ticket_envelope.records), None)
+    flex_record = ticket_envelope.first_record(("U_FLEX", None))
     if not flex_record:
         return None
 
@@ -618,10 +725,7 @@ def parse_ticket_uic_flex(ticket_envelope: uic.Envelope) -> typing.Optional[uic.
 
 
 def parse_ticket_uic_dt_ti(ticket_envelope: uic.Envelope) -> typing.Optional[uic.dt.DTRecordTI]:
-    ti_record = next(filter(
-        lambda r: r.id == "5197TI" or r.id == "5008TI" and r.version == 1,
-        ticket_envelope.records
-    ), None)
+    ti_record = ticket_envelope.first_record(("5197TI", None), ("5008TI", 1))
     if not ti_record:
         return None
 
@@ -636,10 +740,7 @@ def parse_ticket_uic_dt_ti(ticket_envelope: uic.Envelope) -> typing.Optional[uic
 
 
 def parse_ticket_uic_dt_pa(ticket_envelope: uic.Envelope) -> typing.Optional[uic.dt.DTRecordTI]:
-    pa_record = next(filter(
-        lambda r: r.id == "5197PA" or r.id == "5008PA" and r.version == 1,
-        ticket_envelope.records
-    ), None)
+    pa_record = ticket_envelope.first_record(("5197PA", None), ("5008PA", 1))
     if not pa_record:
         return None
 
@@ -654,7 +755,7 @@ def parse_ticket_uic_dt_pa(ticket_envelope: uic.Envelope) -> typing.Optional[uic
 
 
 def parse_ticket_uic_db_bl(ticket_envelope: uic.Envelope) -> typing.Optional[uic.db.DBRecordBL]:
-    bl_record = next(filter(lambda r: r.id == "0080BL" and r.version == 3, ticket_envelope.records), None)
+    bl_record = ticket_envelope.first_record(("0080BL", 3))
     if not bl_record:
         return None
 
@@ -669,7 +770,7 @@ def parse_ticket_uic_db_bl(ticket_envelope: uic.Envelope) -> typing.Optional[uic
 
 
 def parse_ticket_uic_cd_ut(ticket_envelope: uic.Envelope) -> typing.Optional[uic.cd.CDRecordUT]:
-    ut_record = next(filter(lambda r: r.id == "1154UT" and r.version == 1, ticket_envelope.records), None)
+    ut_record = ticket_envelope.first_record(("1154UT", 1))
     if not ut_record:
         return None
 
@@ -683,7 +784,7 @@ def parse_ticket_uic_cd_ut(ticket_envelope: uic.Envelope) -> typing.Optional[uic
         )
 
 def parse_ticket_uic_db_vu(ticket_envelope: uic.Envelope, context: vdv.ticket.Context) -> typing.Optional[uic.db_vu.DBRecordVU]:
-    vu_record = next(filter(lambda r: r.id == "0080VU" and r.version == 1, ticket_envelope.records), None)
+    vu_record = ticket_envelope.first_record(("0080VU", 1))
     if not vu_record:
         return None
 
@@ -697,7 +798,7 @@ def parse_ticket_uic_db_vu(ticket_envelope: uic.Envelope, context: vdv.ticket.Co
         )
 
 def parse_ticket_uic_oebb_99(ticket_envelope: uic.Envelope) -> typing.Optional[uic.oebb.OeBBRecord99]:
-    oebb_record = next(filter(lambda r: r.id == "118199" and r.version == 1, ticket_envelope.records), None)
+    oebb_record = ticket_envelope.first_record(("118199", 1))
     if not oebb_record:
         return None
 
@@ -722,11 +823,14 @@ def parse_ticket_uic(ticket_bytes: bytes, context: vdv.ticket.Context) -> UICTic
             exception=traceback.format_exc()
         )
 
-    return UICTicket.from_envelope(ticket_bytes, ticket_envelope, context)
+    # A new barcode has every record decoded once so a malformed one is rejected here rather than when the stored
+    # ticket is next rendered; tickets loaded back from the database stay lazy
+    ticket_data = UICTicket.from_envelope(ticket_bytes, ticket_envelope, context)
+    ticket_data.validate()
+    return ticket_data
 
 def parse_ticket_rsp(ticket_bytes: bytes) -> RSPTicket:
-    pki_store = rsp.CertificateStore()
-    pki_store.load_certificates()
+    pki_store = rsp.get_certificate_store()
 
     try:
         ticket_envelope = rsp.Envelope.parse(ticket_bytes)
@@ -745,18 +849,25 @@ def parse_ticket_rsp(ticket_bytes: bytes) -> RSPTicket:
         )
 
     ticket_payload = None
-    for cert in pki_store.certificates[ticket_envelope.issuer_id]:
+    matched_cert = None
+    attempts = 0
+    for cert in pki_store.candidate_keys(ticket_envelope.issuer_id):
+        attempts += 1
         try:
             ticket_payload = ticket_envelope.decrypt_with_cert(cert)
         except rsp.RSPException:
+            pki_store.record_match(ticket_envelope.issuer_id, None, attempts)
             raise TicketError(
                 title="Unable to decrypt RSP ticket",
                 message="Its likely the signature over this ticket has been forged - the ticket is invalid.",
                 exception=traceback.format_exc()
             )
         if ticket_payload:
+            matched_cert = cert
             break
 
+    pki_store.record_match(ticket_envelope.issuer_id, matched_cert, attempts)
+
     if not ticket_payload:
         raise TicketError(
             title="Unable to decrypt RSP ticket",
@@ -859,18 +970,63 @@ def parse_ticket(ticket_bytes: bytes, account: typing.Optional["models.Account"]
         account_forename=account.user.first_name if account else None,
         account_surname=account.user.last_name if account else None,
     )
-    if len(ticket_bytes) == 114 and (ticket_bytes[0] & 0xF0) >> 4 == 3:
-        return parse_ticket_ssb(ticket_bytes)
-    if ticket_bytes[:4] == b"i0CV":
-        return parse_ticket_sncf(ticket_bytes)
-    elif ticket_bytes[:3] == b"#UT":
-        return parse_ticket_uic(ticket_bytes, context)
-    elif ticket_bytes[:2] in (b"06", b"08"):
-        return parse_ticket_rsp(ticket_bytes)
-    elif ticket_bytes[:1] == b"e":
-        return parse_ticket_elb(ticket_bytes)
-    else:
-        return parse_ticket_vdv(ticket_bytes, context)
+    return decode_ticket(ticket_bytes, context)
+
+
+def decode_ticket(ticket_bytes: bytes, context: vdv.ticket.Context) -> \
+        typing.Union[VDVTicket, UICTicket, RSPTicket, SNCFTicket, ELBTicket, SSBTicket]:
+    ticket_format = TICKET_FORMATS.identify(ticket_bytes)
+    if not ticket_format:
+        raise TicketError(
+            title="Unknown ticket format",
+            message="This barcode doesn't look like any ticket format we support - you may have scanned something "
+                    "that isn't a ticket.",
+        )
+
+    return TICKET_FORMATS.parse(ticket_format, ticket_bytes, context)
+
+
+def sniff_ssb(data: bytes) -> float:
+    return 0.8 if len(data) == 114 and data[0] >> 4 == 3 else 0
+
+
+def sniff_sncf(data: bytes) -> float:
+    if data[:4] != b"i0CV":
+        return 0
+    return 1 if len(data) == 131 else 0.5
+
+
+def sniff_uic(data: bytes) -> float:
+    if data[:3] != b"#UT":
+        return 0
+    return 1 if data[3:5] in (b"01", b"02") else 0.5
+
+
+def sniff_rsp(data: bytes) -> float:
+    if data[:2] not in (b"06", b"08") or len(data) < 16:
+        return 0
+    return 0.9 if data[2:15].isascii() else 0.3
+
+
+def sniff_elb(data: bytes) -> float:
+    if data[:1] != b"e":
+        return 0
+    return 0.6 if data[19:20] in (b"0", b"1") else 0.2
+
+
+def sniff_vdv(data: bytes) -> float:
+    if data[:3] == b"\x9e\x81\x80":
+        return 0.9
+    return 0.2 if data[:1] in (b"\x9e", b"\x9a", b"\x7f", b"\x42") else 0
+
+
+TICKET_FORMATS = ticket_formats.FormatRegistry()
+TICKET_FORMATS.register("SSB", sniff_ssb, lambda data, context: parse_ticket_ssb(data))
+TICKET_FORMATS.register("SNCF", sniff_sncf, lambda data, context: parse_ticket_sncf(data))
+TICKET_FORMATS.register("UIC", sniff_uic, parse_ticket_uic)
+TICKET_FORMATS.register("RSP", sniff_rsp, lambda data, context: parse_ticket_rsp(data))
+TICKET_FORMATS.register("ELB", sniff_elb, lambda data, context: parse_ticket_elb(data))
+TICKET_FORMATS.register("VDV", sniff_vdv, parse_ticket_vdv)
 
 
 def to_dict_json(elements: typing.List[typing.Tuple[str, typing.Any]]) -> dict:
@@ -883,30 +1039,37 @@ def to_dict_json(elements: typing.List[typing.Tuple[str, typing.Any]]) -> dict:
     return {k: encode_value(v) for k, v in elements}
 
 
-def create_ticket_obj(
-        ticket_obj: "models.Ticket",
+def signature_verification_defaults(envelope: typing.Union[uic.Envelope, ssb.Envelope]) -> dict:
+    result = uic.certs.verify_envelope(envelope)
+    return {
+        "signature_valid": result.valid,
+        "signature_key_fingerprint": result.key_fingerprint,
+        "signature_key_ring_version": result.key_ring_version,
+        "signature_verified_at": result.verified_at,
+    }
+
+
+def ticket_instance_values(
         ticket_bytes: bytes,
-        ticket_data: typing.Union[VDVTicket, UICTicket, RSPTicket, SNCFTicket, ELBTicket],
-) -> bool:
-    created = False
+        ticket_data: typing.Union[VDVTicket, UICTicket, RSPTicket, SNCFTicket, ELBTicket, SSBTicket],
+        verify_signature: bool = True,
+) -> typing.Tuple[typing.Type["models.Model"], dict, dict]:
     if isinstance(ticket_data, VDVTicket):
-        _, created = models.VDVTicketInstance.objects.update_or_create(
-            ticket_number=ticket_data.ticket.ticket_id,
-            ticket_org_id=ticket_data.ticket.ticket_org_id,
-            defaults={
-                "ticket": ticket_obj,
-                "validity_start": ticket_data.ticket.validity_start.as_datetime(),
-                "validity_end": ticket_data.ticket.validity_end.as_datetime(),
-                "barcode_data": ticket_bytes,
-                "decoded_data": {
-                    "root_ca": dataclasses.asdict(ticket_data.root_ca, dict_factory=to_dict_json),
-                    "issuing_ca": dataclasses.asdict(ticket_data.issuing_ca, dict_factory=to_dict_json),
-                    "envelope_certificate":
-                        dataclasses.asdict(ticket_data.envelope_certificate, dict_factory=to_dict_json),
-                    "ticket": base64.b64encode(ticket_data.raw_ticket).decode("ascii"),
-                }
+        return models.VDVTicketInstance, {
+            "ticket_number": ticket_data.ticket.ticket_id,
+            "ticket_org_id": ticket_data.ticket.ticket_org_id,
+        }, {
+            "validity_start": ticket_data.ticket.validity_start.as_datetime(),
+            "validity_end": ticket_data.ticket.validity_end.as_datetime(),
+            "barcode_data": ticket_bytes,
+            "decoded_data": {
+                "root_ca": dataclasses.asdict(ticket_data.root_ca, dict_factory=to_dict_json),
+                "issuing_ca": dataclasses.asdict(ticket_data.issuing_ca, dict_factory=to_dict_json),
+                "envelope_certificate":
+                    dataclasses.asdict(ticket_data.envelope_certificate, dict_factory=to_dict_json),
+                "ticket": base64.b64encode(ticket_data.raw_ticket).decode("ascii"),
             }
-        )
+        }
     elif isinstance(ticket_data, UICTicket):
         validity_start = None
         validity_end = None
@@ -920,20 +1083,19 @@ def create_ticket_obj(
                     validity_start = templatetags.rics.rics_valid_from(docs[0]["ticket"][1], ticket_data.issuing_time())
                     validity_end = templatetags.rics.rics_valid_until(docs[0]["ticket"][1], ticket_data.issuing_time())
 
-        _, created = models.UICTicketInstance.objects.update_or_create(
-            reference=ticket_data.ticket_id(),
-            distributor_rics=ticket_data.issuing_rics(),
-            defaults={
-                "ticket": ticket_obj,
-                "issuing_time": ticket_data.issuing_time(),
-                "barcode_data": ticket_bytes,
-                "validity_start": validity_start,
-                "validity_end": validity_end,
-                "decoded_data": {
-                    "envelope": dataclasses.asdict(ticket_data.envelope, dict_factory=to_dict_json),
-                }
-            }
-        )
+        return models.UICTicketInstance, {
+            "reference": ticket_data.ticket_id(),
+            "distributor_rics": ticket_data.issuing_rics(),
+        }, {
+            "issuing_time": ticket_data.issuing_time(),
+            "barcode_data": ticket_bytes,
+            "validity_start": validity_start,
+            "validity_end": validity_end,
+            "decoded_data": {
+                "envelope": ticket_data.envelope.to_json(),
+            },
+            **(signature_verification_defaults(ticket_data.envelope) if verify_signature else {}),
+        }
     elif isinstance(ticket_data, RSPTicket):
         validity_start = None
         validity_end = None
@@ -941,48 +1103,52 @@ def create_ticket_obj(
             validity_start = ticket_data.data.validity_start_time()
             validity_end = ticket_data.data.validity_end_time()
 
-        _, created = models.RSPTicketInstance.objects.update_or_create(
-            ticket_type=ticket_data.rsp_type,
-            issuer_id=ticket_data.issuer_id,
-            reference=ticket_data.ticket_ref,
-            defaults={
-                "ticket": ticket_obj,
-                "barcode_data": ticket_bytes,
-                "validity_start": validity_start,
-                "validity_end": validity_end,
-                "decoded_data": {
-                    "raw_ticket": base64.b64encode(ticket_data.raw_ticket).decode("ascii"),
-                }
+        return models.RSPTicketInstance, {
+            "ticket_type": ticket_data.rsp_type,
+            "issuer_id": ticket_data.issuer_id,
+            "reference": ticket_data.ticket_ref,
+        }, {
+            "barcode_data": ticket_bytes,
+            "validity_start": validity_start,
+            "validity_end": validity_end,
+            "decoded_data": {
+                "raw_ticket": base64.b64encode(ticket_data.raw_ticket).decode("ascii"),
             }
-        )
+        }
     elif isinstance(ticket_data, SNCFTicket):
-        _, created = models.SNCFTicketInstance.objects.update_or_create(
-            reference=ticket_data.data.ticket_number,
-            defaults={
-                "ticket": ticket_obj,
-                "barcode_data": ticket_bytes,
-            }
-        )
+        return models.SNCFTicketInstance, {
+            "reference": ticket_data.data.ticket_number,
+        }, {
+            "barcode_data": ticket_bytes,
+        }
     elif isinstance(ticket_data, ELBTicket):
-        _, created = models.ELBTicketInstance.objects.update_or_create(
-            pnr=ticket_data.data.pnr,
-            sequence_number=ticket_data.data.sequence_number,
-            defaults={
-                "ticket": ticket_obj,
-                "barcode_data": ticket_bytes,
-            }
-        )
+        return models.ELBTicketInstance, {
+            "pnr": ticket_data.data.pnr,
+            "sequence_number": ticket_data.data.sequence_number,
+        }, {
+            "barcode_data": ticket_bytes,
+        }
     elif isinstance(ticket_data, SSBTicket):
-        _, created = models.SSBTicketInstance.objects.update_or_create(
-            distributor_rics=ticket_data.envelope.issuer_rics,
-            pnr=ticket_data.data.pnr,
-            defaults={
-                "ticket": ticket_obj,
-                "barcode_data": ticket_bytes,
-            }
-        )
+        return models.SSBTicketInstance, {
+            "distributor_rics": ticket_data.envelope.issuer_rics,
+            "pnr": ticket_data.data.pnr,
+        }, {
+            "barcode_data": ticket_bytes,
+            **(signature_verification_defaults(ticket_data.envelope) if verify_signature else {}),
+        }
+    raise TypeError(f"Unsupported ticket type {type(ticket_data).__name__}")
+
+
+def create_ticket_obj(
+        ticket_obj: "models.Ticket",
+        ticket_bytes: bytes,
+        ticket_data: typing.Union[VDVTicket, UICTicket, RSPTicket, SNCFTicket, ELBTicket, SSBTicket],
+) -> bool:
+    model, lookup, defaults = ticket_instance_values(ticket_bytes, ticket_data)
+    _, created = model.objects.update_or_create(**lookup, defaults={"ticket": ticket_obj, **defaults})
     return created
 
+
 def update_from_subscription_barcode(barcode_data: bytes, account: typing.Optional["models.Account"]) -> "models.Ticket":
     decoded_ticket = parse_ticket(barcode_data, account=account)
 
@@ -0,0 +1,127 @@
+import collections
+import hashlib
+import logging
+import pickle
+import threading
+import typing
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a change to a parser alters the structure of decoded tickets
+PARSER_VERSION = 3
+SHARED_TIMEOUT = 7 * 24 * 60 * 60
+
+
+class TicketCache:
+    entries: "collections.OrderedDict[str, typing.Tuple[int, typing.Any]]"
+
+    def __init__(self, max_bytes: int, max_entries: int, shared_alias: typing.Optional[str]):
+        self.entries = collections.OrderedDict()
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.shared_alias = shared_alias
+        self.size = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(kind: str, barcode: bytes, *extra: typing.Optional[str]) -> str:
+        hd = hashlib.sha256()
+        hd.update(barcode)
+        for part in extra:
+            hd.update(b"\x00")
+            hd.update((part or "").encode("utf-8"))
+        return f"ticket:{kind}:{PARSER_VERSION}:{settings.GIT_HASH}:{hd.hexdigest()}"
+
+    def get_or_parse(self, key: str, parse: typing.Callable[[], typing.Any]):
+        with self._lock:
+            if entry := self.entries.get(key):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        shared = caches[self.shared_alias] if self.shared_alias else None
+        if shared:
+            try:
+                data = shared.get(key)
+                if data is not None:
+                    value = pickle.loads(data)
+                    self.store(key, value, len(data), shared_hit=True)
+                    return value
+            except Exception:
+                logger.exception("Failed to read parsed ticket from the shared cache")
+
+        with self._lock:
+            self.misses += 1
+        value = parse()
+        if not shared:
+            # Pickling only to measure the size would cost about as much as the parse, so the local-only cache is
+            # bounded by entry count instead
+            self.store(key, value, 0)
+            return value
+
+        try:
+            data = pickle.dumps(value)
+        except Exception:
+            logger.exception("Unable to serialise parsed ticket for caching")
+            return value
+
+        self.store(key, value, len(data))
+        try:
+            shared.set(key, data, SHARED_TIMEOUT)
+        except Exception:
+            logger.exception("Failed to write parsed ticket to the shared cache")
+        return value
+
+    def store(self, key: str, value, size: int, shared_hit: bool = False):
+        with self._lock:
+            if shared_hit:
+                self.shared_hits += 1
+            if size > self.max_bytes:
+                return
+
+            if old := self.entries.pop(key, None):
+                self.size -= old[0]
+            self.entries[key] = (size, value)
+            self.size += size
+            while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+                _, (old_size, _) = self.entries.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0,
+            }
+
+
+TICKET_CACHE = None
+
+
+def get_ticket_cache() -> TicketCache:
+    global TICKET_CACHE
+
+    if not TICKET_CACHE:
+        TICKET_CACHE = TicketCache(
+            settings.TICKET_CACHE_MAX_BYTES, settings.TICKET_CACHE_MAX_ENTRIES, settings.TICKET_CACHE_SHARED_ALIAS
+        )
+
+    return TICKET_CACHE
@@ -0,0 +1,93 @@
+import bisect
+import dataclasses
+import threading
+import time
+import typing
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+MIN_CONFIDENCE = 0.1
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "buckets": {
+                **{str(le): n for le, n in zip(LATENCY_BUCKETS, self.counts)},
+                "+Inf": self.counts[-1],
+            },
+        }
+
+
+@dataclasses.dataclass
+class TicketFormat:
+    name: str
+    # Must only look at a bounded prefix/length of the payload and return a confidence between 0 and 1
+    sniff: typing.Callable[[bytes], float]
+    parse: typing.Callable[[bytes, typing.Any], typing.Any]
+    parsed: int = 0
+    failed: int = 0
+    latency: LatencyHistogram = dataclasses.field(default_factory=LatencyHistogram)
+
+
+class FormatRegistry:
+    formats: typing.List[TicketFormat]
+
+    def __init__(self):
+        self.formats = []
+        self.unknown = 0
+
+    def register(self, name: str, sniff: typing.Callable[[bytes], float],
+                 parse: typing.Callable[[bytes, typing.Any], typing.Any]):
+        self.formats.append(TicketFormat(name=name, sniff=sniff, parse=parse))
+
+    def identify(self, data: bytes) -> typing.Optional[TicketFormat]:
+        best = None
+        best_confidence = MIN_CONFIDENCE
+        for ticket_format in self.formats:
+            confidence = ticket_format.sniff(data)
+            if confidence >= best_confidence and (best is None or confidence > best_confidence):
+                best = ticket_format
+                best_confidence = confidence
+
+        if best is None:
+            self.unknown += 1
+        return best
+
+    def parse(self, ticket_format: TicketFormat, data: bytes, context):
+        start = time.perf_counter()
+        try:
+            value = ticket_format.parse(data, context)
+        except Exception:
+            ticket_format.failed += 1
+            raise
+        else:
+            ticket_format.parsed += 1
+            return value
+        finally:
+            ticket_format.latency.observe(time.perf_counter() - start)
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "unknown": self.unknown,
+            "formats": {
+                f.name: {
+                    "parsed": f.parsed,
+                    "failed": f.failed,
+                    "latency": f.latency.to_dict(),
+                } for f in self.formats
+            },
+        }
@@ -2,36 +2,251 @@ import cryptography.x509
 import cryptography.exceptions
 import cryptography.hazmat.primitives.hashes
 import cryptography.hazmat.primitives.serialization
+import cryptography.hazmat.primitives.asymmetric.dsa
+import cryptography.hazmat.primitives.asymmetric.ec
+import cryptography.hazmat.primitives.asymmetric.utils
 import django.core.files.storage
+import dataclasses
+import threading
+import typing
+import base64
+import hashlib
+import datetime
+import time
 import json
+import logging
+from django.utils import timezone
 
+from .. import storage_util
 
-def signing_cert(rics: int, key_id: int):
-    uic_storage = django.core.files.storage.storages["uic-data"]
-    key_name = f"cert-{rics}_{key_id}.der"
-    key_meta_name = f"cert-{rics}_{key_id}.json"
-    if uic_storage.exists(key_meta_name):
-        with uic_storage.open(key_meta_name) as key_file:
-            meta = json.load(key_file)
-        with uic_storage.open(key_name) as key_file:
-            key = cryptography.x509.load_der_x509_certificate(key_file.read())
+logger = logging.getLogger(__name__)
 
-        return meta, key
+MANIFEST_NAME = "keys.json"
+RELOAD_INTERVAL = 5 * 60
 
 
-def public_key(rics: int, key_id: int):
+@dataclasses.dataclass
+class Key:
+    rics: int
+    key_id: str
+    meta: typing.Optional[dict]
+    certificate_der: typing.Optional[bytes] = None
+    public_key_der: typing.Optional[bytes] = None
+    _certificate: typing.Optional[cryptography.x509.Certificate] = dataclasses.field(default=None, repr=False)
+    _public_key: typing.Any = dataclasses.field(default=None, repr=False)
+    _fingerprint: typing.Optional[str] = dataclasses.field(default=None, repr=False)
+
+    def certificate(self) -> typing.Optional[cryptography.x509.Certificate]:
+        if self._certificate is None and self.certificate_der:
+            self._certificate = cryptography.x509.load_der_x509_certificate(self.certificate_der)
+        return self._certificate
+
+    def public_key(self):
+        if self._public_key is None:
+            if cert := self.certificate():
+                self._public_key = cert.public_key()
+            elif self.public_key_der:
+                self._public_key = cryptography.hazmat.primitives.serialization.load_der_public_key(
+                    self.public_key_der
+                )
+        return self._public_key
+
+    def fingerprint(self) -> typing.Optional[str]:
+        if self._fingerprint is None:
+            if self.public_key_der:
+                der = self.public_key_der
+            elif pk := self.public_key():
+                der = pk.public_bytes(
+                    cryptography.hazmat.primitives.serialization.Encoding.DER,
+                    cryptography.hazmat.primitives.serialization.PublicFormat.SubjectPublicKeyInfo,
+                )
+            else:
+                return None
+            self._fingerprint = hashlib.sha256(der).hexdigest()
+        return self._fingerprint
+
+    def to_json(self) -> dict:
+        out = {
+            "rics": self.rics,
+            "key_id": self.key_id,
+            "meta": self.meta,
+        }
+        if self.certificate_der:
+            out["certificate"] = base64.b64encode(self.certificate_der).decode("ascii")
+        if self.public_key_der:
+            out["public_key"] = base64.b64encode(self.public_key_der).decode("ascii")
+        return out
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Key":
+        return cls(
+            rics=data["rics"],
+            key_id=data["key_id"],
+            meta=data.get("meta"),
+            certificate_der=base64.b64decode(data["certificate"]) if "certificate" in data else None,
+            public_key_der=base64.b64decode(data["public_key"]) if "public_key" in data else None,
+        )
+
+
+def key_index(rics: int, key_id: typing.Union[int, str]) -> typing.Tuple[int, str]:
+    return int(rics), str(key_id)
+
+
+class KeyRing:
+    keys: typing.Dict[typing.Tuple[int, str], Key]
+    missing: typing.Set[typing.Tuple[int, str]]
+
+    def __init__(self):
+        self.keys = {}
+        self.missing = set()
+        self.version = None
+        self.has_manifest = False
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def reload_if_changed(self):
+        if self.checked_at is not None and time.monotonic() - self.checked_at < RELOAD_INTERVAL:
+            return
+
+        with self._lock:
+            if self.checked_at is not None and time.monotonic() - self.checked_at < RELOAD_INTERVAL:
+                return
+
+            uic_storage = django.core.files.storage.storages["uic-data"]
+            version = storage_util.file_version(uic_storage, MANIFEST_NAME)
+            if self.checked_at is None or version != self.version:
+                self.load(uic_storage, version)
+            self.checked_at = time.monotonic()
+
+    def load(self, uic_storage: django.core.files.storage.Storage, version: typing.Optional[str]):
+        keys = {}
+        if version is not None:
+            with uic_storage.open(MANIFEST_NAME, "r") as f:
+                manifest = json.load(f)
+            for key_data in manifest["keys"]:
+                key = Key.from_json(key_data)
+                index = key_index(key.rics, key.key_id)
+                # A certificate wins over a bare public key for the same key, as with the individual files
+                if key.certificate_der or index not in keys:
+                    keys[index] = key
+        else:
+            logger.warning("UIC key manifest not found, falling back to individual key files")
+
+        self.keys = keys
+        self.missing = set()
+        self.version = version
+        self.has_manifest = version is not None
+
+    def get(self, rics: int, key_id: typing.Union[int, str]) -> typing.Optional[Key]:
+        self.reload_if_changed()
+
+        index = key_index(rics, key_id)
+        if key := self.keys.get(index):
+            return key
+        if index in self.missing:
+            return None
+
+        key = None if self.has_manifest else load_key_files(rics, key_id)
+        if key:
+            self.keys[index] = key
+        else:
+            self.missing.add(index)
+        return key
+
+
+def load_key_files(rics: int, key_id: typing.Union[int, str]) -> typing.Optional[Key]:
     uic_storage = django.core.files.storage.storages["uic-data"]
     cert_name = f"cert-{rics}_{key_id}.der"
+    cert_meta_name = f"cert-{rics}_{key_id}.json"
     key_name = f"pk-{rics}_{key_id}.der"
 
     if uic_storage.exists(cert_name):
+        meta = None
+        if uic_storage.exists(cert_meta_name):
+            with uic_storage.open(cert_meta_name) as key_file:
+                meta = json.load(key_file)
         with uic_storage.open(cert_name) as key_file:
-            key = cryptography.x509.load_der_x509_certificate(key_file.read())
-
-        return key.public_key()
+            return Key(rics=int(rics), key_id=str(key_id), meta=meta, certificate_der=key_file.read())
 
     if uic_storage.exists(key_name):
         with uic_storage.open(key_name) as key_file:
-            key = cryptography.hazmat.primitives.serialization.load_der_public_key(key_file.read())
+            return Key(rics=int(rics), key_id=str(key_id), meta=None, public_key_der=key_file.read())
 
-        return key
+
+KEY_RING = None
+
+
+def get_key_ring() -> KeyRing:
+    global KEY_RING
+
+    if not KEY_RING:
+        KEY_RING = KeyRing()
+
+    return KEY_RING
+
+
+def key_ring_version() -> typing.Optional[str]:
+    key_ring = get_key_ring()
+    key_ring.reload_if_changed()
+    return key_ring.version
+
+
+def signing_cert(rics: int, key_id: int):
+    key = get_key_ring().get(rics, key_id)
+    if key and key.meta is not None and key.certificate():
+        return key.meta, key.certificate()
+
+
+def signing_cert_by_fingerprint(rics: int, key_id: int, fingerprint: typing.Optional[str]):
+    # For display only, so nothing is verified here, the key just has to be the one the stored check used
+    if not fingerprint:
+        return None
+    key = get_key_ring().get(rics, key_id)
+    if key and key.fingerprint() == fingerprint and key.meta is not None and key.certificate():
+        return key.meta, key.certificate()
+
+
+def public_key(rics: int, key_id: int):
+    if key := get_key_ring().get(rics, key_id):
+        return key.public_key()
+
+
+def raw_dss_signature(signature: bytes, size: int) -> bytes:
+    # Fixed width r || s, which can have leading zero bytes that DER doesn't allow
+    return cryptography.hazmat.primitives.asymmetric.utils.encode_dss_signature(
+        int.from_bytes(signature[0:size], "big"), int.from_bytes(signature[size:2 * size], "big")
+    )
+
+
+def verify_dss_signature(pk, signature: bytes, signed_data: bytes, hasher) -> bool:
+    try:
+        if isinstance(pk, cryptography.hazmat.primitives.asymmetric.dsa.DSAPublicKey):
+            pk.verify(signature, signed_data, hasher)
+        elif isinstance(pk, cryptography.hazmat.primitives.asymmetric.ec.EllipticCurvePublicKey):
+            pk.verify(signature, signed_data, cryptography.hazmat.primitives.asymmetric.ec.ECDSA(hasher))
+        else:
+            return False
+    except cryptography.exceptions.InvalidSignature:
+        return False
+    return True
+
+
+@dataclasses.dataclass
+class VerificationResult:
+    valid: typing.Optional[bool]
+    key_fingerprint: typing.Optional[str]
+    key_ring_version: typing.Optional[str]
+    verified_at: datetime.datetime
+
+
+def verify_envelope(envelope, key: typing.Optional[Key] = None) -> VerificationResult:
+    key_ring = get_key_ring()
+    if key is None:
+        key = key_ring.get(envelope.issuer_rics, envelope.signature_key_id)
+    pk = key.public_key() if key else None
+    return VerificationResult(
+        valid=envelope.verify_signature(pk) if pk else None,
+        key_fingerprint=key.fingerprint() if key else None,
+        key_ring_version=key_ring.version,
+        verified_at=timezone.now(),
+    )
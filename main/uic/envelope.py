@@ -1,10 +1,9 @@
+import base64
 import dataclasses
 import typing
 import ber_tlv.tlv
 import cryptography.x509
-import cryptography.exceptions
 import cryptography.hazmat.primitives.hashes
-import cryptography.hazmat.primitives.asymmetric.dsa
 import zlib
 
 from . import util, rics, certs
@@ -14,40 +13,48 @@ from . import util, rics, certs
 class Record:
     id: str
     version: int
-    data: bytes
+    raw: bytes = dataclasses.field(repr=False)
+    start: int
+    end: int
+
+    @property
+    def data(self) -> bytes:
+        return self.raw[self.start:self.end]
 
     def data_hex(self):
-        return ":".join(f"{b:02x}" for b in self.data)
+        return ":".join(f"{b:02x}" for b in memoryview(self.raw)[self.start:self.end])
 
     @classmethod
-    def parse(cls, data: bytes) -> "Record":
-        if len(data) < 12:
+    def parse(cls, raw: bytes, view: memoryview, offset: int) -> "Record":
+        if len(view) - offset < 12:
             raise util.UICException("UIC ticket record too short")
 
         try:
-            record_id = data[0:6].decode("ascii")
+            record_id = str(view[offset:offset+6], "ascii")
         except UnicodeDecodeError as e:
             raise util.UICException("Invalid UIC ticket record ID") from e
 
         try:
-            version_str = data[6:8].decode("ascii")
+            version_str = str(view[offset+6:offset+8], "ascii")
             version = int(version_str, 10)
         except (UnicodeDecodeError, ValueError) as e:
             raise util.UICException("Invalid UIC ticket record version") from e
 
         try:
-            data_length_str = data[8:12].decode("ascii")
+            data_length_str = str(view[offset+8:offset+12], "ascii")
             data_length = int(data_length_str, 10)
         except (UnicodeDecodeError, ValueError) as e:
             raise util.UICException("Invalid UIC ticket record data length") from e
 
-        if len(data) < data_length:
+        if len(view) - offset < data_length:
             raise util.UICException("UIC ticket record data too short")
 
         return cls(
             id=record_id,
             version=version,
-            data=data[12:data_length]
+            raw=raw,
+            start=offset + 12,
+            end=offset + max(data_length, 12),
         )
 
 
@@ -59,6 +66,55 @@ class Envelope:
     records: typing.List[Record]
     signature: bytes = None
     signed_data: bytes = None
+    index: typing.Dict[str, typing.List[Record]] = dataclasses.field(default_factory=dict, repr=False)
+
+    def __post_init__(self):
+        if self.records and not self.index:
+            for record in self.records:
+                self.index.setdefault(record.id, []).append(record)
+
+    def first_record(self, *keys: typing.Tuple[str, typing.Optional[int]]) -> typing.Optional[Record]:
+        found = None
+        for record_id, version in keys:
+            for record in self.index.get(record_id, ()):
+                if version is None or record.version == version:
+                    if found is None or record.start < found.start:
+                        found = record
+                    break
+        return found
+
+    def to_json(self) -> dict:
+        return {
+            "version": self.version,
+            "issuer_rics": self.issuer_rics,
+            "signature_key_id": self.signature_key_id,
+            "records": [{
+                "id": r.id,
+                "version": r.version,
+                "data": base64.b64encode(r.data).decode("ascii"),
+            } for r in self.records],
+            "signature": base64.b64encode(self.signature).decode("ascii") if self.signature is not None else None,
+            "signed_data": base64.b64encode(self.signed_data).decode("ascii") if self.signed_data is not None else None,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Envelope":
+        raw = bytearray()
+        spans = []
+        for r in data["records"]:
+            start = len(raw)
+            raw += base64.b64decode(r["data"])
+            spans.append((r["id"], r["version"], start, len(raw)))
+        raw = bytes(raw)
+
+        return cls(
+            version=data["version"],
+            issuer_rics=data["issuer_rics"],
+            signature_key_id=data["signature_key_id"],
+            records=[Record(id=i, version=v, raw=raw, start=start, end=end) for i, v, start, end in spans],
+            signature=base64.b64decode(data["signature"]) if data.get("signature") is not None else None,
+            signed_data=base64.b64decode(data["signed_data"]) if data.get("signed_data") is not None else None,
+        )
 
     def issuer(self):
         return rics.get_rics(self.issuer_rics)
@@ -69,45 +125,28 @@ class Envelope:
     def can_verify(self):
         return bool(certs.public_key(self.issuer_rics, self.signature_key_id))
 
-    def verify_signature(self):
+    def verify_signature(self, pk=None):
         if not self.signature or not self.signed_data:
             return False
 
-        pk = certs.public_key(self.issuer_rics, self.signature_key_id)
+        if pk is None:
+            pk = certs.public_key(self.issuer_rics, self.signature_key_id)
         if not pk:
             return False
 
         if self.version == 1:
-            sig_data = ber_tlv.tlv.Tlv.parse(self.signature, True)
+            # Only the outer sequence is re-encoded to drop the padding, as a recursive parse would mistake a
+            # zero-prefixed integer for a nested TLV
+            sig_data = ber_tlv.tlv.Tlv.parse(self.signature, False)
             sig = ber_tlv.tlv.Tlv.build(sig_data)
             hasher = cryptography.hazmat.primitives.hashes.SHA1()
         elif self.version == 2:
-            sig = bytearray([0x30, 0x44])
-            if self.signature[0] & 0x80:
-                sig[1] += 1
-                sig.extend([0x02, 0x21, 0x00])
-            else:
-                sig.extend([0x02, 0x20])
-            sig.extend(self.signature[0:32])
-            if self.signature[32] & 0x80:
-                sig[1] += 1
-                sig.extend([0x02, 0x21, 0x00])
-            else:
-                sig.extend([0x02, 0x20])
-            sig.extend(self.signature[32:64])
-            sig = bytes(sig)
+            sig = certs.raw_dss_signature(self.signature, 32)
             hasher = cryptography.hazmat.primitives.hashes.SHA256()
         else:
             return False
 
-        if isinstance(pk, cryptography.hazmat.primitives.asymmetric.dsa.DSAPublicKey):
-            try:
-                pk.verify(sig, self.signed_data, hasher)
-                return True
-            except cryptography.exceptions.InvalidSignature:
-                return False
-        else:
-            return False
+        return certs.verify_dss_signature(pk, sig, self.signed_data, hasher)
 
     @classmethod
     def parse(cls, data: bytes) -> "Envelope":
@@ -138,35 +177,40 @@ class Envelope:
         except ValueError:
             signature_key_id = signature_key_id_str
 
+        view = memoryview(data)
         if version == 1:
-            signature, data = data[14:64], data[64:]
+            signature, view = bytes(view[14:64]), view[64:]
         elif version == 2:
-            signature, data = data[14:78], data[78:]
+            signature, view = bytes(view[14:78]), view[78:]
         else:
             raise util.UICException("Unsupported UIC ticket version")
 
         try:
-            data_length_str = data[0:4].decode("ascii")
+            data_length_str = str(view[0:4], "ascii")
             data_length = int(data_length_str, 10)
         except (UnicodeDecodeError, ValueError) as e:
             raise util.UICException("Invalid UIC ticket data length") from e
 
-        if len(data) < 4 + data_length:
+        if len(view) < 4 + data_length:
             raise util.UICException("UIC ticket data too short")
 
-        signed_data = data[4:]
+        signed_data = bytes(view[4:])
 
         try:
-            raw_ticket = zlib.decompress(data[4:4+data_length])
+            raw_ticket = zlib.decompress(view[4:4+data_length])
         except zlib.error as e:
             raise util.UICException("Failed to decompress UIC ticket data") from e
 
+        # Records reference the decompressed payload by offset, so indexing them copies nothing
+        raw_view = memoryview(raw_ticket)
         offset = 0
         records = []
-        while raw_ticket[offset:]:
-            record = Record.parse(raw_ticket[offset:])
-            offset += 12 + len(record.data)
+        index = {}
+        while offset < len(raw_view):
+            record = Record.parse(raw_ticket, raw_view, offset)
+            offset = record.end
             records.append(record)
+            index.setdefault(record.id, []).append(record)
 
         return cls(
             version=version,
@@ -174,5 +218,6 @@ class Envelope:
             signature_key_id=signature_key_id,
             signature=signature,
             signed_data=signed_data,
-            records=records
-        )
\ No newline at end of file
+            records=records,
+            index=index,
+        )
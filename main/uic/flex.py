@@ -2,14 +2,113 @@ import typing
 import dataclasses
 import pathlib
 import datetime
+import hashlib
+import logging
+import os
+import pickle
+import stat
+import sys
+import threading
+import time
 import asn1tools
 import pytz
-from . import util
+from django.conf import settings
+from . import util, uper
+
+logger = logging.getLogger(__name__)
 
 ROOT = pathlib.Path(__file__).parent
-ASN1_SPEC_V1_3 = asn1tools.compile_files([ROOT / "asn1" / "uicRailTicketData_v1.3.4.asn"], codec="uper")
-ASN1_SPEC_V2 = asn1tools.compile_files([ROOT / "asn1" / "uicRailTicketData_v2.0.2.asn"], codec="uper")
-ASN1_SPEC_V3 = asn1tools.compile_files([ROOT / "asn1" / "uicRailTicketData_v3.0.3.asn"], codec="uper")
+ASN1_SPEC_FILES = {
+    13: ROOT / "asn1" / "uicRailTicketData_v1.3.4.asn",
+    2: ROOT / "asn1" / "uicRailTicketData_v2.0.2.asn",
+    3: ROOT / "asn1" / "uicRailTicketData_v3.0.3.asn",
+}
+ASN1_SPECS = {}
+ASN1_SPEC_STATS = {}
+ASN1_SPEC_LOCK = threading.Lock()
+ASN1_DECODERS = {}
+
+
+def spec_cache_path(version: int) -> pathlib.Path:
+    spec_file = ASN1_SPEC_FILES[version]
+    hd = hashlib.sha256()
+    hd.update(spec_file.read_bytes())
+    hd.update(asn1tools.__version__.encode("utf-8"))
+    hd.update(sys.version.encode("utf-8"))
+    return pathlib.Path(settings.ASN1_CACHE_DIR) / f"{spec_file.stem}-{hd.hexdigest()[:16]}.pickle"
+
+
+def open_spec_cache(cache_path: pathlib.Path) -> typing.BinaryIO:
+    # Unpickling runs arbitrary code, so only trust files nobody else could have written
+    f = cache_path.open("rb")
+    st = os.fstat(f.fileno())
+    if st.st_uid != os.geteuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        f.close()
+        raise PermissionError(f"{cache_path} is not owned by this user or is writable by others")
+    return f
+
+
+def compile_spec(version: int):
+    start = time.perf_counter()
+    spec = asn1tools.compile_files([ASN1_SPEC_FILES[version]], codec="uper")
+    return spec, time.perf_counter() - start
+
+
+def load_spec(version: int):
+    cache_path = spec_cache_path(version)
+    start = time.perf_counter()
+    try:
+        with open_spec_cache(cache_path) as f:
+            spec = pickle.load(f)
+        ASN1_SPEC_STATS[version] = {"source": "disk", "seconds": time.perf_counter() - start}
+        return spec
+    except FileNotFoundError:
+        pass
+    except PermissionError as e:
+        logger.warning("Ignoring cached ASN.1 spec: %s", e)
+    except Exception:
+        logger.exception("Failed to load cached ASN.1 spec %s", cache_path)
+
+    spec, seconds = compile_spec(version)
+    ASN1_SPEC_STATS[version] = {"source": "compiled", "seconds": seconds}
+    try:
+        cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f".{time.time_ns()}.tmp")
+        with tmp_path.open("wb") as f:
+            pickle.dump(spec, f)
+        tmp_path.replace(cache_path)
+    except OSError:
+        logger.exception("Failed to write ASN.1 spec cache %s", cache_path)
+    return spec
+
+
+def get_spec(version: int):
+    if spec := ASN1_SPECS.get(version):
+        return spec
+
+    if version not in ASN1_SPEC_FILES:
+        raise util.UICException("Unsupported UIC rail ticket flexible data version")
+
+    with ASN1_SPEC_LOCK:
+        if version not in ASN1_SPECS:
+            ASN1_SPECS[version] = load_spec(version)
+        return ASN1_SPECS[version]
+
+
+def get_decoder(version: int) -> typing.Callable[[bytes], typing.Any]:
+    if decoder := ASN1_DECODERS.get(version):
+        return decoder
+
+    spec = get_spec(version)
+    with ASN1_SPEC_LOCK:
+        if version not in ASN1_DECODERS:
+            try:
+                ASN1_DECODERS[version], _ = uper.generate(spec, "UicRailTicketData")
+            except uper.UnsupportedType as e:
+                logger.warning("Falling back to asn1tools for UIC FCB version %s: %s", version, e)
+                ASN1_DECODERS[version] = lambda data: spec.decode("UicRailTicketData", data)
+        return ASN1_DECODERS[version]
+
 
 @dataclasses.dataclass
 class Flex:
@@ -18,24 +117,12 @@ class Flex:
 
     @classmethod
     def parse(cls, version: int, data: bytes) -> "Flex":
+        decoder = get_decoder(version)
         try:
-            if version == 13:
-                return cls(
-                    version=version,
-                    data=ASN1_SPEC_V1_3.decode("UicRailTicketData", data)
-                )
-            elif version == 2:
-                return cls(
-                    version=version,
-                    data=ASN1_SPEC_V2.decode("UicRailTicketData", data)
-                )
-            elif version == 3:
-                return cls(
-                    version=version,
-                    data=ASN1_SPEC_V3.decode("UicRailTicketData", data)
-                )
-            else:
-                raise util.UICException("Unsupported UIC rail ticket flexible data version")
+            return cls(
+                version=version,
+                data=decoder(data)
+            )
         except asn1tools.DecodeError as e:
             raise util.UICException("Failed to decode UIC rail ticket flexible data") from e
 
@@ -0,0 +1,433 @@
+import random
+import string
+import typing
+import asn1tools
+from asn1tools.codecs import per, uper
+from .. import bits
+
+# Generates a straight-line decoder for one compiled asn1tools uPER type. The generated code keeps the whole
+# message in a single int and tracks the number of unread bits, so every field is a shift and a mask instead of
+# asn1tools' per-field string slicing. Only the constructs used by the UIC FCB schemas are supported, anything
+# else raises UnsupportedType and callers fall back to asn1tools.
+
+FRAGMENT_LENGTHS = {0xc1: 16384, 0xc2: 32768, 0xc3: 49152, 0xc4: 65536}
+STRING_TYPES = (uper.IA5String, uper.NumericString, uper.PrintableString, uper.VisibleString)
+
+
+class UnsupportedType(Exception):
+    pass
+
+
+def _length_tail(v: int, r: int, first: int) -> typing.Tuple[int, int]:
+    if first & 0xc0 == 0x80:
+        r -= 8
+        return ((first & 0x7f) << 8) | ((v >> r) & 0xff), r
+    if first in FRAGMENT_LENGTHS:
+        return FRAGMENT_LENGTHS[first], r
+    raise asn1tools.DecodeError(f"Bad length determinant fragmentation value 0x{first:02x}.")
+
+
+def _length(v: int, r: int) -> typing.Tuple[int, int]:
+    r -= 8
+    first = (v >> r) & 0xff
+    if first & 0x80:
+        return _length_tail(v, r, first)
+    return first, r
+
+
+def _skip(r: int, bits: int) -> int:
+    r -= bits
+    if r < 0:
+        raise asn1tools.DecodeError("Out of data.")
+    return r
+
+
+def _unconstrained(v: int, r: int) -> typing.Tuple[int, int]:
+    length, r = _length(v, r)
+    if not length:
+        raise asn1tools.DecodeError("Zero length unconstrained whole number.")
+    bits = 8 * length
+    r -= bits
+    value = (v >> r) & ((1 << bits) - 1)
+    if value >> (bits - 1):
+        value -= 1 << bits
+    return value, r
+
+
+def _normally_small(v: int, r: int) -> typing.Tuple[int, int]:
+    r -= 1
+    if not (v >> r) & 1:
+        r -= 6
+        return (v >> r) & 0x3f, r
+    length, r = _length(v, r)
+    r -= 8 * length
+    return (v >> r) & ((1 << (8 * length)) - 1), r
+
+
+def _skip_sequence_additions(v: int, r: int) -> int:
+    r -= 1
+    if not (v >> r) & 1:
+        r -= 6
+        count = ((v >> r) & 0x3f) + 1
+    else:
+        r -= 1
+        if (v >> r) & 1:
+            raise asn1tools.DecodeError("Normally small length number >64 is not supported.")
+        r -= 7
+        count = (v >> r) & 0x7f
+    r -= count
+    present = (v >> r) & ((1 << count) - 1)
+    for i in range(count):
+        if present & (1 << (count - i - 1)):
+            length, r = _length(v, r)
+            r = _skip(r, 8 * length)
+    return r
+
+
+def _skip_choice_addition(v: int, r: int) -> typing.Tuple[typing.Tuple[None, None], int]:
+    _, r = _normally_small(v, r)
+    length, r = _length(v, r)
+    return (None, None), _skip(r, 8 * length)
+
+
+class Generator:
+    def __init__(self):
+        self.functions = {}
+        self.sources = {}
+        self.consts = {}
+        self.names = {}
+        self.counter = 0
+
+    def const(self, value) -> str:
+        key = (type(value).__name__, repr(value))
+        if key not in self.consts:
+            self.consts[key] = (f"C{len(self.consts)}", value)
+        return self.consts[key][0]
+
+    def function(self, node) -> str:
+        if isinstance(node, per.Recursive):
+            return self.function(node._inner)
+        if id(node) in self.names:
+            return self.names[id(node)]
+
+        name = f"d{len(self.names)}"
+        self.names[id(node)] = name
+        counter, self.counter = self.counter, 0
+        if isinstance(node, per.MembersType):
+            body = self.sequence(node)
+        elif isinstance(node, per.Choice):
+            body = self.choice(node)
+        else:
+            body = self.array(node)
+        self.counter = counter
+
+        source = "\n".join(f"    {line}" for line in body)
+        if existing := self.sources.get(source):
+            self.functions[name] = f"{name} = {existing}"
+            self.names[id(node)] = existing
+            return existing
+        self.sources[source] = name
+        self.functions[name] = f"def {name}(v, r):\n{source}"
+        return name
+
+    def temp(self) -> str:
+        self.counter += 1
+        return f"t{self.counter}"
+
+    def sequence(self, node: per.MembersType) -> typing.List[str]:
+        if not isinstance(node, per.Sequence) or node.additions:
+            raise UnsupportedType(f"{type(node).__name__} {node.name}")
+
+        extensible = node.additions is not None
+        head = len(node.optionals) + (1 if extensible else 0)
+        lines = ["out = {}"]
+        if head:
+            lines += [f"r -= {head}", f"b = (v >> r) & {(1 << head) - 1}"]
+
+        bit = head - (2 if extensible else 1)
+        for member in node.root_members:
+            target = f"out[{member.name!r}]"
+            if member.optional or member.default is not None:
+                lines.append(f"if b & {1 << bit}:")
+                lines += [f"    {line}" for line in self.emit(member, target)]
+                if member.default is not None:
+                    lines += ["else:", f"    {target} = {self.const(member.default)}"]
+                bit -= 1
+            else:
+                lines += self.emit(member, target)
+
+        if extensible:
+            lines += [f"if b & {1 << (head - 1)}:", "    r = _skip_sequence_additions(v, r)"]
+        lines.append("return out, r")
+        return lines
+
+    def choice(self, node: per.Choice) -> typing.List[str]:
+        if node.additions_index_to_member:
+            raise UnsupportedType(f"CHOICE {node.name} with additions")
+
+        lines = []
+        if node.additions_index_to_member is not None:
+            lines += ["r -= 1", "if (v >> r) & 1:", "    return _skip_choice_addition(v, r)"]
+
+        members = node.root_index_to_member
+        if len(members) > 1:
+            lines += [f"r -= {node.root_number_of_bits}", f"i = (v >> r) & {(1 << node.root_number_of_bits) - 1}"]
+        else:
+            lines.append("i = 0")
+
+        for index, member in members.items():
+            lines.append(f"if i == {index}:")
+            lines += [f"    {line}" for line in self.emit(member, "value")]
+            lines.append(f"    return ({member.name!r}, value), r")
+        lines.append("raise DecodeError(f'Expected choice index, but got {i}.')")
+        return lines
+
+    def array(self, node: per.ArrayType) -> typing.List[str]:
+        if not isinstance(node, (uper.SequenceOf, uper.SetOf)):
+            raise UnsupportedType(f"{type(node).__name__} {node.name}")
+
+        element = [f"    {line}" for line in self.emit(node.element_type, "value")]
+        element.append("    out.append(value)")
+        lines = ["out = []"]
+        if node.has_extension_marker:
+            lines += ["r -= 1", "if (v >> r) & 1:", "    count, r = _length(v, r)", "    for _ in range(count):"]
+            lines += [f"    {line}" for line in element]
+            lines.append("    return out, r")
+
+        if node.number_of_bits is None:
+            lines += self.chunks("count", ["for _ in range(count):", *element])
+        else:
+            lines += self.length("count", node)
+            lines += ["for _ in range(count):", *element]
+        lines.append("return out, r")
+        return lines
+
+    def length(self, name: str, node) -> typing.List[str]:
+        if node.minimum == node.maximum or not node.number_of_bits:
+            return [f"{name} = {node.minimum}"]
+        return [f"r -= {node.number_of_bits}", f"{name} = ((v >> r) & {(1 << node.number_of_bits) - 1}) + {node.minimum}"]
+
+    def chunks(self, name: str, body: typing.List[str]) -> typing.List[str]:
+        return [
+            "while True:",
+            "    r -= 8",
+            f"    {name} = (v >> r) & 255",
+            f"    if {name} > 127:",
+            f"        {name}, r = _length_tail(v, r, {name})",
+            *[f"    {line}" for line in body],
+            f"    if {name} < 16384:",
+            "        break",
+        ]
+
+    def emit(self, node, target: str) -> typing.List[str]:
+        if isinstance(node, per.Recursive):
+            node = node._inner
+
+        if isinstance(node, (per.MembersType, per.Choice, per.ArrayType)):
+            return [f"{target}, r = {self.function(node)}(v, r)"]
+        if isinstance(node, uper.Integer):
+            return self.integer(node, target)
+        if isinstance(node, per.Boolean):
+            return ["r -= 1", f"{target} = (v >> r) & 1 == 1"]
+        if isinstance(node, per.Null):
+            return [f"{target} = None"]
+        if isinstance(node, per.Enumerated):
+            return self.enumerated(node, target)
+        if isinstance(node, STRING_TYPES):
+            return self.known_multiplier_string(node, target)
+        if isinstance(node, uper.OctetString):
+            return self.octet_string(node, target)
+        if isinstance(node, per.UTF8String):
+            parts = self.temp()
+            return [
+                f"{parts} = []",
+                *self.chunks("n", [
+                    "r -= 8 * n",
+                    f"{parts}.append(((v >> r) & ((1 << (8 * n)) - 1)).to_bytes(n, 'big'))",
+                ]),
+                f"{target} = b''.join({parts}).decode('utf-8')",
+            ]
+        raise UnsupportedType(f"{type(node).__name__} {node.name}")
+
+    def integer(self, node: uper.Integer, target: str) -> typing.List[str]:
+        if node.number_of_bits is None:
+            lines = [f"{target}, r = _unconstrained(v, r)"]
+        elif node.number_of_bits == 0:
+            lines = [f"{target} = {node.minimum}"]
+        else:
+            lines = [
+                f"r -= {node.number_of_bits}",
+                f"{target} = ((v >> r) & {(1 << node.number_of_bits) - 1}) + {node.minimum}",
+            ]
+
+        if node.has_extension_marker:
+            return [
+                "r -= 1",
+                "if (v >> r) & 1:",
+                f"    {target}, r = _unconstrained(v, r)",
+                "else:",
+                *[f"    {line}" for line in lines],
+            ]
+        return lines
+
+    def enumerated(self, node: per.Enumerated, target: str) -> typing.List[str]:
+        root = tuple(node.root_index_to_data[i] for i in range(len(node.root_index_to_data)))
+        bits = node.root_number_of_bits
+        if bits:
+            lines = [f"r -= {bits}", f"{target} = {self.const(root)}[(v >> r) & {(1 << bits) - 1}]"]
+        else:
+            lines = [f"{target} = {self.const(root)}[0]"]
+
+        if node.additions_index_to_data is not None:
+            index = self.temp()
+            return [
+                "r -= 1",
+                "if (v >> r) & 1:",
+                f"    {index}, r = _normally_small(v, r)",
+                f"    {target} = {self.const(node.additions_index_to_data)}.get({index})",
+                "else:",
+                *[f"    {line}" for line in lines],
+            ]
+        return lines
+
+    def known_multiplier_string(self, node, target: str) -> typing.List[str]:
+        if node.has_extension_marker:
+            raise UnsupportedType(f"{type(node).__name__} {node.name} with size extension")
+        bits = node.bits_per_character
+        if not 0 < bits <= 8:
+            raise UnsupportedType(f"{type(node).__name__} {node.name} with {bits} bit characters")
+
+        decode_map = node.permitted_alphabet.decode_map
+        identity = all(decode_map.get(i) == i for i in range(1 << bits))
+        if not identity and (any(k > 0xff for k in decode_map) or any(not 0 <= c <= 0xff for c in decode_map.values())):
+            raise UnsupportedType(f"{type(node).__name__} {node.name} alphabet")
+
+        raw = self.temp()
+        if identity:
+            convert = f"_chars({raw}, n, {bits})"
+        else:
+            table = self.const({k: c for k, c in decode_map.items()})
+            convert = f"bytes({table}[c] for c in _chars({raw}, n, {bits}))"
+
+        read = [
+            f"r -= {bits} * n",
+            f"{raw} = (v >> r) & ((1 << ({bits} * n)) - 1)",
+        ]
+        if node.number_of_bits is None:
+            parts = self.temp()
+            return [
+                f"{parts} = []",
+                *self.chunks("n", [*read, f"{parts}.append({convert})"]),
+                f"{target} = b''.join({parts}).decode('ascii')",
+            ]
+        return [
+            *self.length("n", node),
+            *read,
+            f"{target} = {convert}.decode('ascii')",
+        ]
+
+    def octet_string(self, node: uper.OctetString, target: str) -> typing.List[str]:
+        read = ["r -= 8 * n", f"{target} = ((v >> r) & ((1 << (8 * n)) - 1)).to_bytes(n, 'big')"]
+        if node.number_of_bits is None:
+            parts = self.temp()
+            lines = [
+                f"{parts} = []",
+                *self.chunks("n", [
+                    "r -= 8 * n",
+                    f"{parts}.append(((v >> r) & ((1 << (8 * n)) - 1)).to_bytes(n, 'big'))",
+                ]),
+                f"{target} = b''.join({parts})",
+            ]
+        else:
+            lines = [*self.length("n", node), *read]
+
+        if node.has_extension_marker:
+            return [
+                "r -= 1",
+                "if (v >> r) & 1:",
+                "    n, r = _length(v, r)",
+                *[f"    {line}" for line in read],
+                "else:",
+                *[f"    {line}" for line in lines],
+            ]
+        return lines
+
+    def source(self, root: str) -> str:
+        return "\n\n".join([
+            *self.functions.values(),
+            "def decode(data):\n"
+            "    try:\n"
+            f"        return {root}(int.from_bytes(data, 'big'), 8 * len(data))[0]\n"
+            "    except DecodeError:\n"
+            "        raise\n"
+            "    except (ValueError, KeyError, IndexError) as e:\n"
+            "        raise DecodeError(str(e)) from e\n",
+        ])
+
+
+def generate(spec, type_name: str) -> typing.Tuple[typing.Callable[[bytes], typing.Any], str]:
+    generator = Generator()
+    root = generator.function(spec.types[type_name].type)
+    source = generator.source(root)
+    namespace = {
+        "DecodeError": asn1tools.DecodeError,
+        "_length": _length,
+        "_length_tail": _length_tail,
+        "_skip": _skip,
+        "_unconstrained": _unconstrained,
+        "_normally_small": _normally_small,
+        "_skip_sequence_additions": _skip_sequence_additions,
+        "_skip_choice_addition": _skip_choice_addition,
+        "_chars": bits.unpack,
+    }
+    namespace.update(dict(generator.consts.values()))
+    exec(compile(source, f"<uper {type_name}>", "exec"), namespace)
+    return namespace["decode"], source
+
+
+def example_value(node, rng: random.Random, depth: int = 0):
+    if isinstance(node, per.Recursive):
+        node = node._inner
+
+    if isinstance(node, per.Sequence):
+        value = {}
+        for member in node.root_members:
+            if (member.optional or member.default is not None) and (depth > 3 or rng.random() < 0.5):
+                continue
+            value[member.name] = example_value(member, rng, depth + 1)
+        return value
+    if isinstance(node, per.Choice):
+        member = rng.choice(list(node.root_index_to_member.values()))
+        return member.name, example_value(member, rng, depth + 1)
+    if isinstance(node, per.ArrayType):
+        low = node.minimum or 0
+        high = min(node.maximum, low + 3) if isinstance(node.maximum, int) else low + 3
+        count = low if depth > 3 else rng.randint(low, high)
+        return [example_value(node.element_type, rng, depth + 1) for _ in range(count)]
+    if isinstance(node, uper.Integer):
+        if node.number_of_bits is None:
+            return rng.choice([0, 1, -1, 127, 128, -129, 2 ** 31, -(2 ** 40)]) + rng.randint(-1000, 1000)
+        return rng.randint(node.minimum, node.maximum)
+    if isinstance(node, per.Boolean):
+        return rng.random() < 0.5
+    if isinstance(node, per.Null):
+        return None
+    if isinstance(node, per.Enumerated):
+        return rng.choice(list(node.root_index_to_data.values()))
+    if isinstance(node, STRING_TYPES):
+        alphabet = [chr(c) for c in node.permitted_alphabet.decode_map.values()]
+        if node.number_of_bits is None:
+            count = rng.choice([0, 1, 5, 20, 130])
+        else:
+            count = rng.randint(node.minimum, min(node.maximum, node.minimum + 20))
+        return "".join(rng.choice(alphabet) for _ in range(count))
+    if isinstance(node, uper.OctetString):
+        if node.number_of_bits is None:
+            count = rng.choice([0, 1, 16, 200])
+        else:
+            count = rng.randint(node.minimum, min(node.maximum, node.minimum + 20))
+        return rng.randbytes(count)
+    if isinstance(node, per.UTF8String):
+        alphabet = string.ascii_letters + string.digits + " äöüßéŁ€–😀"
+        return "".join(rng.choice(alphabet) for _ in range(rng.choice([0, 3, 12, 140])))
+    raise UnsupportedType(f"{type(node).__name__} {node.name}")
@@ -1,5 +1,5 @@
 from .envelope import EnvelopeV2
 from .util import VDVException
-from .pki import CertificateStore, Certificate, CAReference, CertificateData
+from .pki import CertificateStore, Certificate, CAReference, CertificateData, get_certificate_store
 from .ticket import VDVTicket
 from . import org_id
\ No newline at end of file
@@ -18,7 +18,8 @@ class EnvelopeV2:
     @classmethod
     def parse(cls, data: bytes) -> "EnvelopeV2":
         try:
-            elms = ber_tlv.tlv.Tlv.Parser.parse(data, True, [], False, 0)
+            # Only descend into constructed tags, a signature can happen to look like nested TLV data
+            elms = ber_tlv.tlv.Tlv.Parser.parse(data, None, [], False, 0)
         except Exception as e:
             raise util.VDVException("Failed to parse envelope, invalid BER-TLV") from e
 
@@ -4,15 +4,22 @@ import pathlib
 import ber_tlv.tlv
 import hashlib
 import string
+import time
+import logging
+import threading
 import django.core.files.storage
 
 from . import iso9796, util
+from .. import storage_util
+
+logger = logging.getLogger(__name__)
 
 ROOT = pathlib.Path(__file__).parent
 SHA1 = [1, 3, 14, 3, 2, 26]
 RSA_ENCRYPTION = [1, 2, 840, 113549, 1, 1, 1]
 SHA1_WITH_RSA_SIGNATURE = [1, 2, 840, 113549, 1, 1, 5]
 TELETRUST_ISO9796_2_WITH_SHA1_AND_RSA = [1, 3, 36, 3, 4, 2, 2, 1]
+REFRESH_INTERVAL = 15 * 60
 KNOWN_OIDS = (
     RSA_ENCRYPTION,
     SHA1_WITH_RSA_SIGNATURE,
@@ -47,9 +54,12 @@ class CAReference:
             return None
 
     def hex_name(self):
-        full_name = self.name + bytes([self.service_indicator, self.algorithm_reference, self.year - 1990])
+        full_name = self.to_bytes()
         return ":".join(f"{full_name[i]:02x}" for i in range(len(full_name)))
 
+    def to_bytes(self) -> bytes:
+        return self.name + bytes([self.service_indicator, self.algorithm_reference, self.year - 1990])
+
     @classmethod
     def from_bytes(cls, data: bytes) -> "CAReference":
         if len(data) != 8:
@@ -73,38 +83,108 @@ class RawCertificate:
     data: bytes
 
 class CertificateStore:
-    certificates: typing.List[RawCertificate]
+    certificates: typing.Dict[bytes, RawCertificate]
+    versions: typing.Dict[str, str]
 
     def __init__(self):
-        self.certificates = []
+        self.certificates = {}
+        self.versions = {}
+        self.loaded_at = None
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.refreshes = 0
+        self._refresh_lock = threading.Lock()
 
     def load_certificates(self):
-        certificates = []
         certificate_storage = django.core.files.storage.storages["vdv-certs"]
-        for filename in certificate_storage.listdir("")[1]:
+        try:
+            versions = storage_util.list_versions(certificate_storage)
+        except Exception as e:
+            raise util.VDVException("Failed to list certificates") from e
+
+        certificates = {}
+        loaded_versions = {}
+        for filename, version in versions.items():
             if not filename.endswith(".der"):
                 continue
-            with certificate_storage.open(filename, "rb") as f:
-                data = f.read()
             try:
                 car_bytes = bytes.fromhex(filename[:-4])
             except ValueError:
                 continue
-            certificates.append(RawCertificate(
-                filename=filename,
-                ca_reference=CAReference.from_bytes(car_bytes),
-                data=data
-            ))
+            if len(car_bytes) != 8:
+                continue
+
+            current = self.certificates.get(car_bytes)
+            if current and current.filename == filename and self.versions.get(filename) == version:
+                certificates[car_bytes] = current
+            else:
+                with certificate_storage.open(filename, "rb") as f:
+                    data = f.read()
+                self.downloads += 1
+                certificates[car_bytes] = RawCertificate(
+                    filename=filename,
+                    ca_reference=CAReference.from_bytes(car_bytes),
+                    data=data
+                )
+            loaded_versions[filename] = version
+
         self.certificates = certificates
+        self.versions = loaded_versions
+        self.loaded_at = time.monotonic()
+        self.refreshes += 1
+
+    def refresh_if_stale(self):
+        if self.loaded_at is None:
+            with self._refresh_lock:
+                if self.loaded_at is None:
+                    self.load_certificates()
+            return
+
+        if time.monotonic() - self.loaded_at < REFRESH_INTERVAL:
+            return
+
+        if self._refresh_lock.acquire(blocking=False):
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.load_certificates()
+        except Exception:
+            logger.exception("Failed to refresh VDV certificates")
+            self.loaded_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
 
     def find_certificate(self, ca_reference: CAReference) -> typing.Optional[RawCertificate]:
-        for certificate in self.certificates:
-            if certificate.ca_reference.name == ca_reference.name and \
-                    certificate.ca_reference.service_indicator == ca_reference.service_indicator and \
-                    certificate.ca_reference.algorithm_reference == ca_reference.algorithm_reference and \
-                    certificate.ca_reference.year == ca_reference.year:
-                return certificate
-        return None
+        certificate = self.certificates.get(ca_reference.to_bytes())
+        if certificate:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return certificate
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "certificates": len(self.certificates),
+            "hits": self.hits,
+            "misses": self.misses,
+            "downloads": self.downloads,
+            "refreshes": self.refreshes,
+        }
+
+
+CERTIFICATE_STORE = None
+
+
+def get_certificate_store() -> CertificateStore:
+    global CERTIFICATE_STORE
+
+    if not CERTIFICATE_STORE:
+        CERTIFICATE_STORE = CertificateStore()
+
+    CERTIFICATE_STORE.refresh_if_stale()
+    return CERTIFICATE_STORE
 
 
 @dataclasses.dataclass
@@ -116,7 +196,7 @@ class Certificate:
     @classmethod
     def parse(cls, raw_cert: RawCertificate):
         try:
-            elms = ber_tlv.tlv.Tlv.Parser.parse(raw_cert.data, True, [], False, 0)
+            elms = ber_tlv.tlv.Tlv.Parser.parse(raw_cert.data, None, [], False, 0)
         except Exception as e:
             raise util.VDVException("Failed to parse certificate") from e
 
@@ -185,7 +265,7 @@ class Certificate:
             raise util.VDVException("Invalid message padding - signature verification failed")
         data = data[offset + 1:]
 
-        data = ber_tlv.tlv.Tlv.Parser.parse(data, True, [], False, 0)
+        data = ber_tlv.tlv.Tlv.Parser.parse(data, None, [], False, 0)
         if len(data) != 1:
             raise util.VDVException("Invalid message structure - signature verification failed")
         if data[0][0] != util.TAG_SEQUENCE:
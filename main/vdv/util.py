@@ -89,7 +89,7 @@ class DateTime:
         return bytes([
             ((self.year - 1990) << 1) | ((self.month >> 3) & 0x01),
             ((self.month << 5) & 0xE0) | self.day & 0x1F,
-            ((self.hour & 0xF8) << 3)| ((self.minute >> 3) & 0x07),
+            ((self.hour << 3) & 0xF8) | ((self.minute >> 3) & 0x07),
             ((self.minute << 5) & 0xE0) | self.second & 0x1F
         ])
 
@@ -2,7 +2,6 @@ import datetime
 import json
 import urllib.parse
 import pytz
-import pymupdf
 import io
 import typing
 import copy
@@ -13,12 +12,13 @@ from django.http import HttpResponse
 from django.core.files.storage import storages
 from django.conf import settings
 from django.core.files.storage import default_storage
-from main import forms, models, ticket, pkpass, vdv, aztec, templatetags, apn, gwallet, rsp, elb, uic, ssb
+from main import forms, models, ticket, pkpass, vdv, aztec, decode_service, templatetags, apn, gwallet, rsp, elb, uic, ssb
 
 
 def index(request):
     ticket_bytes = None
     error = None
+    status = 200
 
     if request.method == "POST":
         if request.POST.get("type") == "scan":
@@ -35,31 +35,14 @@ def index(request):
                 if ticket_file.size > 16 * 1024 * 1024:
                     image_form.add_error("ticket", "The ticket must be less than 16MB")
                 else:
-                    if ticket_file.content_type != "application/pdf":
-                        try:
-                            ticket_bytes = aztec.decode(ticket_file.read())
-                        except aztec.AztecError as e:
-                            image_form.add_error("ticket", str(e))
-                    else:
-                        try:
-                            pdf = pymupdf.open(stream=ticket_file.read(), filetype=ticket_file.content_type)
-                        except RuntimeError as e:
-                            image_form.add_error("ticket", f"Error opening PDF: {e}")
-                        else:
-                            for page_index in range(len(pdf)):
-                                if ticket_bytes:
-                                    break
-                                for pdf_image in pdf.get_page_images(page_index):
-                                    pdf_image = pdf.extract_image(pdf_image[0])
-                                    try:
-                                        ticket_bytes = aztec.decode(pdf_image["image"])
-                                    except aztec.AztecError:
-                                        continue
-                                    else:
-                                        break
-
-                            if not ticket_bytes:
-                                image_form.add_error("ticket", f"Failed to find any Aztec codes in the PDF")
+                    kind = "pdf" if ticket_file.content_type == "application/pdf" else "image"
+                    try:
+                        ticket_bytes = decode_service.decode(kind, ticket_file.read())
+                    except decode_service.DecodeBusy as e:
+                        image_form.add_error("ticket", str(e))
+                        status = 503
+                    except aztec.AztecError as e:
+                        image_form.add_error("ticket", str(e))
 
     else:
         image_form = forms.TicketUploadForm()
@@ -94,7 +77,7 @@ def index(request):
     return render(request, "main/index.html", {
         "image_form": image_form,
         "error": error,
-    })
+    }, status=status)
 
 
 def view_ticket(request, pk):
@@ -55,6 +55,7 @@ def saarvv_login(request):
 def saarvv_logout(request):
     request.user.account.saarvv_token = None
     request.user.account.saarvv_device_id = None
+    request.user.account.saarvv_sync_state = {}
     request.user.account.save()
     messages.add_message(request, messages.SUCCESS, "Successfully logged out")
     return redirect("account")
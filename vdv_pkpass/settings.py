@@ -219,6 +219,17 @@ GWALLET_CONF = {
     "bahncard_pass_class": "pass.ch.magicalcodewit.vdv.bahncard",
 }
 
+TICKET_CACHE_MAX_BYTES = 64 * 1024 * 1024
+TICKET_CACHE_MAX_ENTRIES = 10000
+TICKET_CACHE_SHARED_ALIAS = os.getenv("TICKET_CACHE_SHARED_ALIAS")
+ASN1_CACHE_DIR = os.getenv("ASN1_CACHE_DIR", BASE_DIR / ".asn1-cache")
+
+DECODE_SERVICE_SOCKET = os.getenv("DECODE_SERVICE_SOCKET")
+DECODE_SERVICE_WORKERS = int(os.getenv("DECODE_SERVICE_WORKERS", "2"))
+DECODE_SERVICE_QUEUE_SIZE = int(os.getenv("DECODE_SERVICE_QUEUE_SIZE", "8"))
+DECODE_SERVICE_TIMEOUT = float(os.getenv("DECODE_SERVICE_TIMEOUT", "30"))
+DECODE_SERVICE_MEMORY_LIMIT = int(os.getenv("DECODE_SERVICE_MEMORY_LIMIT", str(1024 * 1024 * 1024)))
+
 AZTEC_JAR_PATH = BASE_DIR / "aztec-1.0.jar"
 
 LOGIN_URL = "magiclink:login"
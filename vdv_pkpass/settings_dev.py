@@ -206,6 +206,17 @@ GWALLET_CONF = {
     "bahncard_pass_class": "pass.ch.magicalcodewit.vdv.bahncard",
 }
 
+TICKET_CACHE_MAX_BYTES = 64 * 1024 * 1024
+TICKET_CACHE_MAX_ENTRIES = 10000
+TICKET_CACHE_SHARED_ALIAS = None
+ASN1_CACHE_DIR = BASE_DIR / ".asn1-cache"
+
+DECODE_SERVICE_SOCKET = None
+DECODE_SERVICE_WORKERS = 2
+DECODE_SERVICE_QUEUE_SIZE = 8
+DECODE_SERVICE_TIMEOUT = 30
+DECODE_SERVICE_MEMORY_LIMIT = 1024 * 1024 * 1024
+
 AZTEC_JAR_PATH = BASE_DIR / "aztec" / "target" / "aztec-1.0.jar"
 
 STORAGES = {